@@ -1,6 +1,9 @@
+import time
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from myConfig import MyConfig
-from myLogger import MyLogger
+from .services.jobLogger import JobLogger
 from .services.jobCfg import JobCfg
 
 # ---------------------------------------------------------------------------
@@ -22,15 +25,32 @@ job_cfg = JobCfg(default_filename)
 # 初始化job的全局日志
 # ---------------------------------------------------------------------------
 #
-log = MyLogger()
-log.initLogger(job_cfg.log_filename)
+log = JobLogger()
+log.initLogger(job_cfg.log_filename, level=job_cfg.log_level, max_length=job_cfg.log_max_length,
+               max_bytes=job_cfg.log_max_bytes, backup_count=job_cfg.log_backup_count, levels=job_cfg.log_levels,
+               sampling=job_cfg.log_sampling)
 
 # ---------------------------------------------------------------------------
 # 初始化app
 # ---------------------------------------------------------------------------
 #
 log.debug('------------Initiate app...------------')
-app = FastAPI()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    启动时才创建定时任务管理器(连接Redis、启动调度器)，停止时关闭。
+    """
+    t_start = time.perf_counter()
+    await job_api.startup()
+    log.info('------------App started, spend: %.3fs------------', time.perf_counter() - t_start)
+    yield
+    await job_api.shutdown()
+    JobLogger.stop()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # ---------------------------------------------------------------------------
 # 加载job相关api
@@ -1,4 +1,59 @@
+import functools
+import inspect
+import threading
+
 from ApiAuth import ApiAuth
 from .. import MyConfig, job_cfg, log
 
-api_auth = ApiAuth(MyConfig(job_cfg.auth_cfg_filename).config)
+
+class LazyApiAuth(object):
+    """
+    首次认证时才读取认证配置并创建ApiAuth，导入模块(注册路由)时不读取。
+    authentication与ApiAuth.authentication的参数相同，可直接作为FastAPI的依赖。
+    """
+    def __init__(self, cfg_filename: str):
+        """
+
+        :param cfg_filename: 认证配置文件；
+        """
+        self.cfg_filename = cfg_filename
+        self._api_auth = None
+        self._lock = threading.Lock()
+        self.authentication = self._delegate('authentication')
+
+    @property
+    def api_auth(self):
+        if self._api_auth is None:
+            with self._lock:
+                if self._api_auth is None:
+                    self._api_auth = ApiAuth(MyConfig(self.cfg_filename).config)
+        return self._api_auth
+
+    def _delegate(self, name: str):
+        """
+        调用时转给ApiAuth实例的同名方法，签名取自ApiAuth类(去掉self)。
+        :param name:
+        :return:
+        """
+        method = getattr(ApiAuth, name)
+        if inspect.iscoroutinefunction(method):
+            async def delegate(*args, **kwargs):
+                return await getattr(self.api_auth, name)(*args, **kwargs)
+        else:
+            def delegate(*args, **kwargs):
+                return getattr(self.api_auth, name)(*args, **kwargs)
+        functools.update_wrapper(delegate, method)
+        del delegate.__wrapped__
+        signature = inspect.signature(method)
+        if not isinstance(inspect.getattr_static(ApiAuth, name), staticmethod):
+            signature = signature.replace(parameters=list(signature.parameters.values())[1:])
+        delegate.__signature__ = signature
+        return delegate
+
+    def __getattr__(self, name: str):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.api_auth, name)
+
+
+api_auth = LazyApiAuth(job_cfg.auth_cfg_filename)
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException
+
+
+# ---------------------------------------------------------------------------
+# API同步调用线程池
+# ---------------------------------------------------------------------------
+#
+class ApiExecutor(object):
+    """
+    把同步的定时任务管理/Redis调用放到独立的有界线程池中执行，避免阻塞FastAPI的事件循环。
+    等待中的调用数超过max_pending时直接返回503，而不是无限排队。
+    """
+    def __init__(self, name: str, max_workers: int, max_pending: int):
+        """
+
+        :param name: 线程池名称，用于线程名前缀；
+        :param max_workers: 线程数；
+        :param max_pending: 允许同时提交(执行中+排队)的最大调用数；
+        """
+        self.name = name
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f'job-api-{name}')
+
+    async def run(self, func, *args, **kwargs):
+        """
+        在线程池中执行同步方法，并等待结果。
+        :param func:
+        :param args:
+        :param kwargs:
+        :return:
+        """
+        # 只在事件循环线程中修改，无需加锁
+        if self.pending >= self.max_pending:
+            raise HTTPException(status_code=503, detail=f'{self.name} executor is busy, pending: {self.pending}')
+
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+        finally:
+            self.pending -= 1
+
+    def stats(self):
+        """
+
+        :return:
+        """
+        return {'max_workers': self.max_workers, 'max_pending': self.max_pending, 'pending': self.pending}
+
+    def shutdown(self, wait=True):
+        """
+
+        :param wait:
+        :return:
+        """
+        self.executor.shutdown(wait=wait)
@@ -1,14 +1,24 @@
 # -*- coding: utf-8 -*-
-from fastapi import Depends
+import functools
+import json
+import threading
+
+from fastapi import Depends, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse, PlainTextResponse
 
 from myClassUtil import BasicApi
 from . import log, api_auth, job_cfg
+from .apiExecutor import ApiExecutor
+from .responseCache import ResponseCache
+from ..services.jobMetrics import metrics
+from ..requests import request_engine, request_limiters
 from ..services.jobCfg import JobOptType, SchedulerOptType
 from ..services.schedulerMgt import SchedulerMgt
 
 
 JOB_OPT_TYPE = JobOptType()
 SCHEDULER_OPT_TYPE = SchedulerOptType()
+API_CACHE = metrics.counter('api_cache_total', 'Read API responses by cache result.', ('endpoint', 'result'))
 
 class JobAPI(BasicApi):
     """
@@ -20,44 +30,287 @@ class JobAPI(BasicApi):
         """
         super().__init__(job_cfg.apis_cfg_filename)
 
-        if not self.log:
-            self.log = log
+        # 使用异步结构化日志，每个api一个子日志，可单独设置级别和采样
+        self.log = log
+        self.endpoint_logs = {}
 
-        self.scheduler_mgt = SchedulerMgt(job_cfg.scheduler_cfg_filename)
+        # 定时任务管理器在startup(或首次使用)时才创建，导入模块时不连接Redis、不启动调度器
+        self._scheduler_mgt = None
+        self._scheduler_mgt_lock = threading.Lock()
 
-    async def get_jobs_api(self, page_no: int, page_size: int,
-                           auth: str = Depends(api_auth.authentication)):
+        # 查询与变更分别使用独立的线程池，变更(如等待任务结束的停止操作)不会占满查询线程
+        self.read_executor = ApiExecutor('read', job_cfg.api_read_workers, job_cfg.api_max_pending)
+        self.write_executor = ApiExecutor('write', job_cfg.api_write_workers, job_cfg.api_max_pending)
+        # 查询结果按job存储版本号缓存，并作为ETag，版本号未变时轮询只需读取一次版本号
+        self.response_cache = ResponseCache(job_cfg.api_cache_size)
+
+        metrics.gauge('api_pending', 'API calls submitted to the API executors and not finished yet.',
+                      lambda: {('read',): self.read_executor.pending, ('write',): self.write_executor.pending},
+                      ('executor',))
+        metrics.gauge('request_slots_available', 'Free concurrency slots per downstream.',
+                      lambda: {(key,): stats['available'] for key, stats in request_limiters.stats().items()
+                               if stats['available'] is not None}, ('downstream',))
+        metrics.gauge('request_queued', 'Downstream requests waiting for the rate limiter.',
+                      lambda: {(key,): stats['queued'] for key, stats in request_limiters.stats().items()},
+                      ('downstream',))
+
+    def _endpoint_log(self, endpoint: str):
+        """
+        api的子日志，名称如 "job.JobAPI.get_jobs_api"。
+        :param endpoint:
+        :return:
         """
+        endpoint_log = self.endpoint_logs.get(endpoint)
+        if endpoint_log is None:
+            endpoint_log = self.endpoint_logs[endpoint] = self.log.getChild(f'JobAPI.{endpoint}')
+        return endpoint_log
 
+    async def _cached_query(self, endpoint: str, request: Request, key: tuple, func, *args):
+        """
+        带ETag的查询：If-None-Match与当前版本号一致时返回304；
+        否则优先返回同一版本号下缓存的响应体，没有缓存时才执行查询。
+        :param endpoint: api名称；
+        :param request:
+        :param key: 缓存key(查询参数)；
+        :param func: 查询方法，返回响应中的data；
+        :param args:
+        :return:
+        """
+        version = await self.read_executor.run(self.scheduler_mgt.get_version)
+        etag = ResponseCache.etag(version)
+        headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+
+        if ResponseCache.match_etag(request.headers.get('if-none-match'), etag):
+            API_CACHE.inc(endpoint, 'not_modified')
+            return Response(status_code=304, headers=headers)
+
+        body = self.response_cache.get(key, version)
+        if body is None:
+            API_CACHE.inc(endpoint, 'miss')
+            data = await self.read_executor.run(func, *args)
+            body = JSONResponse({'result': 'ok', 'data': data}).body
+            # 使用查询前读取的版本号，查询期间job有变化时下次请求会重新查询
+            self.response_cache.put(key, version, body)
+        else:
+            API_CACHE.inc(endpoint, 'hit')
+
+        self._endpoint_log(endpoint).debug('JobAPI.%s===>result: %s', endpoint, body)
+        return Response(body, media_type='application/json', headers=headers)
+
+    @property
+    def scheduler_mgt(self):
+        """
+        首次使用时创建定时任务管理器。
+        :return:
+        """
+        if self._scheduler_mgt is None:
+            with self._scheduler_mgt_lock:
+                if self._scheduler_mgt is None:
+                    self._scheduler_mgt = SchedulerMgt(job_cfg.scheduler_cfg_filename, job_cfg.scheduler_host)
+        return self._scheduler_mgt
+
+    def set_scheduler_mgt(self, scheduler_mgt: SchedulerMgt):
+        """
+        使用已创建的定时任务管理器(如基准测试中连接本地Redis的管理器)。
+        :param scheduler_mgt:
+        :return:
+        """
+        with self._scheduler_mgt_lock:
+            self._scheduler_mgt = scheduler_mgt
+
+    async def startup(self):
+        """
+        app启动(lifespan)时创建定时任务管理器。
+        :return:
+        """
+        await self.write_executor.run(lambda: self.scheduler_mgt)
+
+    async def shutdown(self):
+        """
+        app停止(lifespan)时停止调度器、请求引擎和线程池。
+        :return:
+        """
+        scheduler_mgt = self._scheduler_mgt
+        if scheduler_mgt is not None and scheduler_mgt.scheduler.running:
+            await self.write_executor.run(scheduler_mgt.stop_scheduler)
+        if scheduler_mgt is not None and scheduler_mgt.job_cluster is not None:
+            scheduler_mgt.job_cluster.stop()
+        # 正在执行的job结束后才释放调度进程租约，其它进程随即接管
+        if scheduler_mgt is not None and scheduler_mgt.job_leader is not None:
+            scheduler_mgt.job_leader.stop()
+        request_engine.shutdown()
+        self.read_executor.shutdown(wait=False)
+        self.write_executor.shutdown(wait=False)
+
+    def setup_routes(self, app):
+        """
+        注册配置文件中的api，以及内置的健康检查api。
+        :param app:
+        :return:
+        """
+        super().setup_routes(app)
+        app.add_api_route('/health', self.health_api, methods=['GET'])
+        app.add_api_route('/metrics', self.metrics_api, methods=['GET'])
+        app.add_api_route('/jobs/batch', self.add_jobs_api, methods=['POST'])
+        app.add_api_route('/jobs/export', self.export_jobs_api, methods=['GET'])
+        app.add_api_route('/jobs/simulate', self.simulate_jobs_api, methods=['POST'])
+        app.add_api_route('/jobs/fire-times', self.get_fire_times_api, methods=['GET'])
+        app.add_api_route('/jobs/fire-histogram', self.get_fire_histogram_api, methods=['GET'])
+        app.add_api_route('/jobs/history', self.get_job_history_api, methods=['GET'])
+
+    async def health_api(self):
+        """
+        健康检查：不访问Redis，也不进入线程池，只要事件循环未阻塞即可立即返回。
+        :return:
+        """
+        scheduler_mgt = self._scheduler_mgt
+        scheduler_state = scheduler_mgt.scheduler.state if scheduler_mgt is not None else None
+        return {'result': 'ok', 'data': {'scheduler_state': scheduler_state,
+                                         'read_executor': self.read_executor.stats(),
+                                         'write_executor': self.write_executor.stats()}}
+
+    async def metrics_api(self):
+        """
+        Prometheus文本格式的监控指标(部分指标采集时读取Redis，放在查询线程池中执行)。
+        :return:
+        """
+        content = await self.read_executor.run(metrics.render)
+        return PlainTextResponse(content, media_type='text/plain; version=0.0.4')
+
+    async def get_jobs_api(self, request: Request, page_no: int, page_size: int, sort_by: str = None,
+                           status: str = None, func: str = None, api_name: str = None, api_method: str = None,
+                           name_prefix: str = None, next_run_from: str = None, next_run_to: str = None,
+                           auth: str = Depends(api_auth.authentication)):
+        """
+        支持ETag/If-None-Match，job存储版本号未变时返回304或缓存的结果。
+        :param request:
         :param page_no:
         :param page_size:
+        :param sort_by: 排序方式: next_run_time(默认) or id
+        :param status: 过滤条件(可选，见SchedulerMgt.get_jobs): active or paused
+        :param func:
+        :param api_name:
+        :param api_method:
+        :param name_prefix:
+        :param next_run_from: 如 "2024-01-01 00:00:00"
+        :param next_run_to:
+        :param auth:
+        :return:
+        """
+        filters = {'status': status, 'func': func, 'api_name': api_name, 'api_method': api_method,
+                   'name_prefix': name_prefix, 'next_run_from': next_run_from, 'next_run_to': next_run_to}
+        self._endpoint_log('get_jobs_api').debug('JobAPI.get_jobs_api===>auth: %s', auth)
+        self._endpoint_log('get_jobs_api').info('JobAPI.get_jobs_api===>pageNo/Size: %s/%s, sort_by: %s, filters: %s',
+                                                page_no, page_size, sort_by, filters)
+
+        return await self._cached_query('get_jobs_api', request,
+                                        ('jobs', page_no, page_size, sort_by) + tuple(filters.values()),
+                                        functools.partial(self.scheduler_mgt.get_jobs, page_no, page_size, sort_by,
+                                                          **filters))
+
+    async def get_job_api(self, request: Request, job_id: str,
+                          auth: str = Depends(api_auth.authentication)):
+        """
+        支持ETag/If-None-Match，同get_jobs_api。
+        :param request:
+        :param job_id:
         :param auth:
         :return:
         """
-        self.log.debug(f'JobAPI.get_jobs_api===>auth: {auth}')
-        self.log.info(f'JobAPI.get_jobs_api===>pageNo/Size: {page_no}/{page_size}')
+        self._endpoint_log('get_job_api').debug('JobAPI.get_job_api===>auth: %s', auth)
+        self._endpoint_log('get_job_api').info('JobAPI.get_job_api===>job_id: %s', job_id)
+
+        return await self._cached_query('get_job_api', request, ('job', job_id),
+                                        self.scheduler_mgt.get_job, job_id)
 
-        jobs = self.scheduler_mgt.get_jobs(page_no, page_size)
-        result = {'result': 'ok', 'data': jobs}
+    async def export_jobs_api(self, auth: str = Depends(api_auth.authentication)):
+        """
+        以NDJSON逐行导出全部job，按批读取Redis，不在内存中汇总。
+        :param auth:
+        :return:
+        """
+        self._endpoint_log('export_jobs_api').debug('JobAPI.export_jobs_api===>auth: %s', auth)
+        self._endpoint_log('export_jobs_api').info('JobAPI.export_jobs_api===>start')
 
-        self.log.info(f'JobAPI.get_jobs_api===>result: {result}')
+        # 同步生成器由StreamingResponse在线程池中迭代，不阻塞事件循环
+        jobs = (json.dumps(job_info, ensure_ascii=False, default=str) + '\n'
+                for job_info in self.scheduler_mgt.export_jobs())
+        return StreamingResponse(jobs, media_type='application/x-ndjson',
+                                 headers={'Content-Disposition': 'attachment; filename="jobs.ndjson"'})
+
+    async def simulate_jobs_api(self, simulation: dict,
+                                auth: str = Depends(api_auth.authentication)):
+        """
+        模拟执行负载，如: {"jobs": [...], "include_store": true, "start": "2024-01-01 00:00:00", "seconds": 604800,
+                           "resolution": 60, "duration": 1, "durations": {"orderApi": 5}, "top": 10, "window": 60}
+        :param simulation: 参数见SchedulerMgt.simulate；
+        :param auth:
+        :return:
+        """
+        self._endpoint_log('simulate_jobs_api').debug('JobAPI.simulate_jobs_api===>auth: %s', auth)
+        self._endpoint_log('simulate_jobs_api').info('JobAPI.simulate_jobs_api===>jobs count: %s, seconds: %s',
+                                                      len(simulation.get('jobs') or []), simulation.get('seconds'))
+
+        result = await self.read_executor.run(self.scheduler_mgt.simulate, **simulation)
+        result = {'result': 'ok', 'data': result}
+
+        self._endpoint_log('simulate_jobs_api').debug('JobAPI.simulate_jobs_api===>peak: %s', result['data']['peak'])
         return result
 
-    async def get_job_api(self, job_id: str,
-                          auth: str = Depends(api_auth.authentication)):
+    async def get_fire_times_api(self, cron: str = None, job_id: str = None, count: int = 10,
+                                 auth: str = Depends(api_auth.authentication)):
         """
+        预览cron字符串或已有job的后续执行时间。
+        :param cron:
+        :param job_id:
+        :param count:
+        :param auth:
+        :return:
+        """
+        self._endpoint_log('get_fire_times_api').debug('JobAPI.get_fire_times_api===>auth: %s', auth)
+        self._endpoint_log('get_fire_times_api').info('JobAPI.get_fire_times_api===>cron: %s, job_id: %s, count: %s',
+                                                      cron, job_id, count)
+
+        fire_times = await self.read_executor.run(self.scheduler_mgt.get_fire_times, cron, job_id, count)
+        result = {'result': 'ok', 'data': fire_times}
+
+        self._endpoint_log('get_fire_times_api').debug('JobAPI.get_fire_times_api===>result: %s', result)
+        return result
+
+    async def get_fire_histogram_api(self, seconds: int = 60,
+                                     auth: str = Depends(api_auth.authentication)):
+        """
+        从下一整秒起每秒的执行次数，用于检查打散效果。
+        :param seconds:
+        :param auth:
+        :return:
+        """
+        self._endpoint_log('get_fire_histogram_api').debug('JobAPI.get_fire_histogram_api===>auth: %s', auth)
+        self._endpoint_log('get_fire_histogram_api').info('JobAPI.get_fire_histogram_api===>seconds: %s', seconds)
+
+        histogram = await self.read_executor.run(self.scheduler_mgt.get_fire_histogram, seconds)
+        result = {'result': 'ok', 'data': histogram}
 
+        self._endpoint_log('get_fire_histogram_api').debug('JobAPI.get_fire_histogram_api===>result: %s', result)
+        return result
+
+    async def get_job_history_api(self, job_id: str, count: int = 20,
+                                  auth: str = Depends(api_auth.authentication)):
+        """
+        job最近的执行记录及耗时/调度延迟的p50/p95/p99。
         :param job_id:
+        :param count:
         :param auth:
         :return:
         """
-        self.log.debug(f'JobAPI.get_job_api===>auth: {auth}')
-        self.log.info(f'JobAPI.get_job_api===>job_id: {job_id}')
+        self._endpoint_log('get_job_history_api').debug('JobAPI.get_job_history_api===>auth: %s', auth)
+        self._endpoint_log('get_job_history_api').info('JobAPI.get_job_history_api===>job_id: %s, count: %s',
+                                                       job_id, count)
 
-        jobs = self.scheduler_mgt.get_job(job_id)
-        result = {'result': 'ok', 'data': jobs}
+        history = await self.read_executor.run(self.scheduler_mgt.get_job_history, job_id, count)
+        result = {'result': 'ok', 'data': history}
 
-        self.log.info(f'JobAPI.get_job_api===>result: {result}')
+        self._endpoint_log('get_job_history_api').debug('JobAPI.get_job_history_api===>result: %s', result)
         return result
 
     async def add_job_api(self, job: dict,
@@ -68,15 +321,31 @@ class JobAPI(BasicApi):
         :param auth:
         :return:
         """
-        self.log.debug(f'JobAPI.add_job_api===>auth: {auth}')
-        self.log.info(f'JobAPI.add_job_api===>job: {job}')
+        self._endpoint_log('add_job_api').debug('JobAPI.add_job_api===>auth: %s', auth)
+        self._endpoint_log('add_job_api').info('JobAPI.add_job_api===>job: %s', job)
 
-        self.scheduler_mgt.add_job(job)
+        await self.write_executor.run(self.scheduler_mgt.add_job, job)
         result = {'result': 'ok', 'data': 'ok'}
 
-        self.log.info(f'JobAPI.add_job_api===>result: {result}')
+        self._endpoint_log('add_job_api').debug('JobAPI.add_job_api===>result: %s', result)
         return result
 
+    async def add_jobs_api(self, jobs: list,
+                           auth: str = Depends(api_auth.authentication)):
+        """
+        批量添加job，以NDJSON逐行返回每个job的结果。
+        导入在变更线程池中全部完成后才开始返回结果，与客户端的读取速度及是否断开无关。
+        :param jobs:
+        :param auth:
+        :return:
+        """
+        self._endpoint_log('add_jobs_api').debug('JobAPI.add_jobs_api===>auth: %s', auth)
+        self._endpoint_log('add_jobs_api').info('JobAPI.add_jobs_api===>jobs count: %s', len(jobs))
+
+        results = await self.write_executor.run(lambda: list(self.scheduler_mgt.add_jobs(jobs)))
+        return StreamingResponse((json.dumps(result, ensure_ascii=False) + '\n' for result in results),
+                                 media_type='application/x-ndjson')
+
     async def opt_jobs_api(self, opt_jobs: dict,
                            auth: str = Depends(api_auth.authentication)):
         """
@@ -85,22 +354,22 @@ class JobAPI(BasicApi):
         :param auth:
         :return:
         """
-        self.log.debug(f'JobAPI.opt_jobs_api===>auth: {auth}')
-        self.log.info(f'JobAPI.opt_jobs_api===>opt_jobs: {opt_jobs}')
+        self._endpoint_log('opt_jobs_api').debug('JobAPI.opt_jobs_api===>auth: %s', auth)
+        self._endpoint_log('opt_jobs_api').info('JobAPI.opt_jobs_api===>opt_jobs: %s', opt_jobs)
 
         if opt_jobs["opt_type"] == JOB_OPT_TYPE.REMOVE:
-            self.scheduler_mgt.remove_jobs(opt_jobs['job_ids'])
+            data = await self.write_executor.run(self.scheduler_mgt.remove_jobs, opt_jobs['job_ids'])
         elif opt_jobs["opt_type"] == JOB_OPT_TYPE.PAUSE:
-            self.scheduler_mgt.pause_jobs(opt_jobs['job_ids'])
+            data = await self.write_executor.run(self.scheduler_mgt.pause_jobs, opt_jobs['job_ids'])
         elif opt_jobs["opt_type"] == JOB_OPT_TYPE.RESUME:
-            self.scheduler_mgt.resume_jobs(opt_jobs['job_ids'])
+            data = await self.write_executor.run(self.scheduler_mgt.resume_jobs, opt_jobs['job_ids'])
         elif opt_jobs["opt_type"] == JOB_OPT_TYPE.START_NOW:
-            self.scheduler_mgt.start_jobs(opt_jobs['job_ids'])
+            data = await self.write_executor.run(self.scheduler_mgt.start_jobs, opt_jobs['job_ids'])
         else:
             raise ValueError(f'undefined opt_type: {opt_jobs["opt_type"]}')
-        result = {'result': 'ok', 'data': 'ok'}
+        result = {'result': 'ok', 'data': data}
 
-        self.log.info(f'JobAPI.opt_jobs_api===>result: {result}')
+        self._endpoint_log('opt_jobs_api').debug('JobAPI.opt_jobs_api===>result: %s', result)
         return result
 
     async def opt_scheduler_api(self, opt_type: str,
@@ -111,22 +380,22 @@ class JobAPI(BasicApi):
         :param auth:
         :return:
         """
-        self.log.debug(f'JobAPI.opt_jobs_api===>auth: {auth}')
-        self.log.info(f'JobAPI.opt_jobs_api===>opt_type: {opt_type}')
+        self._endpoint_log('opt_scheduler_api').debug('JobAPI.opt_scheduler_api===>auth: %s', auth)
+        self._endpoint_log('opt_scheduler_api').info('JobAPI.opt_scheduler_api===>opt_type: %s', opt_type)
 
         if opt_type == SCHEDULER_OPT_TYPE.START:
-            self.scheduler_mgt.start_scheduler()
+            await self.write_executor.run(self.scheduler_mgt.start_scheduler)
         elif opt_type == SCHEDULER_OPT_TYPE.STOP:
-            self.scheduler_mgt.stop_scheduler()
+            await self.write_executor.run(self.scheduler_mgt.stop_scheduler)
         elif opt_type == SCHEDULER_OPT_TYPE.STOP_NOW:
-            self.scheduler_mgt.stop_scheduler(False)
+            await self.write_executor.run(self.scheduler_mgt.stop_scheduler, False)
         elif opt_type == SCHEDULER_OPT_TYPE.RESUME:
-            self.scheduler_mgt.resume_scheduler()
+            await self.write_executor.run(self.scheduler_mgt.resume_scheduler)
         elif opt_type == SCHEDULER_OPT_TYPE.PAUSE:
-            self.scheduler_mgt.pause_scheduler()
+            await self.write_executor.run(self.scheduler_mgt.pause_scheduler)
         else:
             raise ValueError(f'undefined opt_type: {opt_type}')
         result = {'result': 'ok', 'data': 'ok'}
 
-        self.log.info(f'JobAPI.opt_scheduler_api===>result: {result}')
+        self._endpoint_log('opt_scheduler_api').debug('JobAPI.opt_scheduler_api===>result: %s', result)
         return result
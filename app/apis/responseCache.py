@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+import threading
+from collections import OrderedDict
+
+
+# ---------------------------------------------------------------------------
+# 查询结果缓存
+# ---------------------------------------------------------------------------
+#
+class ResponseCache(object):
+    """
+    按查询参数缓存序列化后的响应体，同时记录生成时job存储的版本号；
+    版本号变化后缓存自然失效，无需主动清理。LRU，线程安全。
+    """
+    def __init__(self, max_size: int):
+        """
+
+        :param max_size: 最多缓存的响应数；
+        """
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple, version: int):
+        """
+
+        :param key: 查询参数；
+        :param version: 当前版本号；
+        :return: 响应体，没有缓存或版本号不一致时返回None
+        """
+        with self._lock:
+            item = self._items.get(key)
+            if item is None or item[0] != version:
+                return None
+            self._items.move_to_end(key)
+            return item[1]
+
+    def put(self, key: tuple, version: int, body: bytes):
+        """
+
+        :param key: 查询参数；
+        :param version: 生成响应前读取的版本号；
+        :param body:
+        :return:
+        """
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._items[key] = (version, body)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    @staticmethod
+    def etag(version: int):
+        return f'"{version}"'
+
+    @staticmethod
+    def match_etag(if_none_match: str, etag: str):
+        """
+        If-None-Match是否与etag匹配(支持多个值、弱校验及"*")。
+        :param if_none_match:
+        :param etag:
+        :return:
+        """
+        if not if_none_match:
+            return False
+        for value in if_none_match.split(','):
+            value = value.strip()
+            if value == '*' or value.removeprefix('W/') == etag:
+                return True
+        return False
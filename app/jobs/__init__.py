@@ -1,2 +1,4 @@
-from ..requests.jobRequest import job_com_request
-from .. import log
+from ..requests.jobRequest import job_com_request, job_com_request_async
+from ..requests import request_engine, request_policies
+from ..requests.rateLimit import RequestRejected
+from .. import log, job_cfg
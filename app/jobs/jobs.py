@@ -1,19 +1,297 @@
-from . import job_com_request, log
-from myComUtil import FontColor, formatSeconds
+from . import job_com_request, job_com_request_async, request_engine, request_policies, RequestRejected, log, \
+    job_cfg
+from ..requests.forkSafe import ForkSafeThreadPoolExecutor
+from ..services.jobMetrics import JOB_RETRIES
+from myComUtil import formatSeconds
+import asyncio
 import datetime
+import functools
+import multiprocessing
+import time
 
+#: 异步job结束后的处理(执行历史、重试)在该线程池中执行，不占用请求引擎的事件循环
+_job_done_executor = ForkSafeThreadPoolExecutor(max_workers=4, thread_name_prefix='job-done')
 
-def start_job_by_api(api_call_str: str, api_para: dict=None):
+
+class JobRunError(Exception):
+    """
+    job执行失败，result中保存本次执行的时间和错误信息，供执行历史记录。
     """
+    def __init__(self, result: dict):
+        super().__init__(result['error'])
+        self.result = result
+
+    def __reduce__(self):
+        # 进程池执行器中需要把异常序列化回主进程
+        return self.__class__, (self.result,)
 
+
+def start_job_by_api(api_call_str: str, api_para: dict=None, policy: dict=None, attempt: int=1):
+    """
+    开启request-async时，请求提交到异步请求引擎后立即返回future，不占用调度器的工作线程；
+    在进程池执行器中运行时结果需可序列化，仍同步执行。
+    失败且策略允许重试时，结果中的retry_in为重试延迟，由调度器另行安排一次执行(见JobRetry)，不在此等待。
+    :param api_call_str:
+    :param api_para:
+    :param policy: job的请求策略，覆盖request-policies中的设置；
+    :param attempt: 第几次执行，重试时递增；
+    :return: 执行结果(见_job_result) or 结果的future
     """
     # 开始时间
     t_start = datetime.datetime.now()
-    log.info(f'JobByAPI==>{FontColor(api_call_str).green} start: {t_start}')
+    log.info('JobByAPI==>%s start: %s, attempt: %s', api_call_str, t_start, attempt)
 
-    job_com_request(api_call_str, api_para)
+    request_policy = request_policies.get_policy(api_call_str.split(':')[0], policy)
+    if job_cfg.request_async and multiprocessing.parent_process() is None:
+        future = request_engine.submit(
+            _start_job_by_api_async(api_call_str, api_para, request_policy, attempt, t_start))
+        future.add_done_callback(functools.partial(_log_future_end, api_call_str))
+        return future
 
-    # 结束时间
+    try:
+        response = job_com_request(api_call_str, api_para, request_policy)
+    except Exception as e:
+        result = _job_error_result(t_start, e, api_call_str, request_policy, attempt)
+        _log_job_end(api_call_str, result)
+        raise JobRunError(result) from e
+
+    result = _job_result(t_start, response, attempt=attempt)
+    _log_job_end(api_call_str, result)
+    return result
+
+
+async def _start_job_by_api_async(api_call_str: str, api_para: dict, request_policy, attempt: int,
+                                  t_start: datetime.datetime):
+    """
+
+    """
+    try:
+        response = await job_com_request_async(api_call_str, api_para, request_policy)
+    except Exception as e:
+        raise JobRunError(_job_error_result(t_start, e, api_call_str, request_policy, attempt)) from e
+    return _job_result(t_start, response, attempt=attempt)
+
+
+# ---------------------------------------------------------------------------
+# 组合job：一次执行多个下游请求
+# ---------------------------------------------------------------------------
+#
+def start_jobs_by_api(calls: list, max_parallel: int=None, policy: dict=None, attempt: int=1):
+    """
+    一个job按依赖顺序执行多个下游请求，calls中的每项为:
+        {"id": "order", "api_call_str": "orderApi:create", "api_para": {...}, "after": ["user"],
+         "inputs": {"userId": "user.data.id"}, "policy": {...}}
+    after中的请求成功后才执行，互不依赖的请求在异步请求引擎中并发执行，最多max_parallel个；
+    inputs把上游请求响应(JSON)中的字段传入本请求的参数: 参数名 ==> "<上游id>.<字段>...."，上游自动作为依赖；
+    某个请求失败时依赖它的请求不再执行，其它请求照常执行，job结果为失败，重试时重新执行全部请求。
+    开启request-async时同start_job_by_api立即返回future，否则当前线程等待全部请求结束。
+    :param calls:
+    :param max_parallel: 最多同时执行的请求数，None为不限制(仍受每个下游的限流控制)；
+    :param policy: job的请求策略，请求中的policy优先；
+    :param attempt: 第几次执行；
+    :return: 执行结果(calls中为每个请求的结果) or 结果的future
+    """
+    t_start = datetime.datetime.now()
+    ordered_calls = check_api_calls({'calls': calls, 'max_parallel': max_parallel})
+    label = '[' + ','.join(call_id for call_id, _, _ in ordered_calls) + ']'
+    log.info('JobByAPIs==>%s start: %s, attempt: %s', label, t_start, attempt)
+
+    future = request_engine.submit(_run_api_calls(ordered_calls, max_parallel, policy, attempt, t_start))
+    if job_cfg.request_async and multiprocessing.parent_process() is None:
+        future.add_done_callback(functools.partial(_log_future_end, label))
+        return future
+
+    try:
+        return future.result()
+    finally:
+        _log_future_end(label, future)
+
+
+def check_api_calls(para: dict):
+    """
+    校验组合job的参数：id唯一、依赖存在且无环。
+    :param para: start_jobs_by_api的参数；
+    :return: 按依赖排序的 [(id, call, 依赖的id)]
+    """
+    calls = para.get('calls')
+    if not isinstance(calls, list) or not calls:
+        raise ValueError('calls must be a non-empty list!')
+    max_parallel = para.get('max_parallel')
+    if max_parallel is not None and (not isinstance(max_parallel, int) or max_parallel < 1):
+        raise ValueError(f'max_parallel must be a positive integer! input: {max_parallel}')
+
+    deps = {}
+    for i, call in enumerate(calls):
+        if not isinstance(call, dict) or ':' not in str(call.get('api_call_str', '')):
+            raise ValueError(f'call must have an api_call_str like "api_name:method"! input: {call}')
+        call_id = str(call.get('id', i))
+        if call_id in deps:
+            raise ValueError(f'duplicate call id: {call_id}')
+        inputs = call.get('inputs') or {}
+        deps[call_id] = set(call.get('after') or []) | {str(path).split('.')[0] for path in inputs.values()}
+
+    calls_by_id = {str(call.get('id', i)): call for i, call in enumerate(calls)}
+    for call_id, call_deps in deps.items():
+        unknown = call_deps - set(deps) or call_deps & {call_id}
+        if unknown:
+            raise ValueError(f'call {call_id} depends on unknown calls: {sorted(unknown)}')
+
+    # 拓扑排序
+    ordered = []
+    done = set()
+    while len(ordered) < len(deps):
+        ready = [call_id for call_id, call_deps in deps.items() if call_id not in done and call_deps <= done]
+        if not ready:
+            raise ValueError(f'calls have a dependency cycle: {sorted(set(deps) - done)}')
+        for call_id in ready:
+            ordered.append((call_id, calls_by_id[call_id], deps[call_id]))
+            done.add(call_id)
+    return ordered
+
+
+async def _run_api_calls(ordered_calls: list, max_parallel: int, policy: dict, attempt: int,
+                         t_start: datetime.datetime):
+    """
+    按依赖启动全部请求，每个请求等待其依赖结束后执行。
+    """
+    slots = asyncio.Semaphore(max_parallel or len(ordered_calls))
+    tasks = {}
+    results = {}
+    responses = {}
+    errors = []
+
+    async def run_call(call_id: str, call: dict, call_deps: set):
+        if call_deps:
+            await asyncio.wait([tasks[dep] for dep in call_deps])
+            failed = sorted(dep for dep in call_deps if results[dep]['status'] != 'ok')
+            if failed:
+                results[call_id] = {'status': 'skipped', 'error': f'dependency failed: {failed}'}
+                return
+
+        api_call_str = call['api_call_str']
+        request_policy = request_policies.get_policy(api_call_str.split(':')[0],
+                                                     dict(policy or {}, **(call.get('policy') or {})))
+        t_call = time.perf_counter()
+        try:
+            api_para = dict(call.get('api_para') or {}, **{
+                name: _response_value(responses, path) for name, path in (call.get('inputs') or {}).items()})
+            async with slots:
+                response = await job_com_request_async(api_call_str, api_para, request_policy)
+        except Exception as e:
+            errors.append((e, api_call_str, request_policy))
+            results[call_id] = {'status': 'error', 'error': repr(e),
+                                'duration_us': round((time.perf_counter() - t_call) * 1000000)}
+            return
+
+        responses[call_id] = response
+        results[call_id] = {'status': 'ok', 'status_code': getattr(response, 'status_code', None),
+                            'duration_us': round((time.perf_counter() - t_call) * 1000000)}
+
+    for call_id, call, call_deps in ordered_calls:
+        tasks[call_id] = asyncio.ensure_future(run_call(call_id, call, call_deps))
+    await asyncio.gather(*tasks.values())
+
+    calls = {call_id: results[call_id] for call_id, _, _ in ordered_calls}
+    if errors:
+        error, api_call_str, request_policy = errors[0]
+        result = dict(_job_error_result(t_start, error, api_call_str, request_policy, attempt), calls=calls)
+        raise JobRunError(result) from error
+    return dict(_job_result(t_start, attempt=attempt), calls=calls)
+
+
+def _response_value(responses: dict, path: str):
+    """
+    "<上游id>.<字段>...." ==> 上游响应(JSON)中的值，列表按下标取值。
+    """
+    call_id, *keys = str(path).split('.')
+    response = responses[call_id]
+    value = response.json() if callable(getattr(response, 'json', None)) else response
+    for key in keys:
+        value = value[int(key)] if isinstance(value, list) else value[key]
+    return value
+
+
+def _job_error_result(t_start: datetime.datetime, error: Exception, api_call_str: str, request_policy,
+                      attempt: int):
+    """
+    失败结果，按策略计算重试延迟；熔断中的下游不再重试，由下次定时执行探测恢复。
+    """
+    retry_in = None
+    if not (isinstance(error, RequestRejected) and error.reason == 'circuit_open'):
+        retry_in = request_policy.retry_delay(attempt)
+    if retry_in is not None:
+        JOB_RETRIES.inc(api_call_str.split(':')[0])
+    return _job_result(t_start, error=error, attempt=attempt, retry_in=retry_in)
+
+
+def _job_result(t_start: datetime.datetime, response=None, error: Exception=None, attempt: int=1,
+                retry_in: float=None):
+    """
+    本次执行结果: 开始/结束时间戳(秒)、耗时(微秒)、下游状态、错误信息、第几次执行及重试延迟(秒)。
+    """
     t_end = datetime.datetime.now()
     t_spend = t_end - t_start
-    log.info(f'JobByAPI==>{FontColor(api_call_str).red} end: {t_end}, spend：{formatSeconds(t_spend.seconds)}')
+    return {
+        'start': t_start.timestamp(),
+        'end': t_end.timestamp(),
+        'duration_us': t_spend // datetime.timedelta(microseconds=1),
+        'status': 'error' if error is not None else 'ok',
+        'status_code': getattr(response, 'status_code', None),
+        'error': repr(error) if error is not None else None,
+        'attempt': attempt,
+        'retry_in': retry_in,
+    }
+
+
+def get_job_result(future):
+    """
+    从异步执行的future中取执行结果，失败时取JobRunError中的结果。
+    """
+    error = future.exception()
+    if error is None:
+        return future.result()
+    if isinstance(error, JobRunError):
+        return error.result
+    return {'status': 'error', 'error': repr(error)}
+
+
+def on_job_done(future, callback):
+    """
+    异步执行的job结束后，在独立线程中调用callback(执行结果)。
+    future的回调在请求引擎的事件循环线程中执行，回调中只提交任务，读写Redis等阻塞操作放到线程池中。
+    """
+    future.add_done_callback(lambda f: _job_done_executor.submit(_run_job_done, callback, get_job_result(f)))
+
+
+def _run_job_done(callback, result: dict):
+    """
+
+    """
+    try:
+        callback(result)
+    except Exception:
+        log.exception('JobByAPI==>job done callback failed')
+
+
+def _log_future_end(api_call_str: str, future):
+    """
+
+    """
+    _log_job_end(api_call_str, get_job_result(future))
+
+
+def _log_job_end(api_call_str: str, result: dict):
+    """
+
+    """
+    if result['status'] != 'ok':
+        log.error('JobByAPI==>%s error: %s', api_call_str, result['error'])
+        if result.get('retry_in') is not None:
+            log.warning('JobByAPI==>%s attempt %s failed, retry in %.1fs',
+                        api_call_str, result['attempt'], result['retry_in'])
+
+    # 结束时间
+    if 'end' in result:
+        t_end = datetime.datetime.fromtimestamp(result['end'])
+        log.info('JobByAPI==>%s end: %s, spend：%s',
+                 api_call_str, t_end, formatSeconds(result['duration_us'] // 1000000))
@@ -1,4 +1,43 @@
 from myRequestUtil import MyRequestConfig
 from .. import job_cfg
+from .asyncRequest import AsyncRequestEngine
+from .forkSafe import ForkSafeThreadPoolExecutor
+from .rateLimit import RequestLimiters
+from .requestPolicy import RequestPolicies, CircuitBreakers
+from .singleFlight import SingleFlight
+from ..services.jobMetrics import REQUEST_SECONDS
+import functools
+import time
 
-request = MyRequestConfig(job_cfg.requests_cfg_filename, job_cfg.servers_cfg_filename)
+
+@functools.lru_cache(maxsize=None)
+def get_request():
+    """
+    首次发起请求时才加载请求配置。
+    """
+    return MyRequestConfig(job_cfg.requests_cfg_filename, job_cfg.servers_cfg_filename)
+
+
+def timed_request(api_name, api_method_name, params):
+    """
+    发起请求并按api_name记录耗时。
+    """
+    t_start = time.perf_counter()
+    status = 'error'
+    try:
+        response = get_request().request(api_name=api_name, api_method_name=api_method_name, params=params)
+        status = str(getattr(response, 'status_code', 'ok'))
+        return response
+    finally:
+        REQUEST_SECONDS.observe(time.perf_counter() - t_start, api_name, status)
+
+
+request_limiters = RequestLimiters(job_cfg.request_limits, job_cfg.request_concurrency)
+request_engine = AsyncRequestEngine(timed_request, job_cfg.request_workers, request_limiters)
+request_policies = RequestPolicies(job_cfg.request_policies)
+# 异步请求中熔断、请求合并等状态的Redis读写在该线程池中执行，不阻塞请求引擎的事件循环
+state_executor = ForkSafeThreadPoolExecutor(max_workers=4, thread_name_prefix='job-request-state')
+# 熔断状态在定时任务管理器初始化后改为保存在job存储的Redis中
+circuit_breakers = CircuitBreakers()
+# 相同请求合并，同样在定时任务管理器初始化后改为跨节点合并
+single_flight = SingleFlight(executor=state_executor)
@@ -0,0 +1,133 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .forkSafe import at_fork_in_child
+from .rateLimit import RequestLimiters
+from .requestPolicy import RequestTimeout
+
+
+# ---------------------------------------------------------------------------
+# 异步请求执行引擎
+# ---------------------------------------------------------------------------
+#
+class AsyncRequestEngine(object):
+    """
+    在独立线程中运行一个事件循环，API类job提交后立即返回，不再占用调度器的工作线程。
+    每个下游(api_name)的限速、并发及排队由RequestLimiters控制，排队不占用线程。
+    实际的请求仍是同步的(MyRequestConfig)，每个下游(配置了server时为server)使用各自的请求线程池，
+    每个在途请求占用一个线程，某个下游无响应时只会占满它自己的线程池，不影响其他下游；
+    连接是否复用取决于request_func，引擎本身不维护连接池。
+    fork出的子进程(进程池执行器)不会继承事件循环线程，子进程中首次提交时重新启动。
+    """
+    def __init__(self, request_func, max_workers: int = 100, limiters: RequestLimiters = None):
+        """
+
+        :param request_func: 同步请求方法: request_func(api_name, api_method_name, params)；
+        :param max_workers: 每个下游请求线程池大小的上限，下游配置了max-concurrency时取两者中较小的；
+        :param limiters: 下游限流；
+        """
+        self.request_func = request_func
+        self.max_workers = max_workers
+        self.limiters = limiters or RequestLimiters()
+
+        self.loop = None
+        self.executors = {}
+        self._lock = threading.Lock()
+        at_fork_in_child(self._after_fork)
+
+    def _after_fork(self):
+        """
+        子进程中丢弃父进程的事件循环及请求线程池(其线程在子进程中不存在)。
+        :return:
+        """
+        self.loop = None
+        self.executors = {}
+        self._lock = threading.Lock()
+
+    def _start(self):
+        """
+        首次提交时才启动事件循环线程。
+        :return:
+        """
+        with self._lock:
+            if self.loop is not None:
+                return
+
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=self._run_loop, args=(loop,), name='job-request-loop', daemon=True).start()
+            self.loop = loop
+
+    @staticmethod
+    def _run_loop(loop):
+        """
+
+        :param loop:
+        :return:
+        """
+        asyncio.set_event_loop(loop)
+        loop.run_forever()
+
+    def submit(self, coro):
+        """
+        从任意线程提交协程到引擎的事件循环。
+        :param coro:
+        :return: concurrent.futures.Future
+        """
+        if self.loop is None:
+            self._start()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def _executor(self, api_name: str):
+        """
+        下游的请求线程池，首次请求该下游时创建。
+        :param api_name:
+        :return:
+        """
+        limiter = self.limiters.get_limiters(api_name)[-1]
+        executor = self.executors.get(limiter.key)
+        if executor is not None:
+            return executor
+
+        with self._lock:
+            executor = self.executors.get(limiter.key)
+            if executor is None:
+                max_workers = min(limiter.max_concurrency or self.max_workers, self.max_workers)
+                executor = self.executors[limiter.key] = ThreadPoolExecutor(
+                    max_workers=max_workers, thread_name_prefix=f'job-request-{limiter.key}')
+            return executor
+
+    async def request(self, api_name: str, api_method_name: str, params: dict = None, timeout: float = None):
+        """
+        在下游限流内发起请求。
+        :param api_name:
+        :param api_method_name:
+        :param params:
+        :param timeout: 超时(秒)，超时后抛出RequestTimeout；请求线程仍等待下游返回，
+                        限流名额在请求线程返回后才释放，因此无响应的下游不会占用超过其并发上限的线程；
+        :return:
+        """
+        async with self.limiters.acquire_async(api_name) as hold:
+            future = asyncio.get_running_loop().run_in_executor(
+                self._executor(api_name), self.request_func, api_name, api_method_name, params)
+            try:
+                return await asyncio.wait_for(asyncio.shield(future), timeout)
+            except asyncio.TimeoutError:
+                raise RequestTimeout(api_name, timeout) from None
+            finally:
+                if not future.done():
+                    hold(future)
+
+    def shutdown(self):
+        """
+
+        :return:
+        """
+        with self._lock:
+            if self.loop is None:
+                return
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            for executor in self.executors.values():
+                executor.shutdown(wait=False)
+            self.executors = {}
+            self.loop = None
@@ -0,0 +1,40 @@
+import os
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+
+# ---------------------------------------------------------------------------
+# fork后子进程中的重置
+# ---------------------------------------------------------------------------
+#
+def at_fork_in_child(method):
+    """
+    注册fork出的子进程(如进程池执行器)中调用的方法，用于丢弃从父进程继承的线程、锁及在途状态；
+    只保存弱引用，对象被回收后不再调用。不支持fork的平台上不做处理。
+    :param method: 绑定方法；
+    :return:
+    """
+    if not hasattr(os, 'register_at_fork'):
+        return
+    ref = weakref.WeakMethod(method)
+
+    def after_in_child():
+        child_method = ref()
+        if child_method is not None:
+            child_method()
+
+    os.register_at_fork(after_in_child=after_in_child)
+
+
+class ForkSafeThreadPoolExecutor(ThreadPoolExecutor):
+    """
+    子进程不会继承父进程线程池中的线程，继承的线程池提交任务后可能永远等待；fork后在子进程中重新初始化。
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._init_args = args, kwargs
+        at_fork_in_child(self._after_fork)
+
+    def _after_fork(self):
+        args, kwargs = self._init_args
+        ThreadPoolExecutor.__init__(self, *args, **kwargs)
@@ -1,11 +1,88 @@
-from . import request
+import asyncio
+import functools
 
+from . import timed_request, request_engine, request_limiters, request_policies, circuit_breakers, single_flight, \
+    state_executor
+from .rateLimit import RequestRejected
+from .requestPolicy import RequestPolicy
 
-def job_com_request(api_call: str, api_para: dict=None):
+
+def _split_api_call(api_call: str):
     """
-    通用发起请求方法。
+    "api_name:method" ==> (api_name, method)
     """
     api_calls = api_call.split(':')
-    api_name = api_calls[0]
-    api_method_name = api_calls[1]
-    return request.request(api_name=api_name, api_method_name=api_method_name, params=api_para)
+    return api_calls[0], api_calls[1]
+
+
+def job_com_request(api_call: str, api_para: dict=None, policy: RequestPolicy=None):
+    """
+    通用发起请求方法，受每个下游的限流及熔断控制。
+    设置了超时时请求在异步请求引擎中执行，当前线程最多等待timeout秒。
+    策略开启single_flight时，进行中的相同请求(同一api_call及参数)只发出一次，结果共用。
+    """
+    api_name, api_method_name = _split_api_call(api_call)
+    policy = policy or request_policies.get_policy(api_name)
+    if policy.single_flight:
+        return single_flight.run(single_flight.key(api_call, api_para), policy,
+                                 lambda: _request(api_name, api_method_name, api_para, policy))
+    return _request(api_name, api_method_name, api_para, policy)
+
+
+async def job_com_request_async(api_call: str, api_para: dict=None, policy: RequestPolicy=None):
+    """
+    通用发起请求方法(异步)，受每个下游的限流及熔断控制。
+    """
+    api_name, api_method_name = _split_api_call(api_call)
+    policy = policy or request_policies.get_policy(api_name)
+    if policy.single_flight:
+        return await single_flight.run_async(single_flight.key(api_call, api_para), policy,
+                                             lambda: _request_async(api_name, api_method_name, api_para, policy))
+    return await _request_async(api_name, api_method_name, api_para, policy)
+
+
+def _request(api_name: str, api_method_name: str, api_para: dict, policy: RequestPolicy):
+    """
+    实际发出请求(已合并的相同请求只有一个调用方执行)。
+    """
+    state = circuit_breakers.allow(api_name, policy)
+    try:
+        if policy.timeout:
+            response = request_engine.submit(
+                request_engine.request(api_name, api_method_name, api_para, policy.timeout)).result()
+        else:
+            with request_limiters.acquire(api_name):
+                response = timed_request(api_name, api_method_name, api_para)
+    except RequestRejected:
+        raise
+    except Exception:
+        circuit_breakers.record(api_name, policy, state, False)
+        raise
+    circuit_breakers.record(api_name, policy, state, True)
+    return response
+
+
+async def _request_async(api_name: str, api_method_name: str, api_para: dict, policy: RequestPolicy):
+    """
+    同_request(异步)。
+    """
+    state = await _breaker_call(circuit_breakers.allow, api_name, policy)
+    try:
+        response = await request_engine.request(api_name, api_method_name, api_para, policy.timeout)
+    except RequestRejected:
+        raise
+    except Exception:
+        await _breaker_call(circuit_breakers.record, api_name, policy, state, False)
+        raise
+    await _breaker_call(circuit_breakers.record, api_name, policy, state, True)
+    return response
+
+
+async def _breaker_call(func, api_name: str, policy: RequestPolicy, *args):
+    """
+    熔断状态保存在Redis中时，allow/record在state_executor中执行，不阻塞请求引擎的事件循环。
+    """
+    if not policy.breaker_failures or circuit_breakers.redis is None:
+        return func(api_name, policy, *args)
+    return await asyncio.get_running_loop().run_in_executor(
+        state_executor, functools.partial(func, api_name, policy, *args))
@@ -0,0 +1,352 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+
+from .forkSafe import at_fork_in_child
+from ..services.jobMetrics import REQUEST_WAIT_SECONDS, REQUEST_REJECTED
+
+
+class RequestRejected(Exception):
+    """
+    下游排队已满或等待超时，请求未发出(削峰)。
+    """
+    def __init__(self, key: str, reason: str):
+        super().__init__(f'request to {key} rejected: {reason}')
+        self.key = key
+        self.reason = reason
+
+
+# ---------------------------------------------------------------------------
+# 令牌桶
+# ---------------------------------------------------------------------------
+#
+class TokenBucket(object):
+    """
+    每秒补充rate个令牌，最多积攒burst个。令牌不足时预约之后的令牌并返回需等待的时间，
+    同一时刻到达的请求按1/rate的间隔依次放行，而不是同时打到下游。线程安全。
+    """
+    def __init__(self, rate: float, burst: float):
+        """
+
+        :param rate: 每秒令牌数；
+        :param burst: 桶容量(允许的突发请求数)；
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, max_delay: float = None):
+        """
+        预约一个令牌。
+        :param max_delay: 最长可等待时间(秒)，None为不限制；
+        :return: 需等待的秒数，超过max_delay时不预约并返回None
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+            delay = max(1 - self.tokens, 0) / self.rate
+            if max_delay is not None and delay > max_delay:
+                return None
+            self.tokens -= 1
+            return delay
+
+
+# ---------------------------------------------------------------------------
+# 下游限流
+# ---------------------------------------------------------------------------
+#
+class DownstreamLimiter(object):
+    """
+    单个下游(api_name或server)的限流：令牌桶限速 + 最大并发 + 有界排队。
+    同步请求(调度器工作线程)和异步请求引擎(事件循环)共用同一个并发计数，名额按排队顺序依次交给等待者：
+    同步等待者在各自的Event上等待，异步等待者在所在事件循环的future上等待。
+    """
+    def __init__(self, key: str, rate: float = None, burst: float = None, max_concurrency: int = None,
+                 max_queue: int = None, max_wait: float = None):
+        """
+
+        :param key: 下游名称；
+        :param rate: 每秒最多请求数，None为不限速；
+        :param burst: 允许的突发请求数，默认等于rate(至少为1)；
+        :param max_concurrency: 最大并发数，None为不限制；
+        :param max_queue: 最多排队(等待令牌或并发名额)的请求数，超过时直接拒绝，None为不限制；
+        :param max_wait: 最长排队时间(秒)，超过时拒绝，None为不限制；
+        """
+        self.key = key
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.bucket = TokenBucket(rate, burst or max(rate, 1)) if rate else None
+
+        self.queued = 0
+        self.in_flight = 0
+        # 等待并发名额的请求，元素为唤醒方法，释放名额时直接交给队首
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    def _enter(self):
+        with self._lock:
+            if self.max_queue is not None and self.queued >= self.max_queue:
+                REQUEST_REJECTED.inc(self.key, 'queue_full')
+                raise RequestRejected(self.key, 'queue_full')
+            self.queued += 1
+
+    def _leave(self):
+        with self._lock:
+            self.queued -= 1
+
+    def _remaining(self, t_start: float):
+        if self.max_wait is None:
+            return None
+        return max(t_start + self.max_wait - time.monotonic(), 0)
+
+    def _reject(self, reason: str):
+        REQUEST_REJECTED.inc(self.key, reason)
+        raise RequestRejected(self.key, reason)
+
+    def _rate_delay(self, t_start: float):
+        if self.bucket is None:
+            return 0
+        delay = self.bucket.reserve(self._remaining(t_start))
+        if delay is None:
+            self._reject('rate')
+        return delay
+
+    def _take_or_wait(self, wake):
+        """
+        有空闲名额且无人排队时直接占用，否则加入等待队列。
+        :param wake: 名额交给本请求时调用；
+        :return: 是否已占用名额
+        """
+        with self._lock:
+            if not self.max_concurrency or (self.in_flight < self.max_concurrency and not self._waiters):
+                self.in_flight += 1
+                return True
+            self._waiters.append(wake)
+            return False
+
+    def _cancel_wait(self, wake):
+        """
+        等待超时或取消。
+        :param wake:
+        :return: 名额是否在此之前已交给本请求
+        """
+        with self._lock:
+            try:
+                self._waiters.remove(wake)
+            except ValueError:
+                return True
+            return False
+
+    def acquire(self, t_start: float):
+        """
+        同步等待：先等令牌，再等并发名额。
+        :param t_start: 开始排队的时间(time.monotonic)；
+        :return:
+        """
+        self._enter()
+        try:
+            delay = self._rate_delay(t_start)
+            if delay:
+                time.sleep(delay)
+            event = threading.Event()
+            if not self._take_or_wait(event.set) and not event.wait(self._remaining(t_start)) \
+                    and not self._cancel_wait(event.set):
+                self._reject('timeout')
+        finally:
+            self._leave()
+
+    async def acquire_async(self, t_start: float):
+        """
+        同acquire，在调用方的事件循环中等待。
+        :param t_start:
+        :return:
+        """
+        self._enter()
+        try:
+            delay = self._rate_delay(t_start)
+            if delay:
+                await asyncio.sleep(delay)
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+
+            def wake():
+                loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+            if self._take_or_wait(wake):
+                return
+            try:
+                await asyncio.wait_for(asyncio.shield(future), self._remaining(t_start))
+            except asyncio.TimeoutError:
+                if not self._cancel_wait(wake):
+                    self._reject('timeout')
+            except asyncio.CancelledError:
+                if self._cancel_wait(wake):
+                    self.release()
+                raise
+        finally:
+            self._leave()
+
+    def release(self):
+        """
+        释放名额，有等待者时直接交给队首。
+        :return:
+        """
+        with self._lock:
+            wake = self._waiters.popleft() if self._waiters else None
+            if wake is None:
+                self.in_flight -= 1
+        if wake is not None:
+            wake()
+
+    def stats(self):
+        """
+
+        :return:
+        """
+        available = self.max_concurrency - self.in_flight if self.max_concurrency else None
+        return {'queued': self.queued, 'in_flight': self.in_flight, 'available': available}
+
+
+class RequestLimiters(object):
+    """
+    按api_name取限流器，配置了server的api同时受所属server的限流，如:
+        {"default": {"max-concurrency": 20, "max-queue": 1000, "max-wait": 60},
+         "apis": {"orderApi": {"rate": 50, "burst": 10, "server": "order-svc"}},
+         "servers": {"order-svc": {"max-concurrency": 30}}}
+    未单独配置的api使用default；max-concurrency未配置时兼容request-concurrency。
+    """
+    DEFAULT_KEY = 'default'
+
+    def __init__(self, limits: dict = None, concurrency: dict = None):
+        """
+
+        :param limits: 限流配置(request-limits)；
+        :param concurrency: 每个下游的并发上限(request-concurrency)，如: {"default": 20, "<api_name>": 5}；
+        """
+        limits = limits or {}
+        self.default_cfg = limits.get(self.DEFAULT_KEY, {})
+        self.api_cfgs = limits.get('apis', {})
+        self.server_cfgs = limits.get('servers', {})
+        self.concurrency = concurrency or {}
+
+        self.limiters = {}
+        self._api_limiters = {}
+        self._lock = threading.Lock()
+        at_fork_in_child(self._after_fork)
+
+    def _after_fork(self):
+        """
+        子进程中重新计数：父进程的在途请求及排队不属于子进程。
+        :return:
+        """
+        self.limiters = {}
+        self._api_limiters = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _create(key: str, cfg: dict):
+        return DownstreamLimiter(key, rate=cfg.get('rate'), burst=cfg.get('burst'),
+                                 max_concurrency=cfg.get('max-concurrency'), max_queue=cfg.get('max-queue'),
+                                 max_wait=cfg.get('max-wait'))
+
+    def get_limiters(self, api_name: str):
+        """
+
+        :param api_name:
+        :return: [api限流器, server限流器(如有)]
+        """
+        limiters = self._api_limiters.get(api_name)
+        if limiters is not None:
+            return limiters
+
+        with self._lock:
+            limiters = self._api_limiters.get(api_name)
+            if limiters is not None:
+                return limiters
+
+            api_cfg = dict(self.default_cfg, **self.api_cfgs.get(api_name, {}))
+            if api_cfg.get('max-concurrency') is None:
+                api_cfg['max-concurrency'] = self.concurrency.get(api_name, self.concurrency.get(self.DEFAULT_KEY))
+            limiters = [self.limiters.setdefault(api_name, self._create(api_name, api_cfg))]
+
+            server = api_cfg.get('server')
+            if server:
+                server_key = f'server:{server}'
+                if server_key not in self.limiters:
+                    self.limiters[server_key] = self._create(server_key, self.server_cfgs.get(server, {}))
+                limiters.append(self.limiters[server_key])
+
+            self._api_limiters[api_name] = limiters
+            return limiters
+
+    @contextmanager
+    def acquire(self, api_name: str):
+        """
+        同步请求：在限流内执行，排队时间记录到request_wait_seconds。
+        :param api_name:
+        :return:
+        """
+        t_start = time.monotonic()
+        acquired = []
+        try:
+            for limiter in self.get_limiters(api_name):
+                limiter.acquire(t_start)
+                acquired.append(limiter)
+            REQUEST_WAIT_SECONDS.observe(time.monotonic() - t_start, api_name)
+            yield
+        finally:
+            self._release(acquired)
+
+    @asynccontextmanager
+    async def acquire_async(self, api_name: str):
+        """
+        异步请求引擎中使用。
+        yield hold(future)：调用方不再等待仍在执行的请求(超时或取消)时，名额继续占用到future完成才释放。
+        :param api_name:
+        :return:
+        """
+        t_start = time.monotonic()
+        acquired = []
+        held = []
+        try:
+            for limiter in self.get_limiters(api_name):
+                await limiter.acquire_async(t_start)
+                acquired.append(limiter)
+            REQUEST_WAIT_SECONDS.observe(time.monotonic() - t_start, api_name)
+            yield held.append
+        finally:
+            if held:
+                held[0].add_done_callback(lambda future: self._release_held(future, acquired))
+            else:
+                self._release(acquired)
+
+    @staticmethod
+    def _release(acquired: list):
+        for limiter in reversed(acquired):
+            limiter.release()
+
+    @classmethod
+    def _release_held(cls, future, acquired: list):
+        """
+        调用方已放弃的请求完成后释放名额，其结果或异常不再有人读取。
+        :param future:
+        :param acquired:
+        :return:
+        """
+        if not future.cancelled():
+            future.exception()
+        cls._release(acquired)
+
+    def stats(self):
+        """
+
+        :return: {下游: {'queued', 'in_flight', 'available'}}
+        """
+        return {key: limiter.stats() for key, limiter in list(self.limiters.items())}
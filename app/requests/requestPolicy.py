@@ -0,0 +1,292 @@
+import random
+import threading
+import time
+
+from .forkSafe import at_fork_in_child
+from .rateLimit import RequestRejected
+from ..services.jobMetrics import REQUEST_REJECTED, CIRCUIT_OPENED
+
+
+class RequestTimeout(Exception):
+    """
+    下游请求超时(请求线程仍在等待下游，但调用方不再等待)。
+    """
+    def __init__(self, key: str, timeout: float):
+        super().__init__(f'request to {key} timed out after {timeout}s')
+        self.key = key
+        self.timeout = timeout
+
+
+# ---------------------------------------------------------------------------
+# 请求策略
+# ---------------------------------------------------------------------------
+#
+class RequestPolicy(object):
+    """
+    单次调用的超时、重试及熔断设置。
+    """
+    __slots__ = ('timeout', 'retries', 'backoff', 'backoff_max', 'jitter',
+                 'breaker_failures', 'breaker_window', 'breaker_open', 'single_flight', 'result_ttl')
+
+    def __init__(self, timeout: float = None, retries: int = 0, backoff: float = 1, backoff_max: float = 300,
+                 jitter: float = 1, breaker_failures: int = 0, breaker_window: float = 60, breaker_open: float = 30,
+                 single_flight: bool = False, result_ttl: float = 0):
+        """
+
+        :param timeout: 请求超时(秒)，None为不限制；
+        :param retries: 失败后最多重试次数，重试在backoff后作为单次job重新调度，不占用执行线程等待；
+        :param backoff: 第1次重试的基础延迟(秒)，之后每次翻倍；
+        :param backoff_max: 重试延迟上限(秒)；
+        :param jitter: 随机抖动比例[0, 1]：延迟在[base * (1 - jitter), base]内随机，1为完全随机；
+        :param breaker_failures: breaker_window秒内失败达到该次数时熔断，0为不熔断；
+        :param breaker_window: 失败计数窗口(秒)；
+        :param breaker_open: 熔断时间(秒)，之后只放行一个探测请求，成功则恢复，失败则继续熔断；
+        :param single_flight: 合并相同的请求(同一api_call及参数)，进行中的请求只发出一次，见SingleFlight；
+        :param result_ttl: 合并请求时成功结果的保留时间(秒)，期间的相同请求直接使用该结果，0为不保留；
+        """
+        if not 0 <= jitter <= 1:
+            raise ValueError(f'jitter must be between 0 and 1! input: {jitter}')
+        self.timeout = timeout
+        self.retries = int(retries)
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.jitter = jitter
+        self.breaker_failures = int(breaker_failures)
+        self.breaker_window = breaker_window
+        self.breaker_open = breaker_open
+        self.single_flight = bool(single_flight)
+        self.result_ttl = result_ttl
+
+    @classmethod
+    def from_cfg(cls, cfg: dict):
+        """
+        配置(kebab-case key) ==> RequestPolicy，有未知的key(如拼写错误)时抛出ValueError。
+        :param cfg:
+        :return:
+        """
+        kwargs = {key.replace('-', '_'): value for key, value in cfg.items()}
+        unknown = sorted(set(kwargs) - set(cls.__slots__))
+        if unknown:
+            raise ValueError(f'unknown request policy keys: {unknown}')
+        return cls(**kwargs)
+
+    def retry_delay(self, attempt: int):
+        """
+        第attempt次执行失败后，下次重试前的延迟(指数退避 + 抖动)。
+        :param attempt: 已执行次数，从1开始；
+        :return: 秒数，不再重试时返回None
+        """
+        if attempt > self.retries:
+            return None
+        base = min(self.backoff * 2 ** (attempt - 1), self.backoff_max)
+        return base * (1 - self.jitter * random.random())
+
+
+class RequestPolicies(object):
+    """
+    按api_name取请求策略，job中设置的policy覆盖api及默认设置，如:
+        {"default": {"timeout": 30, "retries": 2, "backoff": 5},
+         "apis": {"orderApi": {"timeout": 5, "breaker-failures": 10, "breaker-window": 60, "breaker-open": 30},
+                  "reportApi": {"single-flight": true, "result-ttl": 10}}}
+    """
+    DEFAULT_KEY = 'default'
+
+    def __init__(self, policies: dict = None):
+        """
+
+        :param policies: 请求策略配置(request-policies)；
+        """
+        policies = policies or {}
+        self.default_cfg = policies.get(self.DEFAULT_KEY, {})
+        self.api_cfgs = policies.get('apis', {})
+        self._policies = {}
+        # 加载配置时即校验，配置错误不会等到首次请求才发现
+        for api_name in self.api_cfgs:
+            self.get_policy(api_name)
+        RequestPolicy.from_cfg(self.default_cfg)
+
+    def get_policy(self, api_name: str, job_policy: dict = None):
+        """
+
+        :param api_name:
+        :param job_policy: job中设置的策略；
+        :return:
+        """
+        policy = self._policies.get(api_name)
+        if policy is None:
+            policy = self._policies.setdefault(
+                api_name, RequestPolicy.from_cfg(dict(self.default_cfg, **self.api_cfgs.get(api_name, {}))))
+        if not job_policy:
+            return policy
+        return RequestPolicy.from_cfg(dict(self.default_cfg, **self.api_cfgs.get(api_name, {}), **job_policy))
+
+
+# ---------------------------------------------------------------------------
+# 熔断
+# ---------------------------------------------------------------------------
+#
+class CircuitBreakers(object):
+    """
+    按api_name熔断：窗口内失败次数达到阈值后，熔断期内的请求直接拒绝(不占用限流名额和请求线程)；
+    熔断期结束后只放行一个探测请求，成功则恢复，失败则重新熔断。
+    设置了redis时熔断状态保存在Redis中，所有节点共享；否则只在本进程内生效。
+    状态为一个hash: failures--窗口内失败次数；open_until--熔断结束时间；probe_until--探测请求的截止时间。
+    """
+    #: 允许请求
+    CLOSED = 1
+    #: 熔断结束后的探测请求
+    PROBE = 2
+    #: 拒绝
+    OPEN = 0
+
+    #: 熔断中拒绝；熔断结束后同一时间只放行一个探测请求
+    ALLOW_SCRIPT = """
+        local open_until = tonumber(redis.call('HGET', KEYS[1], 'open_until') or '0')
+        local now = tonumber(ARGV[1])
+        if open_until == 0 then
+            return 1
+        end
+        if now < open_until then
+            return 0
+        end
+        if now < tonumber(redis.call('HGET', KEYS[1], 'probe_until') or '0') then
+            return 0
+        end
+        redis.call('HSET', KEYS[1], 'probe_until', now + tonumber(ARGV[2]))
+        return 2
+    """
+    #: 记录失败，达到阈值或探测失败时熔断，返回是否新熔断(熔断前已放行的请求失败不再计数)
+    FAILURE_SCRIPT = """
+        local now = tonumber(ARGV[1])
+        local open_seconds = tonumber(ARGV[4])
+        local failures = 0
+        if ARGV[5] ~= '1' then
+            if redis.call('HEXISTS', KEYS[1], 'open_until') == 1 then
+                return 0
+            end
+            failures = redis.call('HINCRBY', KEYS[1], 'failures', 1)
+            if failures == 1 then
+                redis.call('EXPIRE', KEYS[1], math.ceil(tonumber(ARGV[3])))
+            end
+        end
+        if ARGV[5] == '1' or failures >= tonumber(ARGV[2]) then
+            redis.call('DEL', KEYS[1])
+            redis.call('HSET', KEYS[1], 'open_until', now + open_seconds)
+            redis.call('EXPIRE', KEYS[1], math.ceil(open_seconds) + 3600)
+            return 1
+        end
+        return 0
+    """
+
+    def __init__(self, key_prefix: str = 'apscheduler.breaker', redis=None):
+        """
+
+        :param key_prefix: Redis key前缀，key为 "<key_prefix>:<api_name>"；
+        :param redis: Redis连接，None时只在本进程内熔断；
+        """
+        self.key_prefix = key_prefix
+        self.redis = redis
+        self._states = {}
+        self._lock = threading.Lock()
+        at_fork_in_child(self._after_fork)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+
+    def _key(self, api_name: str):
+        return f'{self.key_prefix}:{api_name}'
+
+    def allow(self, api_name: str, policy: RequestPolicy):
+        """
+        发起请求前检查，熔断中时抛出RequestRejected(reason为circuit_open)。
+        :param api_name:
+        :param policy:
+        :return: CLOSED or PROBE，请求结束后传给record
+        """
+        if not policy.breaker_failures:
+            return self.CLOSED
+
+        probe_ttl = policy.timeout or policy.breaker_open
+        if self.redis is not None:
+            state = self.redis.eval(self.ALLOW_SCRIPT, 1, self._key(api_name), time.time(), probe_ttl)
+        else:
+            state = self._local_allow(api_name, probe_ttl)
+
+        if state == self.OPEN:
+            REQUEST_REJECTED.inc(api_name, 'circuit_open')
+            raise RequestRejected(api_name, 'circuit_open')
+        return state
+
+    def record(self, api_name: str, policy: RequestPolicy, state: int, success: bool):
+        """
+        记录请求结果：窗口内的成功请求不写入，只有失败和探测结果才更新状态。
+        :param api_name:
+        :param policy:
+        :param state: allow的返回值；
+        :param success:
+        :return:
+        """
+        if not policy.breaker_failures:
+            return
+        probe = state == self.PROBE
+        if success:
+            if probe:
+                if self.redis is not None:
+                    self.redis.delete(self._key(api_name))
+                else:
+                    with self._lock:
+                        self._states.pop(api_name, None)
+            return
+
+        if self.redis is not None:
+            opened = self.redis.eval(self.FAILURE_SCRIPT, 1, self._key(api_name), time.time(),
+                                     policy.breaker_failures, policy.breaker_window, policy.breaker_open,
+                                     '1' if probe else '0')
+        else:
+            opened = self._local_failure(api_name, policy, probe)
+        if opened:
+            CIRCUIT_OPENED.inc(api_name)
+
+    def is_open(self, api_name: str):
+        """
+        是否在熔断期内(用于判断是否值得重试)。
+        :param api_name:
+        :return:
+        """
+        if self.redis is not None:
+            open_until = self.redis.hget(self._key(api_name), 'open_until')
+        else:
+            open_until = self._states.get(api_name, {}).get('open_until')
+        return open_until is not None and time.time() < float(open_until)
+
+    def _local_allow(self, api_name: str, probe_ttl: float):
+        """
+        同ALLOW_SCRIPT。
+        """
+        now = time.time()
+        with self._lock:
+            state = self._states.get(api_name)
+            if state is None or 'open_until' not in state:
+                return self.CLOSED
+            if now < state['open_until'] or now < state.get('probe_until', 0):
+                return self.OPEN
+            state['probe_until'] = now + probe_ttl
+            return self.PROBE
+
+    def _local_failure(self, api_name: str, policy: RequestPolicy, probe: bool):
+        """
+        同FAILURE_SCRIPT。
+        """
+        now = time.time()
+        with self._lock:
+            state = self._states.get(api_name)
+            if state is not None and 'open_until' in state and not probe:
+                return False
+            if state is None or state.get('expire', now) <= now:
+                state = self._states[api_name] = {'failures': 0, 'expire': now + policy.breaker_window}
+            if not probe:
+                state['failures'] += 1
+            if probe or state['failures'] >= policy.breaker_failures:
+                self._states[api_name] = {'open_until': now + policy.breaker_open}
+                return True
+            return False
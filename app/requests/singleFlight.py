@@ -0,0 +1,325 @@
+import asyncio
+import functools
+import hashlib
+import json
+import pickle
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+
+from .forkSafe import at_fork_in_child
+from .requestPolicy import RequestTimeout
+from ..services.jobMetrics import REQUEST_COALESCED
+
+
+class SharedRequestError(Exception):
+    """
+    其它节点发起的同一请求失败(只带回错误描述)。
+    """
+    def __init__(self, key: str, error: str):
+        super().__init__(f'shared request {key} failed: {error}')
+        self.key = key
+        self.error = error
+
+
+# ---------------------------------------------------------------------------
+# 相同请求合并
+# ---------------------------------------------------------------------------
+#
+class SingleFlight(object):
+    """
+    相同的下游请求(api_call + 参数的hash)同时只发出一次，其它调用方等待并共用结果：
+    本进程内的调用方等待同一个future；设置了redis时，各节点先用SET NX抢占请求锁，
+    未抢到的节点轮询抢到锁的节点写入的结果(pickle后的响应，或失败时的错误描述)。
+    结果无法pickle或抢到锁的节点退出时，等待的节点在锁释放(或过期)后自行发出请求；
+    策略设置了超时时，等待其它节点的时间超过timeout后抛出RequestTimeout。
+    result_ttl大于0时，成功的结果在本进程及Redis中保留result_ttl秒，期间的相同请求直接返回该结果。
+    异步请求的Redis读写在executor中执行，不阻塞请求引擎的事件循环。
+    """
+    #: 没有设置超时时请求锁的过期时间(秒)
+    LOCK_TTL = 300
+    #: 等待其它节点结果的轮询间隔(秒)
+    POLL_INTERVAL = 0.05
+    #: 本次结果在Redis中的保留时间(秒)，足够等待的节点读取
+    RESULT_GRACE = 10
+
+    #: 锁仍为本节点持有时，写入本次结果并释放锁
+    RELEASE_SCRIPT = """
+        if ARGV[2] ~= '' then
+            redis.call('SET', KEYS[2], ARGV[2], 'PX', ARGV[3])
+            if tonumber(ARGV[4]) > 0 then
+                redis.call('SET', KEYS[3], ARGV[2], 'PX', ARGV[4])
+            end
+        end
+        if redis.call('GET', KEYS[1]) == ARGV[1] then
+            redis.call('DEL', KEYS[1])
+        end
+        return 1
+    """
+
+    def __init__(self, key_prefix: str = 'apscheduler.flight', redis=None, executor=None):
+        """
+
+        :param key_prefix: Redis key前缀；
+        :param redis: Redis连接，None时只合并本进程内的请求；
+        :param executor: 异步请求中执行Redis读写的线程池，None时使用事件循环的默认线程池；
+        """
+        self.key_prefix = key_prefix
+        self.redis = redis
+        self.executor = executor
+        self._flights = {}
+        self._results = {}
+        self._lock = threading.Lock()
+        at_fork_in_child(self._after_fork)
+
+    def _after_fork(self):
+        """
+        子进程中不等待父进程的在途请求(其结果不会在子进程中返回)。
+        :return:
+        """
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(api_call: str, api_para: dict = None):
+        """
+        请求的合并key: "<api_name:method>:<参数的sha1>"，参数按key排序后序列化。
+        :param api_call:
+        :param api_para:
+        :return:
+        """
+        para_str = json.dumps(api_para or {}, sort_keys=True, ensure_ascii=False, separators=(',', ':'), default=str)
+        return f'{api_call}:{hashlib.sha1(para_str.encode("utf-8")).hexdigest()}'
+
+    def in_flight(self, keys: list):
+        """
+        正在进行(本进程或其它节点)的请求。
+        :param keys: 见key()；
+        :return: 其中正在进行的key
+        """
+        running = {key for key in keys if key in self._flights}
+        rest = [key for key in keys if key not in running]
+        if self.redis is None or not rest:
+            return running
+        with self.redis.pipeline(transaction=False) as pipe:
+            for key in rest:
+                pipe.exists(self._lock_key(key))
+            running.update(key for key, exists in zip(rest, pipe.execute()) if exists)
+        return running
+
+    def run(self, key: str, policy, request):
+        """
+        合并执行同步请求。
+        :param key: 见key()；
+        :param policy: RequestPolicy，使用其timeout及result_ttl；
+        :param request: 发出请求: request() ==> 响应；
+        :return: 响应
+        """
+        leader, future = self._join(key, policy.result_ttl)
+        if not leader:
+            return future.result()
+
+        try:
+            response = self._run_remote(key, policy, request)
+        except BaseException as e:
+            self._finish(key, future, policy.result_ttl, error=e)
+            raise
+        self._finish(key, future, policy.result_ttl, response)
+        return response
+
+    async def run_async(self, key: str, policy, request):
+        """
+        合并执行异步请求，同run。
+        :param key:
+        :param policy:
+        :param request: 发出请求: await request() ==> 响应；
+        :return:
+        """
+        leader, future = self._join(key, policy.result_ttl)
+        if not leader:
+            return await asyncio.wrap_future(future)
+
+        try:
+            response = await self._run_remote_async(key, policy, request)
+        except BaseException as e:
+            self._finish(key, future, policy.result_ttl, error=e)
+            raise
+        self._finish(key, future, policy.result_ttl, response)
+        return response
+
+    # -----------------------------------------------------------------------
+    # 本进程
+    # -----------------------------------------------------------------------
+    def _join(self, key: str, result_ttl: float):
+        """
+        加入本进程内的请求。
+        :return: (是否由调用方发出请求, future)
+        """
+        api_name = key.split(':')[0]
+        with self._lock:
+            cached = self._results.get(key)
+            if cached is not None:
+                if cached[0] > time.monotonic():
+                    REQUEST_COALESCED.inc(api_name, 'cached')
+                    future = Future()
+                    future.set_result(cached[1])
+                    return False, future
+                del self._results[key]
+
+            future = self._flights.get(key)
+            if future is not None:
+                REQUEST_COALESCED.inc(api_name, 'local')
+                return False, future
+            future = self._flights[key] = Future()
+            return True, future
+
+    def _finish(self, key: str, future: Future, result_ttl: float, response=None, error: BaseException = None):
+        with self._lock:
+            self._flights.pop(key, None)
+            if error is None and result_ttl:
+                self._results[key] = (time.monotonic() + result_ttl, response)
+                # 顺便清理过期的结果
+                if len(self._results) > 1000:
+                    now = time.monotonic()
+                    self._results = {k: v for k, v in self._results.items() if v[0] > now}
+        if error is None:
+            future.set_result(response)
+        else:
+            future.set_exception(error)
+
+    # -----------------------------------------------------------------------
+    # 跨节点
+    # -----------------------------------------------------------------------
+    def _run_remote(self, key: str, policy, request):
+        if self.redis is None:
+            return request()
+        deadline = time.monotonic() + policy.timeout if policy.timeout else None
+        while True:
+            token, acquired, shared = self._acquire(key, policy)
+            if shared is not None:
+                return self._unpack(key, shared)
+            if acquired:
+                try:
+                    response = request()
+                except Exception as e:
+                    self._release(key, token, policy, error=e)
+                    raise
+                self._release(key, token, policy, response)
+                return response
+            if token is None:
+                # 抢占时锁恰好被释放，重新抢占
+                continue
+
+            while True:
+                self._check_deadline(key, policy, deadline)
+                time.sleep(self.POLL_INTERVAL)
+                done, shared = self._poll(key, token)
+                if shared is not None:
+                    return self._unpack(key, shared)
+                if done:
+                    break
+
+    async def _run_remote_async(self, key: str, policy, request):
+        if self.redis is None:
+            return await request()
+        loop = asyncio.get_running_loop()
+        deadline = time.monotonic() + policy.timeout if policy.timeout else None
+        while True:
+            token, acquired, shared = await loop.run_in_executor(self.executor, self._acquire, key, policy)
+            if shared is not None:
+                return self._unpack(key, shared)
+            if acquired:
+                try:
+                    response = await request()
+                except Exception as e:
+                    await loop.run_in_executor(self.executor, functools.partial(
+                        self._release, key, token, policy, error=e))
+                    raise
+                await loop.run_in_executor(self.executor, self._release, key, token, policy, response)
+                return response
+            if token is None:
+                continue
+
+            while True:
+                self._check_deadline(key, policy, deadline)
+                await asyncio.sleep(self.POLL_INTERVAL)
+                done, shared = await loop.run_in_executor(self.executor, self._poll, key, token)
+                if shared is not None:
+                    return self._unpack(key, shared)
+                if done:
+                    break
+
+    @staticmethod
+    def _check_deadline(key: str, policy, deadline: float = None):
+        """
+        等待其它节点的结果超过策略的超时时间时抛出RequestTimeout。
+        """
+        if deadline is not None and time.monotonic() >= deadline:
+            raise RequestTimeout(key.split(':')[0], policy.timeout)
+
+    def _acquire(self, key: str, policy):
+        """
+        读取保留的结果，没有时抢占请求锁。SET NX与GET在同一事务中执行，未抢到时一定能读到持有者的token。
+        :return: (持有锁的token, 是否抢到, 保留的结果 or None)，token为None时需重新抢占
+        """
+        if policy.result_ttl:
+            shared = self.redis.get(self._result_key(key))
+            if shared is not None:
+                REQUEST_COALESCED.inc(key.split(':')[0], 'cached')
+                return None, False, shared
+
+        token = uuid.uuid4().hex
+        lock_ttl = policy.timeout * 2 if policy.timeout else self.LOCK_TTL
+        with self.redis.pipeline(transaction=True) as pipe:
+            pipe.set(self._lock_key(key), token, nx=True, px=int(lock_ttl * 1000))
+            pipe.get(self._lock_key(key))
+            acquired, holder = pipe.execute()
+        if acquired:
+            return token, True, None
+        if holder is None:
+            return None, False, None
+        REQUEST_COALESCED.inc(key.split(':')[0], 'remote')
+        return holder.decode('utf-8') if isinstance(holder, bytes) else holder, False, None
+
+    def _poll(self, key: str, token: str):
+        """
+        :return: (该次请求是否已结束, 结果 or None)
+        """
+        with self.redis.pipeline(transaction=False) as pipe:
+            pipe.get(self._flight_key(key, token))
+            pipe.get(self._lock_key(key))
+            shared, holder = pipe.execute()
+        if shared is not None:
+            return True, shared
+        holder = holder.decode('utf-8') if isinstance(holder, bytes) else holder
+        return holder != token, None
+
+    def _release(self, key: str, token: str, policy, response=None, error: Exception = None):
+        if error is not None:
+            data = pickle.dumps(('error', repr(error)))
+        else:
+            try:
+                data = pickle.dumps(('ok', response))
+            except Exception:
+                # 无法共享的结果，等待的节点自行请求
+                data = b''
+        result_ttl = int(policy.result_ttl * 1000) if error is None and data else 0
+        self.redis.eval(self.RELEASE_SCRIPT, 3, self._lock_key(key), self._flight_key(key, token),
+                        self._result_key(key), token, data, self.RESULT_GRACE * 1000, result_ttl)
+
+    @staticmethod
+    def _unpack(key: str, data: bytes):
+        status, value = pickle.loads(data)
+        if status == 'error':
+            raise SharedRequestError(key, value)
+        return value
+
+    def _lock_key(self, key: str):
+        return f'{self.key_prefix}:{key}'
+
+    def _flight_key(self, key: str, token: str):
+        return f'{self.key_prefix}:{key}:{token}'
+
+    def _result_key(self, key: str):
+        return f'{self.key_prefix}:{key}:result'
@@ -0,0 +1,414 @@
+import calendar
+import functools
+import re
+from bisect import bisect_left
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from apscheduler.triggers.base import BaseTrigger
+from apscheduler.util import astimezone, datetime_ceil
+
+from .cronSmear import SmearedTrigger
+
+
+# ---------------------------------------------------------------------------
+# 定时任务配置字符串编译
+# ---------------------------------------------------------------------------
+#
+class CompiledCron(object):
+    """
+    把"秒 分 时 日 月 周 [年]"格式的cron字符串编译为每个域的有序取值列表，语义同CronFiled的说明：
+        日(DayofMonth): 支持 L、L-n、nW、LW；
+        周(DayofWeek): 与APScheduler的CronTrigger相同，0~6或MON-SUN(0=MON)，
+                      支持 L(周日)、nL(当月最后一个周n)、n#k(当月第k个周n)；
+        ? 与 * 相同，日和周同时指定时两者都需满足。
+    周域的数字与普通表达式(CronFiledTrigger)含义一致，不因其它域是否使用了特殊字符而变化。
+    计算下次执行时间时逐域跳到下一个匹配值，而不是逐秒递增。
+    """
+    MIN_YEAR = 1970
+    MAX_YEAR = 2099
+    MONTH_NAMES = {name: i for i, name in enumerate(
+        ['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN', 'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC'], 1)}
+    WEEK_NAMES = {name: i for i, name in enumerate(['MON', 'TUE', 'WED', 'THU', 'FRI', 'SAT', 'SUN'])}
+    #: 日、周两个域中只有本引擎支持的字符，出现时add_job使用CompiledCronTrigger
+    QUARTZ_DAY_OF_MONTH_RE = re.compile(r'[?LW]')
+    QUARTZ_DAY_OF_WEEK_RE = re.compile(r'[?L#]')
+    #: 每个表达式缓存的月份日期数
+    MONTH_CACHE_SIZE = 1024
+
+    def __init__(self, cron_str: str):
+        """
+
+        :param cron_str:
+        """
+        self.cron_str = cron_str
+        cron_list = cron_str.split()
+        cron_len = len(cron_list)
+        if cron_len not in [6, 7]:
+            raise ValueError('Wrong number of fields; got {}, expected 6 or 7'.format(cron_len))
+
+        self.seconds = self._parse_field(cron_list[0], 0, 59)
+        self.minutes = self._parse_field(cron_list[1], 0, 59)
+        self.hours = self._parse_field(cron_list[2], 0, 23)
+        self._parse_day_of_month(cron_list[3])
+        self.months = self._parse_field(cron_list[4], 1, 12, self.MONTH_NAMES)
+        self._parse_day_of_week(cron_list[5])
+        self.years = self._parse_field(cron_list[6] if cron_len == 7 else '*', self.MIN_YEAR, self.MAX_YEAR)
+
+        self._month_days = {}
+
+    @classmethod
+    def is_quartz(cls, cron_str: str):
+        """
+        是否使用了APScheduler的cron触发器不支持的字符。
+        :param cron_str:
+        :return:
+        """
+        cron_list = cron_str.upper().split()
+        if len(cron_list) < 6:
+            return False
+        return cls.QUARTZ_DAY_OF_MONTH_RE.search(cron_list[3]) is not None \
+            or cls.QUARTZ_DAY_OF_WEEK_RE.search(cron_list[5]) is not None
+
+    # -----------------------------------------------------------------------
+    # 解析
+    # -----------------------------------------------------------------------
+    @staticmethod
+    def _parse_value(value: str, min_value: int, max_value: int, names: dict = None):
+        """
+
+        :param value:
+        :param min_value:
+        :param max_value:
+        :param names:
+        :return:
+        """
+        value = value.upper()
+        if names and value in names:
+            return names[value]
+        if not value.isdigit():
+            raise ValueError(f'Invalid cron value: {value}')
+
+        number = int(value)
+        if not min_value <= number <= max_value:
+            raise ValueError(f'Cron value {number} out of range {min_value}-{max_value}')
+        return number
+
+    @classmethod
+    def _parse_field(cls, expr: str, min_value: int, max_value: int, names: dict = None):
+        """
+        解析 , - * / ? 组成的域，返回有序取值列表。
+        :param expr:
+        :param min_value:
+        :param max_value:
+        :param names:
+        :return:
+        """
+        values = set()
+        for part in expr.split(','):
+            values.update(cls._parse_range(part, min_value, max_value, names))
+        return sorted(values)
+
+    @classmethod
+    def _parse_range(cls, part: str, min_value: int, max_value: int, names: dict = None):
+        """
+
+        :param part:
+        :param min_value:
+        :param max_value:
+        :param names:
+        :return:
+        """
+        has_step = '/' in part
+        if has_step:
+            part, step = part.split('/', 1)
+            step = int(step) if step.isdigit() else 0
+            if step <= 0:
+                raise ValueError(f'Invalid cron step: {part}/{step}')
+        else:
+            step = 1
+
+        if part in ('*', '?', ''):
+            start, end = min_value, max_value
+        elif '-' in part:
+            start, end = (cls._parse_value(v, min_value, max_value, names) for v in part.split('-', 1))
+        else:
+            start = cls._parse_value(part, min_value, max_value, names)
+            # "a/b" 表示从a开始每隔b(直到最大值)，"a" 表示单个值
+            end = max_value if has_step else start
+
+        if start > end:
+            raise ValueError(f'Invalid cron range: {part}')
+        return range(start, end + 1, step)
+
+    def _parse_day_of_month(self, expr: str):
+        """
+        日: 普通值 + L、L-n、nW、LW。
+        :param expr:
+        :return:
+        """
+        expr = expr.upper()
+        self.dom_any = expr in ('*', '?')
+        self.dom_values = set()
+        self.dom_last_offsets = set()
+        self.dom_nearest_weekdays = set()
+        self.dom_last_weekday = False
+        if self.dom_any:
+            return
+
+        for part in expr.split(','):
+            if part == 'LW':
+                self.dom_last_weekday = True
+            elif part.startswith('L'):
+                offset = part[2:] if part.startswith('L-') else part[1:]
+                if offset and not offset.isdigit():
+                    raise ValueError(f'Invalid day of month: {part}')
+                self.dom_last_offsets.add(self._parse_value(offset or '0', 0, 30))
+            elif part.endswith('W'):
+                self.dom_nearest_weekdays.add(self._parse_value(part[:-1], 1, 31))
+            elif 'C' in part:
+                raise ValueError(f'Unsupported day of month: {part}')
+            else:
+                self.dom_values.update(self._parse_range(part, 1, 31))
+
+    def _parse_day_of_week(self, expr: str):
+        """
+        周: 0~6或MON-SUN(0=MON，即python的weekday) + L、nL、n#k。
+        :param expr:
+        :return:
+        """
+        expr = expr.upper()
+        self.dow_any = expr in ('*', '?')
+        self.dow_values = set()
+        self.dow_last = set()
+        self.dow_nth = set()
+        if self.dow_any:
+            return
+
+        for part in expr.split(','):
+            if part == 'L':
+                # 一周的最后一天
+                self.dow_values.add(6)
+            elif part.endswith('L'):
+                self.dow_last.add(self._parse_value(part[:-1], 0, 6, self.WEEK_NAMES))
+            elif '#' in part:
+                week_day, nth = part.split('#', 1)
+                self.dow_nth.add((self._parse_value(week_day, 0, 6, self.WEEK_NAMES), self._parse_value(nth, 1, 5)))
+            elif 'C' in part:
+                raise ValueError(f'Unsupported day of week: {part}')
+            else:
+                self.dow_values.update(self._parse_range(part, 0, 6, self.WEEK_NAMES))
+
+    # -----------------------------------------------------------------------
+    # 计算
+    # -----------------------------------------------------------------------
+    def get_month_days(self, year: int, month: int):
+        """
+        某年某月满足日、周两个域的日期，有序列表，按(年, 月)缓存。
+        :param year:
+        :param month:
+        :return:
+        """
+        key = (year, month)
+        days = self._month_days.get(key)
+        if days is None:
+            days = self._compute_month_days(year, month)
+            if len(self._month_days) >= self.MONTH_CACHE_SIZE:
+                self._month_days.clear()
+            self._month_days[key] = days
+        return days
+
+    def _compute_month_days(self, year: int, month: int):
+        """
+
+        :param year:
+        :param month:
+        :return:
+        """
+        first_weekday, days_in_month = calendar.monthrange(year, month)
+        all_days = range(1, days_in_month + 1)
+
+        def weekday(d):
+            return (first_weekday + d - 1) % 7
+
+        if self.dom_any:
+            dom_days = set(all_days)
+        else:
+            dom_days = {d for d in self.dom_values if d <= days_in_month}
+            dom_days.update(days_in_month - offset for offset in self.dom_last_offsets if offset < days_in_month)
+            for d in self.dom_nearest_weekdays:
+                if d <= days_in_month:
+                    dom_days.add(self._nearest_weekday(d, days_in_month, weekday))
+            if self.dom_last_weekday:
+                dom_days.add(self._nearest_weekday(days_in_month, days_in_month, weekday))
+
+        if self.dow_any:
+            dow_days = set(all_days)
+        else:
+            dow_days = {d for d in all_days if weekday(d) in self.dow_values}
+            for week_day in self.dow_last:
+                dow_days.add(max(d for d in all_days if weekday(d) == week_day))
+            for week_day, nth in self.dow_nth:
+                matched = [d for d in all_days if weekday(d) == week_day]
+                if nth <= len(matched):
+                    dow_days.add(matched[nth - 1])
+
+        return sorted(dom_days & dow_days)
+
+    @staticmethod
+    def _nearest_weekday(day: int, days_in_month: int, weekday):
+        """
+        离指定日期最近的工作日，不跨月。
+        """
+        if weekday(day) == 5:
+            return day - 1 if day > 1 else day + 2
+        if weekday(day) == 6:
+            return day + 1 if day < days_in_month else day - 2
+        return day
+
+    @staticmethod
+    def _next_value(values: list, value: int):
+        """
+        values中不小于value的最小值，没有时返回None。
+        """
+        i = bisect_left(values, value)
+        return values[i] if i < len(values) else None
+
+    def next_wall_time(self, start: datetime):
+        """
+        不早于start(不带时区，精确到秒)的下一个匹配时间。
+        某个域没有匹配值时进位到上一级域，并把下级域置为最小值。
+        :param start:
+        :return:
+        """
+        year, month, day = start.year, start.month, start.day
+        hour, minute, second = start.hour, start.minute, start.second
+        next_value = self._next_value
+
+        while year <= self.MAX_YEAR:
+            value = next_value(self.years, year)
+            if value is None:
+                return None
+            if value != year:
+                year, month, day, hour, minute, second = value, 1, 1, 0, 0, 0
+
+            value = next_value(self.months, month)
+            if value is None:
+                year, month, day, hour, minute, second = year + 1, 1, 1, 0, 0, 0
+                continue
+            if value != month:
+                month, day, hour, minute, second = value, 1, 0, 0, 0
+
+            value = next_value(self.get_month_days(year, month), day)
+            if value is None:
+                month, day, hour, minute, second = month + 1, 1, 0, 0, 0
+                continue
+            if value != day:
+                day, hour, minute, second = value, 0, 0, 0
+
+            value = next_value(self.hours, hour)
+            if value is None:
+                day, hour, minute, second = day + 1, 0, 0, 0
+                continue
+            if value != hour:
+                hour, minute, second = value, 0, 0
+
+            value = next_value(self.minutes, minute)
+            if value is None:
+                hour, minute, second = hour + 1, 0, 0
+                continue
+            if value != minute:
+                minute, second = value, 0
+
+            value = next_value(self.seconds, second)
+            if value is None:
+                minute, second = minute + 1, 0
+                continue
+
+            return datetime(year, month, day, hour, minute, value)
+
+        return None
+
+
+@functools.lru_cache(maxsize=4096)
+def compile_cron(cron_str: str):
+    """
+    按cron字符串缓存编译结果。
+    :param cron_str:
+    :return:
+    """
+    return CompiledCron(cron_str)
+
+
+# ---------------------------------------------------------------------------
+# 基于编译结果的触发器
+# ---------------------------------------------------------------------------
+#
+class CompiledCronTrigger(SmearedTrigger, BaseTrigger):
+    """
+    APScheduler触发器，序列化时只保存cron字符串、时区及偏移，加载时从缓存中取编译结果。
+    """
+    __slots__ = 'cron_str', 'timezone', 'cron', 'offset'
+
+    def __init__(self, cron_str: str, timezone, offset: int = 0):
+        """
+
+        :param cron_str:
+        :param timezone:
+        :param offset: 执行时间后移的秒数(见SmearedTrigger)；
+        """
+        self.cron_str = cron_str
+        self.timezone = astimezone(timezone)
+        self.cron = compile_cron(cron_str)
+        self.offset = offset
+
+    def _next_fire_time(self, previous_fire_time, now):
+        """
+        与CronTrigger相同的起算方式；夏令时跳过的时间不触发。
+        :param previous_fire_time:
+        :param now:
+        :return:
+        """
+        if previous_fire_time:
+            start_date = min(now, previous_fire_time + timedelta(microseconds=1))
+            if start_date == previous_fire_time:
+                start_date += timedelta(microseconds=1)
+        else:
+            start_date = now
+
+        wall_time = datetime_ceil(start_date.astimezone(self.timezone)).replace(tzinfo=None)
+        while True:
+            wall_time = self.cron.next_wall_time(wall_time)
+            if wall_time is None:
+                return None
+
+            fire_time = self._localize(wall_time)
+            if fire_time is not None:
+                return fire_time
+            wall_time += timedelta(seconds=1)
+
+    def _localize(self, wall_time: datetime):
+        """
+        本地时间 ==> 带时区时间，本地时间不存在(夏令时跳过)时返回None。
+        :param wall_time:
+        :return:
+        """
+        if hasattr(self.timezone, 'localize'):
+            fire_time = self.timezone.normalize(self.timezone.localize(wall_time))
+        else:
+            fire_time = wall_time.replace(tzinfo=self.timezone).astimezone(dt_timezone.utc).astimezone(self.timezone)
+        return fire_time if fire_time.replace(tzinfo=None) == wall_time else None
+
+    def __getstate__(self):
+        return {'version': 1, 'cron_str': self.cron_str, 'timezone': self.timezone, 'offset': self.offset}
+
+    def __setstate__(self, state):
+        self.cron_str = state['cron_str']
+        self.timezone = state['timezone']
+        self.cron = compile_cron(self.cron_str)
+        self.offset = state.get('offset', 0)
+
+    def __str__(self):
+        return f"cron[{self.cron_str}]"
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} ({self.cron_str!r}, timezone='{self.timezone}')>"
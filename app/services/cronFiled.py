@@ -1,5 +1,9 @@
 import re
 
+from apscheduler.triggers.cron import CronTrigger
+
+from .cronSmear import SmearedTrigger
+
 
 # ---------------------------------------------------------------------------
 # 定时任务配置字符串解析
@@ -16,7 +20,7 @@ class CronFiled(object):
     小时(Hours)          0~23的整数                          , - * /    四个字符
     日期(DayofMonth)     1~31的整数(但是你需要考虑你月的天数)     ,- * ? / L W C     八个字符
     月份(Month)          1~12的整数或者 JAN-DEC               , - * /    四个字符
-    星期(DayofWeek)      1~7的整数或者 SUN-SAT (1=SUN)        , - * ? / L C #     八个字符
+    星期(DayofWeek)      0~6的整数或者 MON-SUN (0=MON)        , - * ? / L C #     八个字符
     年(可选，留空)(Year)   1970~2099                          , - * /    四个字符
     ————————————————
     每一个域可出现的字符如下:
@@ -25,7 +29,8 @@ class CronFiled(object):
     Hours(时):可出现", - * /"四个字符，有效范围为0-23的整数
     DayofMonth(日):可出现", - * / ? L C W"八个字符，有效范围为0-31的整数
     Month(月):可出现", - * /"四个字符，有效范围为1-12的整数或JAN-DEC
-    DayofWeek(周):可出现", - * / ? L C #"四个字符，有效范围为1-7的整数或SUN-SAT两个范围。1表示星期天，2表示星期一， 依次类推
+    DayofWeek(周):可出现", - * / ? L C #"四个字符，有效范围为0-6的整数或MON-SUN两个范围。0表示星期一，1表示星期二，依次类推，6表示星期天
+                 (与APScheduler的CronTrigger及python的weekday相同)
     Year(年):可出现", - * /"四个字符，有效范围为1970-2099年
     ————————————————
     每一个域都使用数字，但还可以出现如下特殊字符，它们的含义是：
@@ -38,12 +43,12 @@ class CronFiled(object):
         -  表示范围，例如在Minutes域使用5-20，表示从5分到20分钟每分钟触发一次 。
         /  表示起始时间开始触发，然后每隔固定时间触发一次，例如在Minutes域使用5/20,则意味着5分钟触发一次，而25，45等分别触发一次。
         ,  表示列出枚举值值。例如：在Minutes域使用5,20，则意味着在5和20分每分钟触发一次。
-        L  表示最后，只能出现在DayofWeek和DayofMonth域，如果在DayofWeek域使用5L,意味着在每月的最后一个星期四触发。
+        L  表示最后，只能出现在DayofWeek和DayofMonth域，如果在DayofWeek域使用3L,意味着在每月的最后一个星期四触发。
         W  表示有效工作日(周一到周五),只能出现在DayofMonth域，系统将在离指定日期的最近的有效工作日触发事件。
            例如：在 DayofMonth使用5W，如果5日是星期六，则将在最近的工作日：星期五，即4日触发。
            如果5日是星期天，则在6日(周一)触发；如果5日在星期一到星期五中的一天，则就在5日触发。另外一点，W的最近寻找不会跨过月份。
         LW 这两个字符可以连用，表示在某个月最后一个工作日，即最后一个星期五。
-        #  用于确定每个月第几个星期几，只能出现在DayofMonth域。例如在4#2，表示某月的第二个星期三。
+        #  用于确定每个月第几个星期几，只能出现在DayofWeek域。例如在2#2，表示某月的第二个星期三。
     ————————————————
     """
 
@@ -84,7 +89,7 @@ class CronFiled(object):
         """
         key_desc = {'year': '年', 'day_of_week': '周', 'month': '月',
                    'day': '日', 'hour': '小时', 'minute': '分钟', 'second': '秒'}
-        week_desc = {'0': '周日', '1': '周一', '2': '周二', '3': '周三', '4': '周四', '5': '周五', '6': '周六'}
+        week_desc = {'0': '周一', '1': '周二', '2': '周三', '3': '周四', '4': '周五', '5': '周六', '6': '周日'}
 
         self.cronDesc = ''
         for key in key_desc:
@@ -119,4 +124,32 @@ class TiggerCronStr(object):
 
         # 根据字段顺序重组字符串
         cron_parts = {key: value for key, value in matches}
-        self.fmt_cron_str = " ".join(cron_parts.get(field, "*") for field in field_order)
\ No newline at end of file
+        self.fmt_cron_str = " ".join(cron_parts.get(field, "*") for field in field_order)
+
+
+class CronFiledTrigger(SmearedTrigger, CronTrigger):
+    """
+    APScheduler的cron触发器，额外保存添加job时的原始cron字符串，展示时不再从str(trigger)反解析；
+    offset不为0时执行时间整体后移offset秒(见SmearedTrigger)。
+    """
+    __slots__ = 'cron_str', 'offset'
+
+    def __init__(self, cron_str, timezone, offset: int = 0):
+        cron_dict = CronFiled(cron_str).cron
+        super().__init__(timezone=timezone, **cron_dict)
+        self.cron_str = cron_str
+        self.offset = offset
+
+    def _next_fire_time(self, previous_fire_time, now):
+        return CronTrigger.get_next_fire_time(self, previous_fire_time, now)
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state['cron_str'] = self.cron_str
+        state['offset'] = self.offset
+        return state
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self.cron_str = state.get('cron_str')
+        self.offset = state.get('offset', 0)
@@ -0,0 +1,60 @@
+import zlib
+from datetime import timedelta
+
+from apscheduler.util import utc
+
+
+# ---------------------------------------------------------------------------
+# 执行时间打散
+# ---------------------------------------------------------------------------
+#
+def smear_offset(job_id: str, window: int):
+    """
+    由job id确定的偏移秒数，在[0, window)内均匀分布；同一个job在任何节点、任何时候计算结果都相同。
+    :param job_id:
+    :param window: 打散窗口(秒)，0为不打散；
+    :return:
+    """
+    if not window or window <= 0:
+        return 0
+    return zlib.crc32(job_id.encode('utf-8')) % int(window)
+
+
+def smear_window(smear, default: int):
+    """
+    job的打散窗口：未设置时使用默认窗口；false/0为不打散；true使用默认窗口；数值为窗口秒数。
+    :param smear: job中的smear设置；
+    :param default: 默认打散窗口(smear-window)；
+    :return:
+    """
+    if smear is None or smear is True:
+        return default
+    if smear is False:
+        return 0
+    window = int(smear)
+    if window < 0:
+        raise ValueError(f'smear must be a non-negative number of seconds! input: {smear}')
+    return window
+
+
+class SmearedTrigger(object):
+    """
+    cron触发器的执行时间整体后移offset秒：每次执行时间 = cron计算的时间 + offset，执行周期不变。
+    子类需定义offset和timezone属性，并实现_next_fire_time(不含偏移的下次执行时间)。
+    """
+    __slots__ = ()
+
+    def get_next_fire_time(self, previous_fire_time, now):
+        offset = getattr(self, 'offset', 0)
+        if not offset:
+            return self._next_fire_time(previous_fire_time, now)
+
+        delta = timedelta(seconds=offset)
+        fire_time = self._next_fire_time(previous_fire_time - delta if previous_fire_time else None, now - delta)
+        if fire_time is None:
+            return None
+        # 按utc偏移，跨夏令时切换时仍是准确的offset秒
+        return (fire_time.astimezone(utc) + delta).astimezone(self.timezone)
+
+    def _next_fire_time(self, previous_fire_time, now):
+        raise NotImplementedError
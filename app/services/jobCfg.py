@@ -1,3 +1,5 @@
+import os
+
 from myConfig import MyConfig
 
 
@@ -16,6 +18,64 @@ class JobTriggerType(object):
         self.BACKGROUND = "Background"
 
 
+# ---------------------------------------------------------------------------
+# 定时任务执行器类型设置
+# ---------------------------------------------------------------------------
+#
+class JobExecutorType(object):
+    """
+    executor type: 执行器类型。thread--线程池；process--进程池；
+    """
+    def __init__(self):
+        #: thread--线程池
+        self.THREAD = "thread"
+        #: process--进程池
+        self.PROCESS = "process"
+
+
+# ---------------------------------------------------------------------------
+# 定时任务状态设置
+# ---------------------------------------------------------------------------
+#
+class JobStatusType(object):
+    """
+    Job status: 按状态过滤job列表
+    """
+    def __init__(self):
+        #: 有下次执行时间的job
+        self.ACTIVE = "active"
+        #: 暂停的job
+        self.PAUSED = "paused"
+
+
+# ---------------------------------------------------------------------------
+# job序列化方式设置
+# ---------------------------------------------------------------------------
+#
+class JobSerializerType(object):
+    """
+    job serializer: Redis中job的保存格式。pickle--pickle整个job(默认)；compact--紧凑格式(msgpack)；
+    """
+    def __init__(self):
+        #: pickle--pickle整个job
+        self.PICKLE = "pickle"
+        #: compact--只保存cron字符串、函数名等字段
+        self.COMPACT = "compact"
+
+
+# ---------------------------------------------------------------------------
+# 调度进程设置
+# ---------------------------------------------------------------------------
+#
+class SchedulerHostType(object):
+    """
+    scheduler host: 本进程是否执行job。elect--多个进程选举出一个(默认)；true--执行；false--不执行；
+    """
+    def __init__(self):
+        #: elect--共用存储的进程通过Redis租约选举，见JobLeader
+        self.ELECT = "elect"
+
+
 # ---------------------------------------------------------------------------
 # 定时任务处理器操作类型设置
 # ---------------------------------------------------------------------------
@@ -49,6 +109,21 @@ class JobOptType(object):
         self.START_NOW = "start-now"
 
 
+# ---------------------------------------------------------------------------
+# 定时任务列表排序类型设置
+# ---------------------------------------------------------------------------
+#
+class JobSortType(object):
+    """
+    Job sort type: 分页查询job列表时的排序方式
+    """
+    def __init__(self):
+        #: 按下次执行时间排序(暂停的job排在最后)
+        self.NEXT_RUN_TIME = "next_run_time"
+        #: 按job id排序
+        self.ID = "id"
+
+
 # ---------------------------------------------------------------------------
 # Job配置文件读取
 # ---------------------------------------------------------------------------
@@ -64,11 +139,39 @@ class JobCfg(object):
         """
         self.cfg = MyConfig(cfg_filename).config
         self.log_filename = self.cfg["log-filename"]
+        # 日志设置(可选): 级别、单条消息最大长度、文件滚动大小/个数、按名称设置的级别及采样比例
+        self.log_level = self.cfg.get("log-level", "INFO")
+        self.log_max_length = self.cfg.get("log-max-length", 2000)
+        self.log_max_bytes = self.cfg.get("log-max-bytes", 0)
+        self.log_backup_count = self.cfg.get("log-backup-count", 0)
+        self.log_levels = self.cfg.get("log-levels", {})
+        self.log_sampling = self.cfg.get("log-sampling", {})
         self.auth_cfg_filename = self.cfg["auth-cfg-filename"]
         self.requests_cfg_filename = self.cfg["requests-cfg-filename"]
         self.servers_cfg_filename = self.cfg["servers-cfg-filename"]
         self.apis_cfg_filename = self.cfg["apis-cfg-filename"]
         self.scheduler_cfg_filename = self.cfg["scheduler-cfg-filename"]
+        # api线程池设置(可选)
+        self.api_read_workers = self.cfg.get("api-read-workers", 8)
+        self.api_write_workers = self.cfg.get("api-write-workers", 2)
+        self.api_max_pending = self.cfg.get("api-max-pending", 200)
+        # 查询结果缓存的条数(按job存储版本号失效)
+        self.api_cache_size = self.cfg.get("api-cache-size", 1000)
+        # 异步请求引擎设置(可选)
+        self.request_async = self.cfg.get("request-async", False)
+        self.request_workers = self.cfg.get("request-workers", 100)
+        self.request_concurrency = self.cfg.get("request-concurrency", {})
+        # 下游限流(可选)：令牌桶限速、最大并发、排队上限及最长排队时间，见RequestLimiters
+        self.request_limits = self.cfg.get("request-limits", {})
+        # 下游请求策略(可选)：超时、失败重试(指数退避+抖动)及熔断，见RequestPolicies
+        self.request_policies = self.cfg.get("request-policies", {})
+        # 本进程是否运行定时任务(可选，见SchedulerHostType)，环境变量JOB_SCHEDULER_HOST优先；
+        # 默认elect: 多worker部署时启动时选举出一个进程执行job，其它进程只提供api(调度器以暂停状态启动，仍可读写job)，
+        # 执行job的进程退出后由其它进程接管
+        scheduler_host = os.environ.get("JOB_SCHEDULER_HOST", self.cfg.get("scheduler-host", "elect"))
+        if isinstance(scheduler_host, str) and scheduler_host.lower() != SchedulerHostType().ELECT:
+            scheduler_host = scheduler_host.lower() in ("1", "true", "yes")
+        self.scheduler_host = scheduler_host.lower() if isinstance(scheduler_host, str) else scheduler_host
 
 
 # ---------------------------------------------------------------------------
@@ -85,9 +188,44 @@ class SchedulerCfg(object):
         :param cfg_filename: 定时任务配置文件名称，默认为scheduler.json；
         :return:
         """
-        self.cfg = MyConfig(cfg_filename).config
-        self.cfg_file = MyConfig(cfg_filename).cfgFile
+        config = MyConfig(cfg_filename)
+        self.cfg = config.config
+        self.cfg_file = config.cfgFile
         self.log_file = self.cfg['log-filename']
+        self.log_level = self.cfg.get('log-level', 'INFO')
+        self.log_max_length = self.cfg.get('log-max-length', 2000)
         self.redis_name = self.cfg['redis-name']
         self.trigger_type = self.cfg['trigger-type']
         self.timezone = self.cfg['timezone']
+        # 启动时导入的job文件(可选)，与本配置文件在同一目录，支持.json/.ndjson
+        self.jobs_filename = self.cfg.get('jobs-filename')
+        # 执行历史(可选): 每个job保留的最大记录数及Redis key前缀
+        self.history_max_len = self.cfg.get('history-max-len', 1000)
+        self.history_key_prefix = self.cfg.get('history-key-prefix', 'apscheduler.history')
+        # 熔断状态的Redis key前缀(可选)，所有节点共享
+        self.breaker_key_prefix = self.cfg.get('breaker-key-prefix', 'apscheduler.breaker')
+        # 相同请求合并的Redis key前缀(可选)，所有节点共享
+        self.flight_key_prefix = self.cfg.get('flight-key-prefix', 'apscheduler.flight')
+        # 执行器(可选)，如: {"default": {"type": "thread", "max-workers": 20}, "heavy": {"type": "process", "max-workers": 4}}
+        self.executors = self.cfg.get('executors', {})
+        # job默认设置(可选)，如: {"coalesce": true, "max-instances": 3, "misfire-grace-time": 30}
+        self.job_defaults = {key.replace('-', '_'): value for key, value in self.cfg.get('job-defaults', {}).items()}
+        # 执行时间打散窗口(秒，可选)：大于0时add_job默认按job id把执行时间后移[0, smear-window)秒，
+        # 同一时刻触发的大量job均匀分散到窗口内，单个job可用"smear"覆盖
+        self.smear_window = self.cfg.get('smear-window', 0)
+        # job序列化方式(可选)，见JobSerializerType；job-serializer-migrate为true时启动时把已有job转为该格式
+        self.job_serializer = self.cfg.get('job-serializer', 'pickle')
+        self.job_serializer_migrate = self.cfg.get('job-serializer-migrate', False)
+        # 集群模式(可选): 多个节点共用同一个Redis存储
+        self.cluster_mode = self.cfg.get('cluster-mode', False)
+        self.cluster_channel = self.cfg.get('cluster-channel', 'apscheduler.changes')
+        self.cluster_lock_ttl = self.cfg.get('cluster-lock-ttl', 60)
+        self.cluster_lock_retry = self.cfg.get('cluster-lock-retry', 0.5)
+        # 调度进程选举(scheduler-host为elect时)的租约key及有效期(秒)
+        self.leader_key = self.cfg.get('leader-key', 'apscheduler.leader')
+        self.leader_ttl = self.cfg.get('leader-ttl', 15)
+        # 进程内job副本(可选): 调度器及查询直接读取解码后的job，写入仍提交到Redis，
+        # 变更通过memory-tier-channel广播，每memory-tier-check秒检查一次版本号；共用存储的进程需同时开启
+        self.memory_tier = self.cfg.get('memory-tier', False)
+        self.memory_tier_channel = self.cfg.get('memory-tier-channel', 'apscheduler.store')
+        self.memory_tier_check = self.cfg.get('memory-tier-check', 5)
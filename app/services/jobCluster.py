@@ -0,0 +1,72 @@
+import json
+import os
+import socket
+import uuid
+
+
+# ---------------------------------------------------------------------------
+# 定时任务集群
+# ---------------------------------------------------------------------------
+#
+class JobCluster(object):
+    """
+    多节点共用同一个Redis job存储时的节点间通知：
+    节点修改job后通过Redis pub/sub广播变更的job id，其它节点收到后立即唤醒调度器并失效本地缓存，
+    不必等到下一次定时唤醒。每次执行只运行一次由JobRedisStore的执行锁保证。
+    """
+    def __init__(self, redis, channel: str, on_change):
+        """
+
+        :param redis: Redis连接；
+        :param channel: pub/sub频道；
+        :param on_change: 收到其它节点变更时的回调: on_change(job_ids)，job_ids为None表示全部；
+        """
+        self.redis = redis
+        self.channel = channel
+        self.on_change = on_change
+        self.node_id = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+        self._pubsub = None
+        self._thread = None
+
+    def start(self):
+        """
+        启动订阅线程。
+        :return:
+        """
+        if self._thread is not None:
+            return
+        self._pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        self._pubsub.subscribe(**{self.channel: self._handle_message})
+        self._thread = self._pubsub.run_in_thread(sleep_time=1, daemon=True)
+
+    def stop(self):
+        """
+
+        :return:
+        """
+        if self._thread is None:
+            return
+        self._thread.stop()
+        self._pubsub.close()
+        self._thread = None
+        self._pubsub = None
+
+    def publish(self, job_ids: list = None):
+        """
+        广播job变更。
+        :param job_ids: 变更的job id，None表示全部；
+        :return:
+        """
+        self.redis.publish(self.channel, json.dumps({'node': self.node_id, 'job_ids': job_ids}))
+
+    def _handle_message(self, message):
+        """
+
+        :param message:
+        :return:
+        """
+        data = json.loads(message['data'])
+        if data.get('node') == self.node_id:
+            return
+        self.on_change(data.get('job_ids'))
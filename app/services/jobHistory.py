@@ -0,0 +1,131 @@
+import math
+from concurrent.futures import Future
+
+from apscheduler.events import EVENT_JOB_ERROR
+
+from ..jobs.jobs import on_job_done
+from .jobRetry import origin_id
+
+
+# ---------------------------------------------------------------------------
+# 定时任务执行历史
+# ---------------------------------------------------------------------------
+#
+class JobHistory(object):
+    """
+    每个job一个Redis stream，按最大长度截断，记录每次执行的:
+        scheduled: 计划执行时间戳；start/end: 实际开始/结束时间戳；
+        lag_us: 调度延迟(实际开始-计划执行，微秒)；duration_us: 耗时(微秒)；
+        status/status_code/error: 下游调用结果；attempt/retry_in: 第几次执行及重试延迟(秒)。
+    重试job的执行记录在原job的stream中。
+    """
+    PERCENTILES = (50, 95, 99)
+    FIELDS = ('scheduled', 'start', 'end', 'lag_us', 'duration_us', 'status', 'status_code', 'error', 'attempt',
+              'retry_in')
+    INT_FIELDS = ('lag_us', 'duration_us', 'status_code', 'attempt')
+    FLOAT_FIELDS = ('scheduled', 'start', 'end', 'retry_in')
+
+    def __init__(self, redis, key_prefix: str, max_len: int):
+        """
+
+        :param redis: Redis连接；
+        :param key_prefix: stream key前缀，key为 "<key_prefix>:<job_id>"；
+        :param max_len: 每个job保留的最大执行记录数；
+        """
+        self.redis = redis
+        self.key_prefix = key_prefix
+        self.max_len = max_len
+
+    def _key(self, job_id: str):
+        return f'{self.key_prefix}:{job_id}'
+
+    def on_job_event(self, event):
+        """
+        EVENT_JOB_EXECUTED | EVENT_JOB_ERROR 监听器。异步执行的job在future完成后于独立线程中记录(见on_job_done)。
+        :param event:
+        :return:
+        """
+        if event.code == EVENT_JOB_ERROR:
+            result = getattr(event.exception, 'result', None) or {'status': 'error', 'error': repr(event.exception)}
+        elif isinstance(event.retval, Future):
+            on_job_done(event.retval,
+                        lambda result: self.record(origin_id(event.job_id), event.scheduled_run_time, result))
+            return
+        elif isinstance(event.retval, dict):
+            result = event.retval
+        else:
+            result = {'status': 'ok'}
+
+        self.record(origin_id(event.job_id), event.scheduled_run_time, result)
+
+    def record(self, job_id: str, scheduled_run_time, result: dict):
+        """
+
+        :param job_id:
+        :param scheduled_run_time:
+        :param result:
+        :return:
+        """
+        run = dict(result, scheduled=scheduled_run_time.timestamp() if scheduled_run_time else None)
+        if run.get('start') is not None and run['scheduled'] is not None:
+            run['lag_us'] = round((run['start'] - run['scheduled']) * 1000000)
+
+        fields = {key: run[key] for key in self.FIELDS if run.get(key) is not None}
+        self.redis.xadd(self._key(job_id), fields, maxlen=self.max_len, approximate=True)
+
+    def get_runs(self, job_id: str, count: int = 20):
+        """
+        最近count次执行记录，新的在前。
+        :param job_id:
+        :param count:
+        :return:
+        """
+        return [self._decode(fields) for _, fields in self.redis.xrevrange(self._key(job_id), count=count)]
+
+    def get_stats(self, job_id: str):
+        """
+        保留的执行记录中耗时与调度延迟的百分位数(微秒)。
+        :param job_id:
+        :return:
+        """
+        runs = [self._decode(fields) for _, fields in self.redis.xrange(self._key(job_id))]
+        stats = {'count': len(runs), 'errors': sum(1 for run in runs if run.get('status') != 'ok')}
+        for field in ('duration_us', 'lag_us'):
+            values = sorted(run[field] for run in runs if field in run)
+            stats[field] = {f'p{p}': self.percentile(values, p) for p in self.PERCENTILES}
+        return stats
+
+    def remove(self, job_ids: list):
+        """
+        删除job的执行历史。
+        :param job_ids:
+        :return:
+        """
+        if job_ids:
+            self.redis.delete(*(self._key(job_id) for job_id in job_ids))
+
+    @staticmethod
+    def percentile(sorted_values: list, p: float):
+        """
+        最近秩法百分位数。
+        """
+        if not sorted_values:
+            return None
+        return sorted_values[max(math.ceil(p / 100 * len(sorted_values)) - 1, 0)]
+
+    def _decode(self, fields: dict):
+        """
+
+        :param fields:
+        :return:
+        """
+        run = {}
+        for key, value in fields.items():
+            key = key.decode('utf-8') if isinstance(key, bytes) else key
+            value = value.decode('utf-8') if isinstance(value, bytes) else value
+            if key in self.INT_FIELDS:
+                value = int(value)
+            elif key in self.FLOAT_FIELDS:
+                value = float(value)
+            run[key] = value
+        return run
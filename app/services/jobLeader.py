@@ -0,0 +1,114 @@
+import os
+import socket
+import threading
+import time
+import uuid
+
+
+# ---------------------------------------------------------------------------
+# 调度进程选举
+# ---------------------------------------------------------------------------
+#
+class JobLeader(object):
+    """
+    多个worker(uvicorn/gunicorn)共用同一个Redis存储时，选出唯一执行job的进程：
+    用SET NX PX抢占租约，持有者每ttl/3秒续约一次；持有者退出或失联后租约过期，其它进程在下一次检查时接管。
+    """
+    #: 仅在租约仍属于本进程时续约/释放
+    RENEW_SCRIPT = """
+        if redis.call('GET', KEYS[1]) == ARGV[1] then
+            return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+        end
+        return 0
+    """
+    RELEASE_SCRIPT = """
+        if redis.call('GET', KEYS[1]) == ARGV[1] then
+            return redis.call('DEL', KEYS[1])
+        end
+        return 0
+    """
+
+    def __init__(self, redis, key: str, ttl: float, on_change=None, log=None):
+        """
+
+        :param redis: Redis连接；
+        :param key: 租约的key，共用存储的进程需一致；
+        :param ttl: 租约有效期(秒)，持有者失联后最多ttl秒由其它进程接管；
+        :param on_change: 本进程成为或不再是调度进程时的回调: on_change(is_leader)；
+        :param log:
+        """
+        self.redis = redis
+        self.key = key
+        self.ttl = ttl
+        self.on_change = on_change
+        self.log = log
+        self.node_id = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.is_leader = False
+        self._renewed_at = None
+
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def check(self):
+        """
+        持有租约时续约，否则尝试抢占；结果变化时调用on_change。
+        :return: 本进程是否为调度进程
+        """
+        ttl_ms = int(self.ttl * 1000)
+        if self.is_leader:
+            is_leader = bool(self.redis.eval(self.RENEW_SCRIPT, 1, self.key, self.node_id, ttl_ms))
+        else:
+            is_leader = bool(self.redis.set(self.key, self.node_id, nx=True, px=ttl_ms))
+        if is_leader:
+            self._renewed_at = time.monotonic()
+        self._set_leader(is_leader)
+        return is_leader
+
+    def _set_leader(self, is_leader: bool):
+        if is_leader == self.is_leader:
+            return
+        self.is_leader = is_leader
+        if self.log is not None:
+            self.log.info('%s调度进程, node=%s', '成为' if is_leader else '不再是', self.node_id)
+        if self.on_change is not None:
+            self.on_change(is_leader)
+
+    def start(self):
+        """
+        启动续约/接管线程，首次选举由调用方先调用check()同步完成。
+        :return:
+        """
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='job-leader', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        停止线程并释放租约，其它进程不必等租约过期即可接管。
+        :return:
+        """
+        if self._thread is None:
+            return
+        self._stopped.set()
+        self._thread.join()
+        self._thread = None
+        if self.is_leader:
+            self.redis.eval(self.RELEASE_SCRIPT, 1, self.key, self.node_id)
+            self.is_leader = False
+
+    def _run(self):
+        """
+
+        :return:
+        """
+        while not self._stopped.wait(self.ttl / 3):
+            try:
+                self.check()
+            except Exception as e:
+                if self.log is not None:
+                    self.log.error('调度进程续约失败: %r', e)
+                # Redis不可用：租约过期后其它进程可能已接管，本进程停止执行job
+                if self.is_leader and time.monotonic() - self._renewed_at >= self.ttl:
+                    self._set_leader(False)
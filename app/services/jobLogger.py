@@ -0,0 +1,170 @@
+import atexit
+import json
+import logging
+import queue
+import random
+import threading
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+
+# ---------------------------------------------------------------------------
+# 结构化日志格式
+# ---------------------------------------------------------------------------
+#
+class JsonFormatter(logging.Formatter):
+    """
+    每条日志输出为一行JSON，超过max_length的消息截断。
+    消息在写日志的后台线程中才格式化。
+    """
+    def __init__(self, max_length: int = 0):
+        super().__init__()
+        self.max_length = max_length
+
+    def format(self, record):
+        msg = record.getMessage()
+        if self.max_length and len(msg) > self.max_length:
+            msg = f'{msg[:self.max_length]}...(truncated {len(msg) - self.max_length} chars)'
+
+        data = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'msg': msg,
+        }
+        if record.exc_text:
+            data['exc'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class LazyQueueHandler(QueueHandler):
+    """
+    QueueHandler默认在调用线程中格式化消息，这里只放入队列，由后台线程格式化。
+    参数对象在入队后不应再被修改；队列满时丢弃日志并计数，不阻塞调用线程。
+    """
+    dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LazyQueueHandler.dropped += 1
+
+    def prepare(self, record):
+        if record.exc_info:
+            # 异常对象不能跨线程保留，先转为文本
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class SamplingFilter(logging.Filter):
+    """
+    按比例采样，rate为保留的比例(0~1)。
+    """
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return self.rate >= 1 or random.random() < self.rate
+
+
+# ---------------------------------------------------------------------------
+# 异步日志
+# ---------------------------------------------------------------------------
+#
+class JobLogger(object):
+    """
+    与MyLogger接口兼容的异步结构化日志：
+    日志先放入内存队列，由后台线程格式化为JSON并写文件，写日志不阻塞请求和job；
+    消息使用 log.info('... %s', arg) 的延迟格式化，级别未开启时不做任何格式化；
+    可按名称(如 "JobAPI.get_jobs_api")单独设置级别和采样比例。
+    """
+    ROOT_NAME = 'job'
+    QUEUE_SIZE = 10000
+
+    _listeners = {}
+    _lock = threading.Lock()
+
+    def __init__(self, name: str = None):
+        """
+
+        :param name: 日志名称，默认为根日志 "job"；
+        """
+        self.name = name or self.ROOT_NAME
+        self.logger = logging.getLogger(self.name)
+
+    def initLogger(self, fileName: str, level=logging.INFO, max_length: int = 0, max_bytes: int = 0,
+                   backup_count: int = 0, levels: dict = None, sampling: dict = None):
+        """
+        同一个文件只创建一个后台写线程。
+        :param fileName: 日志文件名；
+        :param level: 日志级别，默认INFO(DEBUG级别的请求/响应内容不格式化也不入队)；
+        :param max_length: 单条消息最大长度，0为不限制；
+        :param max_bytes: 日志文件大小上限，0为不滚动；
+        :param backup_count: 滚动保留的文件数；
+        :param levels: 子日志级别，如 {"JobAPI.get_jobs_api": "WARNING"}；
+        :param sampling: 子日志采样比例，如 {"JobAPI.get_jobs_api": 0.1}；
+        :return:
+        """
+        with self._lock:
+            listener = self._listeners.get(fileName)
+            if listener is None:
+                file_handler = RotatingFileHandler(fileName, maxBytes=max_bytes, backupCount=backup_count,
+                                                   encoding='utf-8')
+                file_handler.setFormatter(JsonFormatter(max_length))
+                log_queue = queue.Queue(self.QUEUE_SIZE)
+                listener = QueueListener(log_queue, file_handler, respect_handler_level=False)
+                listener.start()
+                self._listeners[fileName] = listener
+
+        self.logger.handlers = [LazyQueueHandler(listener.queue)]
+        self.logger.setLevel(level)
+        self.logger.propagate = False
+
+        for name, child_level in (levels or {}).items():
+            self.getChild(name).logger.setLevel(child_level)
+        for name, rate in (sampling or {}).items():
+            self.getChild(name).logger.addFilter(SamplingFilter(rate))
+
+    def getChild(self, suffix: str):
+        """
+        子日志，写入父日志的文件，可单独设置级别。
+        :param suffix:
+        :return:
+        """
+        return JobLogger(f'{self.name}.{suffix}')
+
+    def isEnabledFor(self, level):
+        return self.logger.isEnabledFor(level)
+
+    def debug(self, msg, *args, **kwargs):
+        self.logger.debug(msg, *args, **kwargs)
+
+    def info(self, msg, *args, **kwargs):
+        self.logger.info(msg, *args, **kwargs)
+
+    def warning(self, msg, *args, **kwargs):
+        self.logger.warning(msg, *args, **kwargs)
+
+    def error(self, msg, *args, **kwargs):
+        self.logger.error(msg, *args, **kwargs)
+
+    def exception(self, msg, *args, **kwargs):
+        self.logger.exception(msg, *args, **kwargs)
+
+    @classmethod
+    def stop(cls):
+        """
+        写完队列中剩余的日志后停止后台线程。
+        :return:
+        """
+        with cls._lock:
+            for listener in cls._listeners.values():
+                listener.stop()
+            cls._listeners.clear()
+
+
+atexit.register(JobLogger.stop)
@@ -0,0 +1,360 @@
+import heapq
+import json
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from apscheduler.job import Job
+from apscheduler.util import datetime_to_utc_timestamp, utc
+
+from .jobMetrics import MEMORY_TIER_RELOADS
+
+
+# ---------------------------------------------------------------------------
+# job存储的进程内副本
+# ---------------------------------------------------------------------------
+#
+class JobMemoryTier(object):
+    """
+    JobRedisStore的进程内副本：保存解码后的job状态及按下次执行时间排序的堆，
+    读取job、查找到期job及计算下次唤醒时间不再访问Redis，也不再反序列化。
+    Redis仍是唯一的持久存储：写入先提交到Redis，成功后再更新副本，并在change频道广播变更的job id及版本号；
+    其它进程收到后从Redis重新读取这些job。副本中每个job记录其最后一次变更的版本号，较旧的变更不会覆盖较新的。
+    每check_interval秒比较一次Redis中的版本号，消息丢失(如断线或未开启副本的进程写入)时全量重新加载。
+    其它进程的变更在收到消息前(通常为毫秒级)不可见。
+    """
+    #: 全量加载时每批读取的job数
+    BATCH_SIZE = 500
+
+    def __init__(self, store, channel: str, check_interval: float = 5, log=None):
+        """
+
+        :param store: JobRedisStore；
+        :param channel: 广播变更的pub/sub频道；
+        :param check_interval: 检查版本号的间隔(秒)；
+        :param log:
+        """
+        self.store = store
+        self.channel = channel
+        self.check_interval = check_interval
+        self.log = log
+        self.token = uuid.uuid4().hex
+        # 副本是否可用，不可用时JobRedisStore直接读取Redis
+        self.ready = False
+
+        self._states = {}
+        self._run_times = {}
+        self._heap = []
+        # job id ==> 最后一次变更的版本号(含已删除的job，见_prune)
+        self._versions = {}
+        self._lock = threading.RLock()
+
+        # 已连续处理到的版本号及乱序收到的版本号
+        self._version = 0
+        self._pending = set()
+        # 该版本号之前的消息，本进程的变更也需重新读取(全量加载期间的写入可能未加载)
+        self._refresh_until = 0
+        self._behind = None
+        self._pruned_version = 0
+
+        self._pubsub = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    # -----------------------------------------------------------------------
+    # 启动/停止
+    # -----------------------------------------------------------------------
+    def start(self):
+        """
+        订阅变更频道并全量加载(同步完成，启动后的第一次调度即可使用副本)，再启动同步线程。
+        :return:
+        """
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._subscribe()
+        self._thread = threading.Thread(target=self._run, name='JobMemoryTier', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+
+        :return:
+        """
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self.ready = False
+
+    # -----------------------------------------------------------------------
+    # 读取
+    # -----------------------------------------------------------------------
+    def lookup_job(self, job_id: str):
+        """
+
+        :param job_id:
+        :return: Job or None
+        """
+        state = self._states.get(job_id)
+        return self._create_job(state) if state is not None else None
+
+    def lookup_jobs(self, job_ids: list):
+        """
+        已不存在的job会被忽略。
+        :param job_ids:
+        :return:
+        """
+        states = self._states
+        return [self._create_job(states[job_id]) for job_id in job_ids if job_id in states]
+
+    def get_all_jobs(self):
+        """
+        同RedisJobStore.get_all_jobs，按下次执行时间排序，暂停的job排在最后。
+        :return:
+        """
+        jobs = [self._create_job(state) for state in list(self._states.values())]
+        paused_sort_key = datetime(9999, 12, 31, tzinfo=utc)
+        return sorted(jobs, key=lambda job: job.next_run_time or paused_sort_key)
+
+    def get_run_times(self, job_ids: list):
+        """
+
+        :param job_ids:
+        :return: [下次执行时间的utc时间戳 or None]
+        """
+        run_times = self._run_times
+        return [run_times.get(job_id) for job_id in job_ids]
+
+    def get_due(self, timestamp: float):
+        """
+        下次执行时间不晚于timestamp的job。
+        :param timestamp: utc时间戳；
+        :return: [(job_id, 下次执行时间的utc时间戳)]，按执行时间排序
+        """
+        with self._lock:
+            due = []
+            seen = set()
+            while self._heap and self._heap[0][0] <= timestamp:
+                run_time, job_id = heapq.heappop(self._heap)
+                if self._run_times.get(job_id) == run_time and job_id not in seen:
+                    seen.add(job_id)
+                    due.append((job_id, run_time))
+            # 只是查看，执行后由update_job更新下次执行时间
+            for job_id, run_time in due:
+                heapq.heappush(self._heap, (run_time, job_id))
+            return due
+
+    def get_next_run_time(self):
+        """
+
+        :return: 最早的下次执行时间(utc时间戳) or None
+        """
+        with self._lock:
+            heap = self._heap
+            # 堆中的旧执行时间在到达堆顶时丢弃
+            while heap and self._run_times.get(heap[0][1]) != heap[0][0]:
+                heapq.heappop(heap)
+            return heap[0][0] if heap else None
+
+    def count(self):
+        return len(self._states)
+
+    # -----------------------------------------------------------------------
+    # 写入
+    # -----------------------------------------------------------------------
+    def apply(self, version: int, jobs: list = (), removed_ids: list = ()):
+        """
+        本进程写入Redis成功后更新副本并广播。
+        :param version: 写入后的版本号(INCR的结果)；
+        :param jobs: 写入的job；
+        :param removed_ids: 删除的job id；
+        :return:
+        """
+        with self._lock:
+            for job in jobs:
+                state = job.__getstate__()
+                self._put(job.id, state, self._run_time(state), version)
+            for job_id in removed_ids:
+                self._put(job_id, None, None, version)
+        self.publish(version, [job.id for job in jobs] + list(removed_ids))
+
+    def clear(self, version: int):
+        """
+        本进程删除了全部job。
+        :param version:
+        :return:
+        """
+        with self._lock:
+            self._reset({}, {}, version)
+        self.publish(version, None)
+
+    def publish(self, version: int, job_ids: list = None):
+        """
+        广播变更。
+        :param version:
+        :param job_ids: 变更的job id，None表示全部；
+        :return:
+        """
+        self.store.redis.publish(self.channel, json.dumps({'token': self.token, 'version': version,
+                                                           'job_ids': job_ids}))
+
+    # -----------------------------------------------------------------------
+    # 内部方法
+    # -----------------------------------------------------------------------
+    def _create_job(self, state: dict):
+        """
+        每次返回新的Job，调用方修改job不影响副本。
+        """
+        job = Job.__new__(Job)
+        job.__setstate__(state)
+        job._scheduler = self.store._scheduler
+        job._jobstore_alias = self.store._alias
+        return job
+
+    @staticmethod
+    def _run_time(state: dict):
+        next_run_time = state['next_run_time']
+        return datetime_to_utc_timestamp(next_run_time) if next_run_time is not None else None
+
+    def _put(self, job_id: str, state, run_time, version: int):
+        """
+        更新一个job，state为None表示删除；已有更新的变更时忽略。
+        """
+        if self._versions.get(job_id, 0) > version:
+            return
+        self._versions[job_id] = version
+        if state is None:
+            self._states.pop(job_id, None)
+            self._run_times.pop(job_id, None)
+            return
+
+        self._states[job_id] = state
+        if run_time is None:
+            self._run_times.pop(job_id, None)
+        elif self._run_times.get(job_id) != run_time:
+            self._run_times[job_id] = run_time
+            heapq.heappush(self._heap, (run_time, job_id))
+            # 旧执行时间过多时重建堆
+            if len(self._heap) > 2 * len(self._run_times) + 1000:
+                self._heap = [(run_time, job_id) for job_id, run_time in self._run_times.items()]
+                heapq.heapify(self._heap)
+
+    def _reset(self, states: dict, run_times: dict, version: int):
+        self._states = states
+        self._run_times = run_times
+        self._heap = [(run_time, job_id) for job_id, run_time in run_times.items()]
+        heapq.heapify(self._heap)
+        self._versions = {job_id: version for job_id in states}
+
+    def _subscribe(self):
+        self._pubsub = self.store.redis.pubsub(ignore_subscribe_messages=True)
+        self._pubsub.subscribe(self.channel)
+        self.reload('start')
+
+    def _run(self):
+        """
+        同步线程：处理变更消息，定期检查版本号；连接出错时副本停用，重新订阅并全量加载后恢复。
+        """
+        next_check = time.monotonic() + self.check_interval
+        while not self._stop.is_set():
+            try:
+                if self._pubsub is None:
+                    self._subscribe()
+                message = self._pubsub.get_message(timeout=min(self.check_interval, 1))
+                if message is not None and message['type'] == 'message':
+                    self._handle(json.loads(message['data']))
+                if time.monotonic() >= next_check:
+                    next_check = time.monotonic() + self.check_interval
+                    self._check()
+            except Exception as e:
+                self.ready = False
+                if self.log is not None:
+                    self.log.error('job副本同步失败: %r', e)
+                self._close()
+                self._stop.wait(1)
+        self._close()
+
+    def _close(self):
+        if self._pubsub is not None:
+            try:
+                self._pubsub.close()
+            except Exception:
+                pass
+            self._pubsub = None
+
+    def _handle(self, data: dict):
+        """
+        处理一条变更消息。
+        """
+        version = data['version']
+        if version <= self._version or version in self._pending:
+            return
+        if data['token'] != self.token or version <= self._refresh_until:
+            if data['job_ids'] is None:
+                self.reload('changed')
+                return
+            self._refresh(data['job_ids'], version)
+
+        self._pending.add(version)
+        while self._version + 1 in self._pending:
+            self._version += 1
+            self._pending.remove(self._version)
+
+    def _check(self):
+        """
+        上次检查时Redis中已有、至今仍未收到的变更视为丢失，全量重新加载。
+        """
+        if self._behind is not None and self._version < self._behind:
+            self.reload('missed')
+            return
+        version = self.store.get_version()
+        self._behind = version if version > self._version else None
+        self._prune()
+
+    def _prune(self):
+        """
+        清理已删除job的版本号：保留至少一个检查周期，足以覆盖写入Redis到更新副本之间的间隔。
+        """
+        with self._lock:
+            self._versions = {job_id: version for job_id, version in self._versions.items()
+                              if job_id in self._states or version > self._pruned_version}
+        self._pruned_version = self._version
+
+    def _refresh(self, job_ids: list, version: int):
+        """
+        从Redis重新读取变更的job。
+        """
+        for i in range(0, len(job_ids), self.BATCH_SIZE):
+            rows = self.store.fetch_job_states(job_ids[i:i + self.BATCH_SIZE])
+            with self._lock:
+                for job_id, state, run_time in rows:
+                    self._put(job_id, state, run_time, version)
+        self.store.view_cache.invalidate_many(job_ids)
+
+    def reload(self, reason: str):
+        """
+        全量加载：加载期间不阻塞读取，完成后替换副本。
+        :param reason: 加载原因(指标标签)；
+        :return: 加载的job数
+        """
+        t_start = time.perf_counter()
+        start_version = self.store.get_version()
+        states, run_times = self.store.load_job_states(self.BATCH_SIZE)
+        with self._lock:
+            self._reset(states, run_times, start_version)
+        self.store.view_cache.clear()
+        # 加载期间的变更可能未加载，这些版本的消息即使来自本进程也重新读取
+        self._refresh_until = self.store.get_version()
+        self._version = start_version
+        self._pending = {version for version in self._pending if version > start_version}
+        self._behind = None
+        self.ready = True
+
+        MEMORY_TIER_RELOADS.inc(reason)
+        if self.log is not None:
+            self.log.info('加载job副本(%s), count=%s, version=%s, spend=%.3fs', reason, len(states), start_version,
+                          time.perf_counter() - t_start)
+        return len(states)
@@ -0,0 +1,200 @@
+import functools
+import threading
+import time
+from bisect import bisect_left
+
+
+# ---------------------------------------------------------------------------
+# 指标
+# ---------------------------------------------------------------------------
+#
+class _Metric(object):
+    """
+    指标基类：按标签值分别统计，输出Prometheus文本格式。
+    """
+    TYPE = ''
+
+    def __init__(self, name: str, desc: str, label_names: tuple = ()):
+        self.name = name
+        self.desc = desc
+        self.label_names = label_names
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _labels_str(self, label_values: tuple, extra: str = ''):
+        pairs = [f'{name}="{self._escape(value)}"' for name, value in zip(self.label_names, label_values)]
+        if extra:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+    @staticmethod
+    def _escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.desc}', f'# TYPE {self.name} {self.TYPE}']
+        lines.extend(self._render_values())
+        return lines
+
+    def _render_values(self):
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """
+    计数器。
+    """
+    TYPE = 'counter'
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def _render_values(self):
+        with self._lock:
+            values = list(self._values.items())
+        return [f'{self.name}{self._labels_str(labels)} {value}' for labels, value in values]
+
+
+class Histogram(_Metric):
+    """
+    直方图：每个标签值保存各桶计数、总和与总数，输出时累加为le桶。
+    """
+    TYPE = 'histogram'
+    DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, name: str, desc: str, label_names: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, desc, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            data = self._values.get(label_values)
+            if data is None:
+                data = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            data[0][index] += 1
+            data[1] += value
+            data[2] += 1
+
+    def time(self, *label_values):
+        """
+        计时装饰器。
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                t_start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.observe(time.perf_counter() - t_start, *label_values)
+            return wrapper
+        return decorator
+
+    def _render_values(self):
+        with self._lock:
+            values = [(labels, list(data[0]), data[1], data[2]) for labels, data in self._values.items()]
+
+        lines = []
+        for labels, bucket_counts, total, count in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), bucket_counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(float(bound))
+                bucket_labels = self._labels_str(labels, 'le="' + le + '"')
+                lines.append(f'{self.name}_bucket{bucket_labels} {cumulative}')
+            lines.append(f'{self.name}_sum{self._labels_str(labels)} {total}')
+            lines.append(f'{self.name}_count{self._labels_str(labels)} {count}')
+        return lines
+
+
+class Gauge(_Metric):
+    """
+    采集时才计算的仪表：func返回数值，或 {标签值元组: 数值}。
+    """
+    TYPE = 'gauge'
+
+    def __init__(self, name: str, desc: str, func, label_names: tuple = ()):
+        super().__init__(name, desc, label_names)
+        self.func = func
+
+    def _render_values(self):
+        try:
+            value = self.func()
+        except Exception:
+            return []
+        if isinstance(value, dict):
+            return [f'{self.name}{self._labels_str(labels)} {v}' for labels, v in value.items()]
+        return [f'{self.name} {value}']
+
+
+# ---------------------------------------------------------------------------
+# 指标注册表
+# ---------------------------------------------------------------------------
+#
+class MetricsRegistry(object):
+    """
+
+    """
+    def __init__(self, prefix: str = 'job'):
+        self.prefix = prefix
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, desc: str, label_names: tuple = ()):
+        return self._register(Counter(f'{self.prefix}_{name}', desc, label_names))
+
+    def histogram(self, name: str, desc: str, label_names: tuple = (), buckets: tuple = Histogram.DEFAULT_BUCKETS):
+        return self._register(Histogram(f'{self.prefix}_{name}', desc, label_names, buckets))
+
+    def gauge(self, name: str, desc: str, func, label_names: tuple = ()):
+        """
+        同名gauge重复注册时以最后一次为准(如重新初始化定时任务管理器)。
+        """
+        metric = Gauge(f'{self.prefix}_{name}', desc, func, label_names)
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        """
+        Prometheus文本格式(0.0.4)。
+        :return:
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry()
+
+# 定时任务事件
+JOB_EVENTS = metrics.counter('events_total', 'Scheduler job events by type.', ('event',))
+# Redis存储操作耗时
+JOB_STORE_SECONDS = metrics.histogram('store_op_seconds', 'Redis job store operation latency.', ('op',))
+# 进程内副本全量加载次数
+MEMORY_TIER_RELOADS = metrics.counter('memory_tier_reloads_total', 'Full reloads of the in-memory job tier from Redis.',
+                                      ('reason',))
+# 下游请求耗时
+REQUEST_SECONDS = metrics.histogram('request_seconds', 'Downstream API request latency.', ('api_name', 'status'))
+# 下游限流排队耗时及拒绝数
+REQUEST_WAIT_SECONDS = metrics.histogram('request_wait_seconds', 'Time spent queued by the downstream rate limiter.',
+                                         ('api_name',))
+REQUEST_REJECTED = metrics.counter('request_rejected_total', 'Downstream requests shed by the rate limiter or circuit breaker.',
+                                   ('downstream', 'reason'))
+# 熔断及重试
+CIRCUIT_OPENED = metrics.counter('circuit_opened_total', 'Times the circuit breaker of a downstream opened.',
+                                 ('api_name',))
+# 合并的相同请求: local--等待本进程的请求；remote--等待其它节点的请求；cached--使用保留的结果
+REQUEST_COALESCED = metrics.counter('request_coalesced_total', 'Duplicate downstream requests served by a shared call.',
+                                    ('api_name', 'source'))
+JOB_RETRIES = metrics.counter('job_retries_total', 'Deferred re-attempts scheduled after a failed job run.',
+                              ('api_name',))
@@ -0,0 +1,116 @@
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+
+from apscheduler.events import EVENT_JOB_ERROR
+from apscheduler.jobstores.base import JobLookupError
+
+from ..jobs.jobs import on_job_done
+
+#: 重试job的id为 "<job_id>#retry-<attempt>"
+RETRY_SEP = '#retry-'
+
+
+def retry_id(job_id: str, attempt: int):
+    return f'{job_id}{RETRY_SEP}{attempt}'
+
+
+def origin_id(job_id: str):
+    """
+    重试job ==> 原job的id，其它job原样返回。
+    """
+    return job_id.partition(RETRY_SEP)[0]
+
+
+# ---------------------------------------------------------------------------
+# 失败重试
+# ---------------------------------------------------------------------------
+#
+class JobRetry(object):
+    """
+    执行结果中带有retry_in(见start_job_by_api)时，按原job的设置在retry_in秒后安排一次执行，
+    执行线程不必sleep等待。重试job保存在本节点的内存存储中，不出现在job列表里，重启后丢失；
+    下次定时执行早于重试时间，或原job已被删除、暂停、修改时，不再重试。
+    """
+    #: 重试job的存储
+    STORE = 'retry'
+
+    def __init__(self, scheduler, jobstore: str, log):
+        """
+
+        :param scheduler:
+        :param jobstore: 原job的存储；
+        :param log:
+        """
+        self.scheduler = scheduler
+        self.jobstore = jobstore
+        self.log = log
+
+    def on_job_event(self, event):
+        """
+        EVENT_JOB_EXECUTED | EVENT_JOB_ERROR 监听器。异步执行的job在future完成后于独立线程中处理(见on_job_done)。
+        :param event:
+        :return:
+        """
+        if event.code == EVENT_JOB_ERROR:
+            result = getattr(event.exception, 'result', None)
+        elif isinstance(event.retval, Future):
+            on_job_done(event.retval, lambda result: self.schedule(event.job_id, result))
+            return
+        else:
+            result = event.retval
+
+        if isinstance(result, dict):
+            self.schedule(event.job_id, result)
+
+    def on_job_changed(self, event):
+        """
+        EVENT_JOB_ADDED | EVENT_JOB_MODIFIED | EVENT_JOB_REMOVED 监听器：原job变更后取消未执行的重试。
+        :param event:
+        :return:
+        """
+        if event.jobstore == self.jobstore:
+            self.cancel(event.job_id)
+
+    def schedule(self, job_id: str, result: dict):
+        """
+
+        :param job_id: 失败的job(或重试job)的id；
+        :param result: 执行结果；
+        :return: 重试job，不重试时返回None
+        """
+        if result.get('retry_in') is None:
+            return None
+
+        job_id = origin_id(job_id)
+        job = self.scheduler.get_job(job_id, self.jobstore)
+        run_date = datetime.now(self.scheduler.timezone) + timedelta(seconds=result['retry_in'])
+        if job is None or job.next_run_time is None or job.next_run_time <= run_date:
+            self.log.info('不再重试, id=%s, attempt=%s', job_id, result.get('attempt'))
+            return None
+
+        attempt = result.get('attempt', 1) + 1
+        self.log.info('重试定时任务, id=%s, attempt=%s, run_date=%s', job_id, attempt, run_date)
+        return self.scheduler.add_job(job.func, 'date', run_date=run_date, id=retry_id(job_id, attempt),
+                                      name=job.name, args=job.args, kwargs=dict(job.kwargs, attempt=attempt),
+                                      executor=job.executor, misfire_grace_time=job.misfire_grace_time,
+                                      jobstore=self.STORE, replace_existing=True)
+
+    def cancel(self, job_id: str):
+        """
+        取消job未执行的重试。
+        :param job_id:
+        :return:
+        """
+        for job in self.scheduler.get_jobs(self.STORE):
+            if origin_id(job.id) == job_id:
+                try:
+                    self.scheduler.remove_job(job.id, self.STORE)
+                except JobLookupError:
+                    pass
+
+    def count(self):
+        """
+        未执行的重试数。
+        :return:
+        """
+        return len(self.scheduler.get_jobs(self.STORE))
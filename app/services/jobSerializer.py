@@ -0,0 +1,175 @@
+import functools
+import json
+import pickle
+from datetime import datetime
+
+import msgpack
+from apscheduler.util import obj_to_ref
+
+from .cronFiled import CronFiledTrigger
+from .cronCompiled import CompiledCronTrigger
+
+
+# ---------------------------------------------------------------------------
+# job序列化
+# ---------------------------------------------------------------------------
+#
+class JobSerializer(object):
+    """
+    默认序列化方式：与RedisJobStore相同，pickle整个job状态。
+    读取时同时支持pickle和紧凑格式，两种格式的job可以共存，切换序列化方式后无需停机迁移。
+    """
+    #: 紧凑格式的首字节(同时作为格式版本)，pickle数据(protocol>=2)以0x80开头，不会冲突
+    MAGIC = b'\x01'
+    #: 紧凑格式的编码方式，JSON只用于读取早期写入的数据
+    CODEC_MSGPACK = b'm'
+    CODEC_JSON = b'j'
+    #: 可按cron字符串重建的触发器
+    TRIGGER_TYPES = {
+        'cron': CronFiledTrigger,
+        'quartz': CompiledCronTrigger,
+    }
+
+    def __init__(self, function_map: dict = None, pickle_protocol: int = pickle.HIGHEST_PROTOCOL):
+        """
+
+        :param function_map: job函数名 ==> 函数，紧凑格式中只保存函数名；
+        :param pickle_protocol:
+        """
+        self.function_map = function_map or {}
+        self.pickle_protocol = pickle_protocol
+        self._func_names = {obj_to_ref(func): name for name, func in self.function_map.items()}
+
+    def dumps(self, job_state: dict):
+        """
+
+        :param job_state: job.__getstate__()；
+        :return:
+        """
+        return pickle.dumps(job_state, self.pickle_protocol)
+
+    def loads(self, data: bytes):
+        """
+        按首字节识别格式。
+        :param data:
+        :return: job状态，可直接用于job.__setstate__
+        """
+        if data[:1] == self.MAGIC:
+            return self._decode(data)
+        return pickle.loads(data)
+
+    def is_current(self, data: bytes):
+        """
+        已保存的数据是否为本序列化方式的格式(用于迁移时跳过)。
+        :param data:
+        :return:
+        """
+        return data[:1] != self.MAGIC
+
+    def _decode(self, data: bytes):
+        """
+        紧凑格式 ==> job状态。
+        :param data:
+        :return:
+        """
+        codec, payload = data[1:2], data[2:]
+        if codec == self.CODEC_MSGPACK:
+            record = msgpack.unpackb(payload, raw=False)
+        elif codec == self.CODEC_JSON:
+            record = json.loads(payload)
+        else:
+            raise ValueError(f'undefined job codec: {codec!r}')
+
+        trigger = self._create_trigger(record['t'], record['c'], record['z'], record.get('s', 0))
+        func = record['f']
+        if func in self.function_map:
+            func = obj_to_ref(self.function_map[func])
+
+        return {
+            'version': 1,
+            'id': record['i'],
+            'func': func,
+            'trigger': trigger,
+            'executor': record['e'],
+            'args': tuple(record['a']),
+            'kwargs': record['k'],
+            'name': record['n'],
+            'misfire_grace_time': record['m'],
+            'coalesce': record['o'],
+            'max_instances': record['x'],
+            'next_run_time': datetime.fromtimestamp(record['r'], trigger.timezone) if record['r'] is not None
+            else None,
+        }
+
+
+    @staticmethod
+    @functools.lru_cache(maxsize=4096)
+    def _create_trigger(trigger_type: str, cron_str: str, timezone: str, offset: int = 0):
+        """
+        触发器没有可变状态，相同cron字符串、时区和偏移的job共用一个触发器，批量读取时不必重复解析。
+        """
+        return JobSerializer.TRIGGER_TYPES[trigger_type](cron_str, timezone, offset)
+
+
+class CompactJobSerializer(JobSerializer):
+    """
+    紧凑格式：只保存原始cron字符串、时区、偏移及FUNCTION_MAP中的函数名，不再pickle触发器和函数引用，
+    使用msgpack编码。
+    无法按cron字符串重建的触发器或无法编码的参数，该job仍使用pickle。
+    """
+    def dumps(self, job_state: dict):
+        record = self._encode(job_state)
+        if record is None:
+            return super().dumps(job_state)
+        try:
+            return self.MAGIC + self.CODEC_MSGPACK + msgpack.packb(record, use_bin_type=True)
+        except (TypeError, ValueError):
+            return super().dumps(job_state)
+
+    def is_current(self, data: bytes):
+        return data[:1] == self.MAGIC
+
+    def _encode(self, job_state: dict):
+        """
+        job状态 ==> 紧凑格式的字段，不支持时返回None。
+        :param job_state:
+        :return:
+        """
+        trigger = job_state['trigger']
+        trigger_type = self._trigger_type(trigger)
+        if trigger_type is None:
+            return None
+
+        next_run_time = job_state['next_run_time']
+        return {
+            'i': job_state['id'],
+            'n': job_state['name'],
+            'f': self._func_names.get(job_state['func'], job_state['func']),
+            'a': list(job_state['args']),
+            'k': job_state['kwargs'],
+            't': trigger_type,
+            'c': trigger.cron_str,
+            'z': str(trigger.timezone),
+            's': getattr(trigger, 'offset', 0),
+            'e': job_state['executor'],
+            'm': job_state['misfire_grace_time'],
+            'o': job_state['coalesce'],
+            'x': job_state['max_instances'],
+            'r': next_run_time.timestamp() if next_run_time is not None else None,
+        }
+
+    def _trigger_type(self, trigger):
+        """
+        只有除cron字符串和时区外没有其它设置(开始/结束时间、jitter)的触发器才能按cron字符串重建。
+        :param trigger:
+        :return:
+        """
+        if not getattr(trigger, 'cron_str', None):
+            return None
+        if type(trigger) is CronFiledTrigger:
+            if trigger.start_date is not None or trigger.end_date is not None or trigger.jitter:
+                return None
+            return 'cron'
+        if type(trigger) is CompiledCronTrigger:
+            return 'quartz'
+        return None
@@ -0,0 +1,410 @@
+import heapq
+import math
+from collections import Counter
+from datetime import datetime, timedelta
+from itertools import accumulate
+from operator import add, sub
+from types import SimpleNamespace
+
+from apscheduler.util import astimezone, localize
+
+from .cronFiled import CronFiledTrigger
+from .cronCompiled import CompiledCron, CompiledCronTrigger
+from .cronSmear import smear_offset, smear_window
+
+
+# ---------------------------------------------------------------------------
+# 执行负载模拟
+# ---------------------------------------------------------------------------
+#
+class JobSimulator(object):
+    """
+    离线展开job的cron触发器，统计一段时间内每秒的执行次数、按下游api的请求次数、峰值并发及最忙的时间段，
+    不创建调度器，也不修改job存储。组合job(calls)每次执行对其中每个下游各计一次请求。
+
+    展开方式：时、分、秒三个域与日期无关，每个cron字符串只计算一次当天的执行秒数(seconds of day)，
+    再由触发器逐日跳到匹配的日期(每个匹配日一次计算)；相同匹配日期的job先按偏移累加为一天的分布，
+    最后按天整段累加到时间轴上，耗时与job数基本无关，只与不同cron字符串的数量及窗口天数有关。
+    逐秒的时间轴只有全局执行次数及每种请求耗时各一条，按下游api的分布直接按resolution合并后累加。
+    夏令时切换当天按每小时的utc偏移换算，跳过或重复的那一小时与实际执行可能有差异。
+    """
+    TIME_FMT = '%Y-%m-%d %H:%M:%S'
+    DAY_SECONDS = 86400
+    HOUR_SECONDS = 3600
+    #: 最长模拟时间(秒)
+    MAX_SECONDS = 31 * 86400
+    #: 同一cron字符串的偏移种类超过该数量时，按切片整段累加
+    SLICE_OFFSETS = 8
+
+    def __init__(self, timezone, default_smear_window: int = 0):
+        """
+
+        :param timezone: 定时任务配置的时区；
+        :param default_smear_window: 打散窗口(smear-window)，用于计算新job的偏移；
+        """
+        self.timezone = astimezone(timezone)
+        self.default_smear_window = default_smear_window
+        #: job id ==> (cron字符串, 偏移秒数, 下游api)
+        self.jobs = {}
+        self._seconds_of_day = {}
+
+    def add_views(self, job_views):
+        """
+        加入已有job，暂停的job不会执行，跳过。
+        :param job_views: (展示信息, 下次执行时间)的迭代器，见JobRedisStore.iter_job_views；
+        :return: 加入的job数
+        """
+        count = 0
+        for view, run_time in job_views:
+            if run_time is None:
+                continue
+            self.jobs[view['id']] = (view['trigger'], view.get('offset', 0),
+                                     self._api_labels(view.get('func'), view.get('kwargs')))
+            count += 1
+        return count
+
+    def add_jobs(self, jobs):
+        """
+        加入待添加的job(格式同add_job)，与已有job同名时替换已有job。
+        :param jobs:
+        :return: 加入的job数
+        """
+        count = 0
+        for job in jobs:
+            name = job['name']
+            # 校验cron字符串，每个cron字符串只解析一次
+            self._get_seconds_of_day(job['cron'])
+            offset = smear_offset(name, smear_window(job.get('smear'), self.default_smear_window))
+            self.jobs[name] = (job['cron'], offset, self._api_labels(job.get('func'), job.get('para')))
+            count += 1
+        return count
+
+    @staticmethod
+    def _api_labels(func: str, kwargs: dict = None):
+        """
+        每次执行请求的下游api名称(api_call_str中":"之前的部分)：组合job为calls中每个请求的下游，
+        非api类job使用函数名。
+        :return: 下游api名称元组，每次执行对每项各请求一次
+        """
+        kwargs = kwargs or {}
+        calls = kwargs.get('calls')
+        if isinstance(calls, list) and calls:
+            return tuple(str((call or {}).get('api_call_str', '')).split(':')[0] for call in calls)
+        api_call_str = kwargs.get('api_call_str')
+        if api_call_str:
+            return api_call_str.split(':')[0],
+        return func or '',
+
+    def simulate(self, start: datetime = None, seconds: int = 7 * 86400, resolution: int = 60, duration: float = 1,
+                 durations: dict = None, top: int = 10, window: int = 60):
+        """
+        全局统计job的执行次数(逐秒)及下游请求的并发；按下游api的统计为请求次数，只按resolution合并，
+        峰值为最忙的桶(peak_bucket)，不计算逐秒峰值及并发。
+        :param start: 开始时间，默认为当前时间；
+        :param seconds: 模拟秒数，最多MAX_SECONDS；
+        :param resolution: 返回的直方图每个桶的秒数，1为逐秒；
+        :param duration: 每次请求的预计耗时(秒)，用于计算并发，不超过1秒时并发即每秒请求次数；
+        :param durations: 按下游api设置的预计耗时，如 {"orderApi": 5}；
+        :param top: 返回最忙的时间段数；
+        :param window: 最忙时间段的长度(秒)；
+        :return:
+        """
+        seconds = int(seconds)
+        if seconds < 1 or seconds > self.MAX_SECONDS:
+            raise ValueError(f'seconds must be between 1 and {self.MAX_SECONDS}! input: {seconds}')
+        if int(resolution) < 1 or int(window) < 1:
+            raise ValueError(f'resolution and window must be positive! input: {resolution}/{window}')
+        resolution, window = int(resolution), int(window)
+        durations = durations or {}
+
+        start = (start or datetime.now(self.timezone)).astimezone(self.timezone)
+        start_ts = math.ceil(start.timestamp())
+        start = datetime.fromtimestamp(start_ts, self.timezone)
+
+        # cron字符串 ==> {偏移: job数}；下游api ==> cron字符串 ==> {偏移: 请求数}
+        crons = {}
+        apis = {}
+        api_jobs = Counter()
+        for cron_str, offset, api_names in self.jobs.values():
+            crons.setdefault(cron_str, Counter())[offset] += 1
+            for api_name in api_names:
+                apis.setdefault(api_name, {}).setdefault(cron_str, Counter())[offset] += 1
+            api_jobs.update(set(api_names))
+        max_offset = max((offset for _, offset, _ in self.jobs.values()), default=0)
+
+        # 偏移后落在窗口内的执行，计划时间可能早于窗口max_offset秒
+        first_day = datetime.fromtimestamp(start_ts - max_offset, self.timezone).date()
+        last_day = datetime.fromtimestamp(start_ts + seconds - 1, self.timezone).date()
+        pattern_len = self.DAY_SECONDS + max_offset
+        matching_days = {}
+        layouts = {}
+
+        def segments(cron_offsets: dict):
+            patterns = self._day_patterns(cron_offsets, matching_days, first_day, last_day, pattern_len)
+            return self._segments(patterns, layouts, start_ts)
+
+        histogram = [0] * seconds
+        for segment in segments(crons):
+            self._add_segment(histogram, *segment)
+
+        # 按耗时(向上取整的秒数)分组累加下游请求，每组一条逐秒时间轴；
+        # 每个job只请求一次且耗时都不超过1秒时，并发即每秒执行次数
+        duration_crons = {}
+        for api_name, api_crons in apis.items():
+            group = duration_crons.setdefault(max(math.ceil(durations.get(api_name, duration)), 1), {})
+            for cron_str, offsets in api_crons.items():
+                group.setdefault(cron_str, Counter()).update(offsets)
+        if list(duration_crons) == [1] and all(len(api_names) == 1 for _, _, api_names in self.jobs.values()):
+            running = histogram
+        else:
+            running = [0] * seconds
+            for api_duration, group in duration_crons.items():
+                calls = [0] * seconds
+                for segment in segments(group):
+                    self._add_segment(calls, *segment)
+                running[:] = map(add, running, self._running(calls, api_duration))
+
+        api_results = {}
+        buckets = math.ceil(seconds / resolution)
+        for api_name, api_crons in apis.items():
+            api_histogram = [0] * buckets
+            cache = {}
+            for segment in segments(api_crons):
+                self._add_buckets(api_histogram, resolution, seconds, cache, *segment)
+            peak = max(api_histogram)
+            peak_ts = start_ts + api_histogram.index(peak) * resolution
+            api_results[api_name] = {
+                'jobs': api_jobs[api_name],
+                'fires': sum(api_histogram),
+                'peak_bucket': {'fires': peak, 'time': self._time_str(peak_ts)},
+                'resolution': resolution,
+                'histogram': api_histogram,
+            }
+
+        result = {
+            'start': start.strftime(self.TIME_FMT),
+            'end': datetime.fromtimestamp(start_ts + seconds, self.timezone).strftime(self.TIME_FMT),
+            'seconds': seconds,
+            'jobs': len(self.jobs),
+        }
+        result.update(self._summary(histogram, running, start_ts, resolution))
+        result['busiest_windows'] = self._busiest_windows(histogram, start_ts, window, top)
+        result['apis'] = api_results
+        return result
+
+    # -----------------------------------------------------------------------
+    # 展开
+    # -----------------------------------------------------------------------
+    def _create_trigger(self, cron_str: str):
+        """
+        与SchedulerMgt._create_trigger相同的触发器选择，不含偏移。
+        """
+        if CompiledCron.is_quartz(cron_str):
+            return CompiledCronTrigger(cron_str, self.timezone)
+        return CronFiledTrigger(cron_str, self.timezone)
+
+    def _get_seconds_of_day(self, cron_str: str):
+        """
+        匹配日当天的执行时刻(距0点的秒数，升序)。
+        :param cron_str:
+        :return:
+        """
+        seconds_of_day = self._seconds_of_day.get(cron_str)
+        if seconds_of_day is not None:
+            return seconds_of_day
+
+        trigger = self._create_trigger(cron_str)
+        if isinstance(trigger, CompiledCronTrigger):
+            hours, minutes, seconds = trigger.cron.hours, trigger.cron.minutes, trigger.cron.seconds
+        else:
+            fields = {field.name: field for field in trigger.fields}
+            hours, minutes, seconds = (self._field_values(fields[name], max_value)
+                                       for name, max_value in (('hour', 23), ('minute', 59), ('second', 59)))
+        seconds_of_day = self._seconds_of_day[cron_str] = [
+            hour * self.HOUR_SECONDS + minute * 60 + second for hour in hours for minute in minutes
+            for second in seconds]
+        return seconds_of_day
+
+    @staticmethod
+    def _field_values(field, max_value: int):
+        """
+        APScheduler cron域(时、分、秒)的全部取值。
+        """
+        values = []
+        value = field.get_next_value(SimpleNamespace(**{field.name: 0}))
+        while value is not None and value <= max_value:
+            values.append(value)
+            value = field.get_next_value(SimpleNamespace(**{field.name: value + 1}))
+        return values
+
+    def _matching_days(self, cron_str: str, first_day, last_day):
+        """
+        [first_day, last_day]内有执行的日期，由触发器从每个匹配日的次日0点起跳到下一个匹配日。
+        :return: 日期元组
+        """
+        trigger = self._create_trigger(cron_str)
+        days = []
+        day = first_day
+        while day <= last_day:
+            fire_time = trigger.get_next_fire_time(None, localize(datetime(day.year, day.month, day.day),
+                                                                  self.timezone))
+            if fire_time is None:
+                break
+            day = fire_time.astimezone(self.timezone).date()
+            if day > last_day:
+                break
+            days.append(day)
+            day += timedelta(days=1)
+        return tuple(days)
+
+    def _day_patterns(self, cron_offsets: dict, matching_days: dict, first_day, last_day, pattern_len: int):
+        """
+        相同匹配日期的cron字符串按偏移累加为一天的分布。
+        :param cron_offsets: cron字符串 ==> {偏移: 次数}；
+        :param matching_days: cron字符串 ==> 匹配日期，多次调用共用；
+        :return: {匹配日期元组: 一天的分布}
+        """
+        patterns = {}
+        for cron_str, offsets in cron_offsets.items():
+            days = matching_days.get(cron_str)
+            if days is None:
+                days = matching_days[cron_str] = self._matching_days(cron_str, first_day, last_day)
+            if not days:
+                continue
+            pattern = patterns.get(days)
+            if pattern is None:
+                pattern = patterns[days] = [0] * pattern_len
+            self._add_pattern(pattern, self._get_seconds_of_day(cron_str), offsets)
+        return patterns
+
+    def _segments(self, patterns: dict, layouts: dict, start_ts: int):
+        """
+        每个匹配日的分布在时间轴上的各段：(分布, 分布起点, 分布终点, 时间轴下标)。
+        :param patterns: 见_day_patterns；
+        :param layouts: 日期 ==> 见_day_layout，多次调用共用；
+        :param start_ts:
+        :return:
+        """
+        for days, pattern in patterns.items():
+            for day in days:
+                layout = layouts.get(day)
+                if layout is None:
+                    layout = layouts[day] = self._day_layout(day, len(pattern), start_ts)
+                for p_start, p_end, index in layout:
+                    yield pattern, p_start, p_end, index
+
+    def _add_pattern(self, pattern: list, seconds_of_day: list, offsets: Counter):
+        """
+        把一个cron字符串的job按偏移累加到一天的分布上。
+        :param pattern: 一天的分布，下标为距0点的秒数(含偏移)；
+        :param seconds_of_day:
+        :param offsets: {偏移: job数}；
+        :return:
+        """
+        if len(offsets) <= self.SLICE_OFFSETS:
+            for offset, count in offsets.items():
+                for second in seconds_of_day:
+                    pattern[second + offset] += count
+            return
+
+        weights = [0] * (max(offsets) + 1)
+        for offset, count in offsets.items():
+            weights[offset] = count
+        size = len(weights)
+        for second in seconds_of_day:
+            pattern[second:second + size] = map(add, pattern[second:second + size], weights)
+
+    def _day_layout(self, day, pattern_len: int, start_ts: int):
+        """
+        一天的分布在时间轴上的位置：[(分布起点, 分布终点, 时间轴下标)]。
+        没有夏令时切换的日期整段放置，切换当天按小时分段，跳过的小时不放置。
+        """
+        midnight = datetime(day.year, day.month, day.day)
+        hour_ts = []
+        for hour in range(24):
+            wall_time = midnight + timedelta(hours=hour)
+            fire_time = datetime.fromtimestamp(localize(wall_time, self.timezone).timestamp(), self.timezone)
+            hour_ts.append(int(fire_time.timestamp()) if fire_time.replace(tzinfo=None) == wall_time else None)
+
+        if all(ts is not None and ts == hour_ts[0] + hour * self.HOUR_SECONDS for hour, ts in enumerate(hour_ts)):
+            return [(0, pattern_len, hour_ts[0] - start_ts)]
+        return [(hour * self.HOUR_SECONDS, (hour + 1) * self.HOUR_SECONDS if hour < 23 else pattern_len,
+                 ts - start_ts) for hour, ts in enumerate(hour_ts) if ts is not None]
+
+    @staticmethod
+    def _add_segment(histogram: list, pattern: list, p_start: int, p_end: int, index: int):
+        """
+        histogram[index:] += pattern[p_start:p_end]，超出时间轴的部分忽略。
+        """
+        if index < 0:
+            p_start -= index
+            index = 0
+        p_end = min(p_end, p_start + len(histogram) - index)
+        if p_end <= p_start:
+            return
+        end = index + p_end - p_start
+        histogram[index:end] = map(add, histogram[index:end], pattern[p_start:p_end])
+
+    @staticmethod
+    def _add_buckets(buckets: list, resolution: int, seconds: int, cache: dict, pattern: list, p_start: int,
+                     p_end: int, index: int):
+        """
+        按resolution合并后累加：buckets[(index + i) // resolution] += pattern[p_start + i]，超出时间轴的部分忽略。
+        :param cache: 同一分布、同一段在桶内位置相同时合并结果相同(如不含夏令时切换的整天)，只合并一次；
+        """
+        if index < 0:
+            p_start -= index
+            index = 0
+        p_end = min(p_end, p_start + seconds - index)
+        if p_end <= p_start:
+            return
+        phase = index % resolution
+        key = (id(pattern), p_start, p_end, phase)
+        merged = cache.get(key)
+        if merged is None:
+            part = pattern[p_start:p_end]
+            first = resolution - phase
+            merged = cache[key] = [sum(part[:first])] + [sum(part[i:i + resolution])
+                                                         for i in range(first, len(part), resolution)]
+        i = index // resolution
+        buckets[i:i + len(merged)] = map(add, buckets[i:i + len(merged)], merged)
+
+    # -----------------------------------------------------------------------
+    # 统计
+    # -----------------------------------------------------------------------
+    @staticmethod
+    def _running(histogram: list, duration: float):
+        """
+        每秒正在执行的数量：每次执行持续duration秒，即最近duration秒内的执行次数之和。
+        """
+        duration = max(math.ceil(duration), 1)
+        if duration == 1:
+            return histogram
+        cumulative = list(accumulate(histogram, initial=0))
+        return list(map(sub, cumulative[1:], [0] * (duration - 1) + cumulative[:len(histogram) - duration + 1]))
+
+    def _summary(self, histogram: list, running: list, start_ts: int, resolution: int):
+        """
+        总数、每秒峰值、峰值并发及按resolution合并的直方图。
+        """
+        peak = max(histogram)
+        peak_running = max(running)
+        return {
+            'fires': sum(histogram),
+            'peak': {'fires': peak, 'time': self._time_str(start_ts + histogram.index(peak))},
+            'peak_concurrency': {'running': peak_running, 'time': self._time_str(start_ts + running.index(peak_running))},
+            'resolution': resolution,
+            'histogram': histogram if resolution == 1 else
+            [sum(histogram[i:i + resolution]) for i in range(0, len(histogram), resolution)],
+        }
+
+    def _busiest_windows(self, histogram: list, start_ts: int, window: int, top: int):
+        """
+        按window秒分段，执行次数最多的top段。
+        """
+        totals = [sum(histogram[i:i + window]) for i in range(0, len(histogram), window)]
+        busiest = heapq.nlargest(top, (i for i, total in enumerate(totals) if total), key=totals.__getitem__)
+        return [{'start': self._time_str(start_ts + i * window), 'fires': totals[i]} for i in busiest]
+
+    def _time_str(self, ts: int):
+        return datetime.fromtimestamp(ts, self.timezone).strftime(self.TIME_FMT)
@@ -0,0 +1,983 @@
+import json
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from apscheduler.job import Job
+from apscheduler.jobstores.base import ConflictingIdError, JobLookupError
+from apscheduler.jobstores.redis import RedisJobStore
+from apscheduler.util import datetime_to_utc_timestamp, utc, utc_timestamp_to_datetime
+
+from .jobCfg import JobSortType
+from .cronFiled import TiggerCronStr
+from .jobMetrics import JOB_STORE_SECONDS
+from .jobMemoryTier import JobMemoryTier
+from .jobSerializer import JobSerializer
+
+
+# ---------------------------------------------------------------------------
+# job展示信息缓存
+# ---------------------------------------------------------------------------
+#
+class JobViewCache(object):
+    """
+    按job id缓存job展示信息的LRU，线程安全。
+    """
+    def __init__(self, max_size: int):
+        """
+
+        :param max_size:
+        """
+        self.max_size = max_size
+        self._views = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, job_id: str):
+        with self._lock:
+            view = self._views.get(job_id)
+            if view is not None:
+                self._views.move_to_end(job_id)
+            return view
+
+    def put(self, job_id: str, view: dict):
+        with self._lock:
+            self._views[job_id] = view
+            self._views.move_to_end(job_id)
+            while len(self._views) > self.max_size:
+                self._views.popitem(last=False)
+
+    def invalidate(self, job_id: str):
+        with self._lock:
+            self._views.pop(job_id, None)
+
+    def invalidate_many(self, job_ids: list = None):
+        """
+        job_ids为None时全部失效。
+        """
+        with self._lock:
+            if job_ids is None:
+                self._views.clear()
+                return
+            for job_id in job_ids:
+                self._views.pop(job_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._views.clear()
+
+
+# ---------------------------------------------------------------------------
+# 定时任务Redis存储
+# ---------------------------------------------------------------------------
+#
+class JobRedisStore(RedisJobStore):
+    """
+    在RedisJobStore的基础上增加:
+    分页读取：总数取自jobs hash的长度，每页只读取当前页的job，不再全量加载；
+    批量读写：多个job的读取按批合并到pipeline中，更新、删除按批在一个Lua脚本中完成，减少Redis往返；
+    展示信息：每次写入job时同时在views hash中保存其展示信息(含原始cron字符串)，
+             列表查询直接读取展示信息和run_times中的下次执行时间，不再反序列化job；
+    集群模式：多个节点共用存储时，每次到期执行先用SET NX抢占执行锁，只有抢到锁的节点执行；
+    版本号：每次写入或删除job(包括触发执行后更新下次执行时间)时递增，查询结果可按版本号缓存；
+    序列化：可替换为紧凑格式(见CompactJobSerializer)，读取时兼容已有的pickle数据；
+    二级索引：写入/删除job时同时维护暂停状态、函数、下游api及job id的索引，按条件过滤时只读索引，不扫描全部job；
+    进程内副本：可在Redis前增加解码后的job副本(见JobMemoryTier)，调度器读取job及下次执行时间不再访问Redis。
+    """
+    SORT_TYPE = JobSortType()
+    #: 批量读写时每个pipeline包含的job数
+    BATCH_SIZE = 500
+    #: 进程内展示信息缓存的job数
+    VIEW_CACHE_SIZE = 10000
+    #: 索引结构的版本，变化时启动后重建索引
+    INDEX_VERSION = '3'
+
+    def __init__(self, *args, views_key=None, version_key=None, serializer=None, **kwargs):
+        """
+
+        :param views_key: 保存job展示信息的hash，默认为 "<jobs_key>.views"；
+        :param version_key: 保存版本号的key，默认为 "<jobs_key>.version"；
+        :param serializer: job序列化方式，默认同RedisJobStore使用pickle；
+        """
+        super().__init__(*args, **kwargs)
+        self.serializer = serializer or JobSerializer(pickle_protocol=self.pickle_protocol)
+        self.views_key = views_key or f'{self.jobs_key}.views'
+        self.version_key = version_key or f'{self.jobs_key}.version'
+        # 二级索引: 暂停的job及全部job id(score均为0，按字典序的zset)、函数/下游api(set)，
+        # 以及每个job所在的函数/下游api索引(hash)，写入时据此移出原来的索引，不需要读取原展示信息
+        self.index_prefix = f'{self.jobs_key}.idx'
+        self.paused_key = f'{self.index_prefix}:paused'
+        self.names_key = f'{self.index_prefix}:names'
+        self.job_indexes_key = f'{self.index_prefix}:jobs'
+        self.index_version_key = f'{self.index_prefix}:version'
+        self.view_cache = JobViewCache(self.VIEW_CACHE_SIZE)
+        # 进程内展示信息缓存只有在其它进程的变更会使其失效(集群模式或进程内副本)时才使用
+        self.cache_views = False
+
+        # 集群模式，见enable_cluster
+        self.node_id = None
+        self.lock_ttl = None
+        self.lock_retry = None
+
+        # 进程内副本，见enable_memory_tier
+        self.memory_tier = None
+
+    def enable_cluster(self, node_id: str, lock_ttl: float, lock_retry: float):
+        """
+        开启集群模式。
+        :param node_id: 本节点id，作为执行锁的值；
+        :param lock_ttl: 执行锁过期时间(秒)，需大于抢到锁后更新下次执行时间所需的时间；
+        :param lock_retry: 到期job被其它节点锁定时，本节点再次检查的间隔(秒)；
+        :return:
+        """
+        self.node_id = node_id
+        self.lock_ttl = lock_ttl
+        self.lock_retry = lock_retry
+        self.cache_views = True
+
+    def enable_memory_tier(self, channel: str, check_interval: float = 5, log=None):
+        """
+        开启进程内副本，同步完成全量加载。
+        :param channel: 广播变更的pub/sub频道，共用存储的进程需一致；
+        :param check_interval: 检查版本号的间隔(秒)；
+        :param log:
+        :return:
+        """
+        self.memory_tier = JobMemoryTier(self, channel, check_interval, log)
+        self.memory_tier.start()
+        self.cache_views = True
+
+    def _ready_tier(self):
+        """
+        可用的进程内副本，未开启或同步中断时返回None(直接读取Redis)。
+        """
+        tier = self.memory_tier
+        return tier if tier is not None and tier.ready else None
+
+    # -----------------------------------------------------------------------
+    # BaseJobStore
+    # -----------------------------------------------------------------------
+    @JOB_STORE_SECONDS.time('lookup_job')
+    def lookup_job(self, job_id):
+        tier = self._ready_tier()
+        if tier is not None:
+            return tier.lookup_job(job_id)
+        return super().lookup_job(job_id)
+
+    @JOB_STORE_SECONDS.time('get_due_jobs')
+    def get_due_jobs(self, now):
+        tier = self._ready_tier()
+        timestamp = datetime_to_utc_timestamp(now)
+        if self.node_id is None:
+            if tier is not None:
+                return tier.lookup_jobs([job_id for job_id, _ in tier.get_due(timestamp)])
+            return super().get_due_jobs(now)
+
+        # 集群模式: 执行锁的key包含本次的计划执行时间，每次执行只有一个节点能抢到
+        if tier is not None:
+            due = tier.get_due(timestamp)
+        else:
+            due = self.redis.zrangebyscore(self.run_times_key, 0, timestamp, withscores=True)
+        if not due:
+            return []
+
+        with self.redis.pipeline(transaction=False) as pipe:
+            for job_id, run_time in due:
+                pipe.set(self._lock_key(job_id, run_time), self.node_id, nx=True, px=int(self.lock_ttl * 1000))
+            locked = pipe.execute()
+        return self.lookup_jobs([self._decode_id(job_id) for (job_id, _), acquired in zip(due, locked) if acquired])
+
+    @JOB_STORE_SECONDS.time('get_next_run_time')
+    def get_next_run_time(self):
+        tier = self._ready_tier()
+        if tier is not None:
+            run_time = tier.get_next_run_time()
+            next_run_time = utc_timestamp_to_datetime(run_time) if run_time is not None else None
+        else:
+            next_run_time = super().get_next_run_time()
+        if self.node_id is None or next_run_time is None:
+            return next_run_time
+
+        # 集群模式: 仍到期的job已被其它节点锁定，等其更新下次执行时间后再检查，避免空转
+        now = datetime.now(utc)
+        if next_run_time <= now:
+            return now + timedelta(seconds=self.lock_retry)
+        return next_run_time
+
+    def get_all_jobs(self):
+        tier = self._ready_tier()
+        if tier is not None:
+            return tier.get_all_jobs()
+        return super().get_all_jobs()
+
+    @JOB_STORE_SECONDS.time('add_job')
+    def add_job(self, job):
+        if not self._write_jobs([job], 'new'):
+            raise ConflictingIdError(job.id)
+
+    @JOB_STORE_SECONDS.time('update_job')
+    def update_job(self, job):
+        # 每次触发执行后调用，检查存在与写入在同一个脚本中完成，只需一次往返
+        if not self._write_jobs([job], 'exists'):
+            raise JobLookupError(job.id)
+
+    @JOB_STORE_SECONDS.time('remove_job')
+    def remove_job(self, job_id):
+        if not self.remove_jobs([job_id]):
+            raise JobLookupError(job_id)
+
+    def remove_all_jobs(self):
+        index_keys = list(self.redis.scan_iter(f'{self.index_prefix}:*'))
+        with self.redis.pipeline() as pipe:
+            pipe.delete(self.jobs_key, self.run_times_key, self.views_key, *index_keys)
+            pipe.set(self.index_version_key, self.INDEX_VERSION)
+            pipe.incr(self.version_key)
+            version = pipe.execute()[-1]
+        self.view_cache.clear()
+        if self.memory_tier is not None:
+            self.memory_tier.clear(version)
+
+    # -----------------------------------------------------------------------
+    # 分页查询
+    # -----------------------------------------------------------------------
+    def get_version(self):
+        """
+        当前版本号，job有任何变化时递增(集群中各节点共用)。
+        :return:
+        """
+        return int(self.redis.get(self.version_key) or 0)
+
+    @JOB_STORE_SECONDS.time('get_due_jobs_between')
+    def get_due_jobs_between(self, start: datetime, end: datetime):
+        """
+        下次执行时间在[start, end)内的job。
+        :param start:
+        :param end:
+        :return:
+        """
+        job_ids = self.redis.zrangebyscore(self.run_times_key, datetime_to_utc_timestamp(start),
+                                           f'({datetime_to_utc_timestamp(end)}')
+        return self.lookup_jobs(job_ids)
+
+    def count_jobs(self):
+        """
+        job总数(包括暂停的job)。
+        :return:
+        """
+        tier = self._ready_tier()
+        if tier is not None:
+            return tier.count()
+        return self.redis.hlen(self.jobs_key)
+
+    def get_jobs_page(self, offset: int, limit: int, sort_by: str = None):
+        """
+        读取一页job。
+        :param offset: 起始位置，从0开始；
+        :param limit: 读取条数；
+        :param sort_by: 排序方式，见JobSortType，默认按下次执行时间排序；
+        :return:
+        """
+        page = self._get_page_run_times(offset, limit, sort_by)
+        return self.lookup_jobs([job_id for job_id, _ in page])
+
+    @JOB_STORE_SECONDS.time('get_job_views_page')
+    def get_job_views_page(self, offset: int, limit: int, sort_by: str = None):
+        """
+        读取一页job的展示信息。
+        :param offset: 起始位置，从0开始；
+        :param limit: 读取条数；
+        :param sort_by: 排序方式，见JobSortType，默认按下次执行时间排序；
+        :return: [(展示信息, 下次执行时间的utc时间戳 or None)]
+        """
+        page = self._get_page_run_times(offset, limit, sort_by)
+        views = self.get_job_views([job_id for job_id, _ in page])
+        return [(views[job_id], run_time) for job_id, run_time in page if job_id in views]
+
+    @JOB_STORE_SECONDS.time('get_job_view')
+    def get_job_view(self, job_id: str):
+        """
+        读取单个job的展示信息。
+        :param job_id:
+        :return: (展示信息, 下次执行时间的utc时间戳 or None)，job不存在时返回None
+        """
+        views = self.get_job_views([job_id])
+        if job_id not in views:
+            return None
+        return views[job_id], self._get_run_times([job_id])[0]
+
+    def get_job_views(self, job_ids: list):
+        """
+        批量读取展示信息：先查进程内缓存，再查views hash；
+        没有展示信息的旧job反序列化一次后补写。
+        :param job_ids:
+        :return: {job_id: 展示信息}，不存在的job不返回
+        """
+        views = self._read_views(job_ids)
+        unrendered_ids = [job_id for job_id in job_ids if job_id not in views]
+        if unrendered_ids:
+            jobs = self.lookup_jobs(unrendered_ids)
+            with self.redis.pipeline() as pipe:
+                for job in jobs:
+                    views[job.id] = self.render_view(job)
+                    pipe.hset(self.views_key, job.id, self._dump_view(views[job.id]))
+                    self._add_indexes(pipe, job.id, views[job.id])
+                pipe.execute()
+            self._cache_views({job.id: views[job.id] for job in jobs})
+
+        return views
+
+    # -----------------------------------------------------------------------
+    # 按条件查询(二级索引)
+    # -----------------------------------------------------------------------
+    @JOB_STORE_SECONDS.time('find_job_views_page')
+    def find_job_views_page(self, offset: int, limit: int, sort_by: str = None, paused: bool = None,
+                            func: str = None, api_name: str = None, api_method: str = None, name_prefix: str = None,
+                            run_time_min: float = None, run_time_max: float = None):
+        """
+        按条件过滤后分页读取展示信息，只读取索引及命中job的下次执行时间。
+        :param offset: 起始位置，从0开始；
+        :param limit: 读取条数；
+        :param sort_by: 排序方式，见JobSortType，默认按下次执行时间排序(暂停的job排在最后)；
+        :param paused: True--只查暂停的job；False--只查未暂停的job；
+        :param func: job函数名；
+        :param api_name: start_job_by_api调用的下游api名称；
+        :param api_method: 下游api方法名，需同时指定api_name；
+        :param name_prefix: job id(name)前缀；
+        :param run_time_min: 下次执行时间下限(utc时间戳，含)；
+        :param run_time_max: 下次执行时间上限(utc时间戳，含)；
+        :return: (命中总数, [(展示信息, 下次执行时间的utc时间戳 or None)])
+        """
+        if api_method and not api_name:
+            raise ValueError('api_method requires api_name!')
+        has_range = run_time_min is not None or run_time_max is not None
+        if paused and has_range:
+            return 0, []
+
+        if sort_by not in (None, self.SORT_TYPE.NEXT_RUN_TIME, self.SORT_TYPE.ID):
+            raise ValueError(f'undefined sort_by: {sort_by}')
+        by_id = sort_by == self.SORT_TYPE.ID
+
+        set_keys = []
+        if func:
+            set_keys.append(self._func_key(func))
+        if api_name:
+            set_keys.append(self._api_key(api_name, api_method))
+        active = paused is False or has_range
+
+        # 只用一个索引即可按所需顺序分页时，在Redis中取区间，总数取自索引计数
+        if not set_keys and offset >= 0 and limit > 0:
+            total, page = None, None
+            if paused:
+                # 暂停的job按id排序(两种排序方式相同)
+                if name_prefix:
+                    lex_min, lex_max = self._lex_range(name_prefix)
+                    total = self.redis.zlexcount(self.paused_key, lex_min, lex_max)
+                    job_ids = self.redis.zrangebylex(self.paused_key, lex_min, lex_max, start=offset, num=limit)
+                else:
+                    total = self.redis.zcard(self.paused_key)
+                    job_ids = self.redis.zrange(self.paused_key, offset, offset + limit - 1)
+                page = [(self._decode_id(job_id), None) for job_id in job_ids]
+            elif active and not name_prefix and not by_id:
+                score_min = '-inf' if run_time_min is None else run_time_min
+                score_max = '+inf' if run_time_max is None else run_time_max
+                total = self.redis.zcount(self.run_times_key, score_min, score_max)
+                page = [(self._decode_id(job_id), run_time) for job_id, run_time in self.redis.zrangebyscore(
+                    self.run_times_key, score_min, score_max, start=offset, num=limit, withscores=True)]
+            elif not active and name_prefix and by_id:
+                lex_min, lex_max = self._lex_range(name_prefix)
+                total = self.redis.zlexcount(self.names_key, lex_min, lex_max)
+                job_ids = [self._decode_id(job_id) for job_id in
+                           self.redis.zrangebylex(self.names_key, lex_min, lex_max, start=offset, num=limit)]
+                page = list(zip(job_ids, self._get_run_times(job_ids)))
+            if page is not None:
+                views = self.get_job_views([job_id for job_id, _ in page])
+                return total, [(views[job_id], run_time) for job_id, run_time in page if job_id in views]
+
+        # 多个条件组合(索引求交集或再按前缀/时间过滤)时读取全部命中的job后排序
+        if set_keys:
+            job_ids = [self._decode_id(job_id) for job_id in self.redis.sinter(set_keys)]
+            if name_prefix:
+                job_ids = [job_id for job_id in job_ids if job_id.startswith(name_prefix)]
+            rows = list(zip(job_ids, self._get_run_times(job_ids)))
+            if paused:
+                # 暂停的job即没有下次执行时间的job
+                rows = [(job_id, run_time) for job_id, run_time in rows if run_time is None]
+            elif active:
+                rows = [(job_id, run_time) for job_id, run_time in rows if run_time is not None
+                        and (run_time_min is None or run_time >= run_time_min)
+                        and (run_time_max is None or run_time <= run_time_max)]
+        elif paused:
+            if name_prefix:
+                job_ids = self.redis.zrangebylex(self.paused_key, *self._lex_range(name_prefix))
+            else:
+                job_ids = self.redis.zrange(self.paused_key, 0, -1)
+            rows = [(self._decode_id(job_id), None) for job_id in job_ids]
+        elif active:
+            rows = [(self._decode_id(job_id), run_time) for job_id, run_time in self.redis.zrangebyscore(
+                self.run_times_key, '-inf' if run_time_min is None else run_time_min,
+                '+inf' if run_time_max is None else run_time_max, withscores=True)]
+            if name_prefix:
+                rows = [(job_id, run_time) for job_id, run_time in rows if job_id.startswith(name_prefix)]
+        elif name_prefix:
+            job_ids = [self._decode_id(job_id) for job_id in
+                       self.redis.zrangebylex(self.names_key, *self._lex_range(name_prefix))]
+            rows = list(zip(job_ids, self._get_run_times(job_ids)))
+        else:
+            raise ValueError('at least one filter is required!')
+
+        if by_id:
+            rows.sort(key=lambda row: row[0])
+        else:
+            rows.sort(key=lambda row: (row[1] is None, row[1] or 0, row[0]))
+
+        page = rows[max(offset, 0):max(offset, 0) + limit] if limit > 0 else []
+        views = self.get_job_views([job_id for job_id, _ in page])
+        return len(rows), [(views[job_id], run_time) for job_id, run_time in page if job_id in views]
+
+    def ensure_indexes(self):
+        """
+        索引不存在或版本不一致(如升级前已有的job)时重建。
+        :return: 是否重建了索引
+        """
+        index_version = self.redis.get(self.index_version_key)
+        if index_version is not None and index_version.decode('utf-8') == self.INDEX_VERSION:
+            return False
+        self.rebuild_indexes()
+        return True
+
+    @JOB_STORE_SECONDS.time('rebuild_indexes')
+    def rebuild_indexes(self):
+        """
+        按批扫描全部job重建索引。重建期间写入的job可能需要再次重建才能被索引。
+        :return: 索引的job数
+        """
+        index_keys = [key for key in self.redis.scan_iter(f'{self.index_prefix}:*')]
+        if index_keys:
+            self.redis.delete(*index_keys)
+
+        count = 0
+        batch_ids = []
+        for job_id, _ in self.redis.hscan_iter(self.jobs_key, count=self.BATCH_SIZE):
+            batch_ids.append(self._decode_id(job_id))
+            if len(batch_ids) >= self.BATCH_SIZE:
+                count += self._index_jobs(batch_ids)
+                batch_ids = []
+        if batch_ids:
+            count += self._index_jobs(batch_ids)
+
+        self.redis.set(self.index_version_key, self.INDEX_VERSION)
+        return count
+
+    # -----------------------------------------------------------------------
+    # 导出
+    # -----------------------------------------------------------------------
+    def iter_job_views(self, batch_size: int = None):
+        """
+        按job id顺序逐批读取全部job的展示信息：以上一批最后的job id为游标读取job id索引，
+        每批只读一次展示信息和下次执行时间，不反序列化job，也不写入进程内缓存，内存占用与job总数无关。
+        导出期间新增或删除的job可能不在结果中。
+        :param batch_size: 每批job数，默认为BATCH_SIZE；
+        :return: 生成器，每项为 (展示信息, 下次执行时间的utc时间戳 or None)
+        """
+        batch_size = batch_size or self.BATCH_SIZE
+        cursor = b'-'
+        while True:
+            job_ids = self.redis.zrangebylex(self.names_key, cursor, b'+', start=0, num=batch_size)
+            if not job_ids:
+                return
+            cursor = b'(' + job_ids[-1]
+            job_ids = [self._decode_id(job_id) for job_id in job_ids]
+
+            views = {}
+            for job_id, view_json in zip(job_ids, self.redis.hmget(self.views_key, *job_ids)):
+                if view_json is not None:
+                    views[job_id] = json.loads(view_json)
+            # 没有展示信息的旧job补写
+            unrendered_ids = [job_id for job_id in job_ids if job_id not in views]
+            if unrendered_ids:
+                views.update(self.get_job_views(unrendered_ids))
+
+            for job_id, run_time in zip(job_ids, self._get_run_times(job_ids)):
+                if job_id in views:
+                    yield views[job_id], run_time
+            if len(job_ids) < batch_size:
+                return
+
+    @JOB_STORE_SECONDS.time('lookup_jobs')
+    def lookup_jobs(self, job_ids: list):
+        """
+        批量读取job，已不存在的job会被忽略。
+        :param job_ids:
+        :return:
+        """
+        tier = self._ready_tier()
+        if tier is not None:
+            return tier.lookup_jobs(job_ids)
+        jobs = []
+        for batch_ids in self._batches(job_ids):
+            job_states = self.redis.hmget(self.jobs_key, *batch_ids)
+            jobs.extend(self._reconstitute_jobs((job_id, job_state) for job_id, job_state in zip(batch_ids, job_states)
+                                                if job_state is not None))
+        return jobs
+
+    # -----------------------------------------------------------------------
+    # 批量写入
+    # -----------------------------------------------------------------------
+    def add_jobs(self, jobs: list):
+        """
+        批量添加job，已存在的job直接覆盖(同replace_existing=True)。
+        :param jobs:
+        :return:
+        """
+        self.update_jobs(jobs)
+
+    @JOB_STORE_SECONDS.time('update_jobs')
+    def update_jobs(self, jobs: list):
+        """
+        批量写入job(新增或覆盖)，每批在一个脚本中写入。
+        展示信息是否变化在脚本中与views hash中的当前值比较，不使用进程内缓存，也不需要WATCH重试。
+        :param jobs:
+        :return:
+        """
+        for batch_jobs in self._batches(jobs):
+            self._write_jobs(batch_jobs)
+
+    @JOB_STORE_SECONDS.time('remove_jobs')
+    def remove_jobs(self, job_ids: list):
+        """
+        批量删除job，每批在一个脚本中删除。
+        :param job_ids:
+        :return: 实际删除的job id
+        """
+        removed_ids = []
+        for batch_ids in self._batches(job_ids):
+            results = self.redis.eval(self.REMOVE_JOBS_SCRIPT, 7, *self._write_keys(), *batch_ids)
+            for job_id in batch_ids:
+                self.view_cache.invalidate(job_id)
+            if self.memory_tier is not None:
+                self.memory_tier.apply(results[-1], removed_ids=batch_ids)
+            removed_ids.extend(job_id for job_id, count in zip(batch_ids, results) if count)
+        return removed_ids
+
+    # -----------------------------------------------------------------------
+    # 进程内副本的加载
+    # -----------------------------------------------------------------------
+    @JOB_STORE_SECONDS.time('load_job_states')
+    def load_job_states(self, batch_size: int = None):
+        """
+        按批扫描并解码全部job，无法解码的job被忽略(不删除)。
+        :param batch_size:
+        :return: ({job_id: job状态}, {job_id: 下次执行时间的utc时间戳})
+        """
+        states = {}
+        for job_id, job_state in self.redis.hscan_iter(self.jobs_key, count=batch_size or self.BATCH_SIZE):
+            job_id = self._decode_id(job_id)
+            state = self._load_state(job_id, job_state)
+            if state is not None:
+                states[job_id] = state
+        run_times = {self._decode_id(job_id): run_time for job_id, run_time in
+                     self.redis.zscan_iter(self.run_times_key, count=batch_size or self.BATCH_SIZE)}
+        return states, {job_id: run_time for job_id, run_time in run_times.items() if job_id in states}
+
+    @JOB_STORE_SECONDS.time('fetch_job_states')
+    def fetch_job_states(self, job_ids: list):
+        """
+        从Redis读取一批job的当前状态(不经过进程内副本)。
+        :param job_ids:
+        :return: [(job_id, job状态 or None, 下次执行时间的utc时间戳 or None)]，None表示job已删除
+        """
+        with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hmget(self.jobs_key, *job_ids)
+            for job_id in job_ids:
+                pipe.zscore(self.run_times_key, job_id)
+            results = pipe.execute()
+        return [(job_id, self._load_state(job_id, job_state) if job_state is not None else None, run_time)
+                for job_id, job_state, run_time in zip(job_ids, results[0], results[1:])]
+
+    def _load_state(self, job_id: str, job_state: bytes):
+        try:
+            return self.serializer.loads(job_state)
+        except Exception:
+            self._logger.exception('Unable to restore job "%s" -- skipping it', job_id)
+            return None
+
+    @JOB_STORE_SECONDS.time('migrate_jobs')
+    def migrate_jobs(self):
+        """
+        按当前序列化方式重写其它格式保存的job(如pickle ==> 紧凑格式)，按批扫描，不阻塞Redis。
+        无法转换的job(如非cron触发器)保持原样。
+        :return: 重写的job数
+        """
+        migrated = 0
+        batch = []
+        for job_id, job_state in self.redis.hscan_iter(self.jobs_key, count=self.BATCH_SIZE):
+            if self.serializer.is_current(job_state):
+                continue
+            new_state = self.serializer.dumps(self.serializer.loads(job_state))
+            if not self.serializer.is_current(new_state):
+                continue
+            batch.extend((job_id, job_state, new_state))
+            if len(batch) >= self.BATCH_SIZE * 3:
+                migrated += self._replace_states(batch)
+                batch = []
+        if batch:
+            migrated += self._replace_states(batch)
+        return migrated
+
+    # -----------------------------------------------------------------------
+    # 内部方法
+    # -----------------------------------------------------------------------
+    #: 只有job仍为扫描时的数据才覆盖，扫描后被调度器更新或删除的job不受影响
+    REPLACE_STATES_SCRIPT = """
+        local n = 0
+        for i = 1, #ARGV, 3 do
+            if redis.call('HGET', KEYS[1], ARGV[i]) == ARGV[i + 1] then
+                redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 2])
+                n = n + 1
+            end
+        end
+        return n
+    """
+
+    #: 写入一批job：KEYS见_write_keys，ARGV为 [检查, (job_id, 状态, 下次执行时间, 展示信息, 索引数, 索引...)...]
+    #: 检查: new--job均不存在，exists--job均存在，空--不检查；不满足时不写入，返回 {0, job_id}，否则返回 {1, 版本号}
+    #: 展示信息与已保存的相同时(如触发执行后只更新下次执行时间)不写展示信息及函数/下游api索引
+    WRITE_JOBS_SCRIPT = r"""
+        local check = ARGV[1]
+        local i = 2
+        while check ~= '' and i <= #ARGV do
+            local exists = redis.call('HEXISTS', KEYS[1], ARGV[i]) == 1
+            if exists == (check == 'new') then
+                return {0, ARGV[i]}
+            end
+            i = i + 5 + tonumber(ARGV[i + 4])
+        end
+
+        i = 2
+        while i <= #ARGV do
+            local job_id, run_time, view, n = ARGV[i], ARGV[i + 2], ARGV[i + 3], tonumber(ARGV[i + 4])
+            redis.call('HSET', KEYS[1], job_id, ARGV[i + 1])
+            if run_time ~= '' then
+                redis.call('ZADD', KEYS[2], run_time, job_id)
+                redis.call('ZREM', KEYS[3], job_id)
+            else
+                redis.call('ZREM', KEYS[2], job_id)
+                redis.call('ZADD', KEYS[3], 0, job_id)
+            end
+            redis.call('ZADD', KEYS[4], 0, job_id)
+            if redis.call('HGET', KEYS[5], job_id) ~= view then
+                redis.call('HSET', KEYS[5], job_id, view)
+                local new_keys, added = {}, {}
+                for j = 1, n do
+                    new_keys[j] = ARGV[i + 4 + j]
+                    added[ARGV[i + 4 + j]] = true
+                end
+                local old_keys = redis.call('HGET', KEYS[6], job_id)
+                if old_keys then
+                    for key in string.gmatch(old_keys, '[^\n]+') do
+                        if added[key] then
+                            added[key] = nil
+                        else
+                            redis.call('SREM', key, job_id)
+                        end
+                    end
+                end
+                for key in pairs(added) do
+                    redis.call('SADD', key, job_id)
+                end
+                redis.call('HSET', KEYS[6], job_id, table.concat(new_keys, '\n'))
+            end
+            i = i + 5 + n
+        end
+        return {1, redis.call('INCR', KEYS[7])}
+    """
+
+    #: 删除一批job：KEYS同上，ARGV为job id，返回 {每个job是否存在..., 版本号}
+    REMOVE_JOBS_SCRIPT = r"""
+        local results = {}
+        for i, job_id in ipairs(ARGV) do
+            results[i] = redis.call('HDEL', KEYS[1], job_id)
+            redis.call('ZREM', KEYS[2], job_id)
+            redis.call('ZREM', KEYS[3], job_id)
+            redis.call('ZREM', KEYS[4], job_id)
+            redis.call('HDEL', KEYS[5], job_id)
+            local old_keys = redis.call('HGET', KEYS[6], job_id)
+            if old_keys then
+                for key in string.gmatch(old_keys, '[^\n]+') do
+                    redis.call('SREM', key, job_id)
+                end
+                redis.call('HDEL', KEYS[6], job_id)
+            end
+        end
+        results[#ARGV + 1] = redis.call('INCR', KEYS[7])
+        return results
+    """
+
+    def _write_keys(self):
+        return (self.jobs_key, self.run_times_key, self.paused_key, self.names_key, self.views_key,
+                self.job_indexes_key, self.version_key)
+
+    def _write_jobs(self, jobs: list, check: str = ''):
+        """
+        写入一批job，并更新进程内缓存及副本。
+        :param jobs:
+        :param check: 见WRITE_JOBS_SCRIPT；
+        :return: 是否写入(检查不满足时为False)
+        """
+        args = [check]
+        views = {}
+        for job in jobs:
+            view = views[job.id] = self.render_view(job)
+            run_time = datetime_to_utc_timestamp(job.next_run_time) if job.next_run_time else ''
+            index_keys = sorted(self._index_keys(view))
+            args.extend((job.id, self._serialize_job(job), run_time, self._dump_view(view), len(index_keys),
+                         *index_keys))
+        written, version = self.redis.eval(self.WRITE_JOBS_SCRIPT, 7, *self._write_keys(), *args)
+        if not written:
+            return False
+        self._cache_views(views)
+        if self.memory_tier is not None:
+            self.memory_tier.apply(version, jobs=jobs)
+        return True
+
+    def _replace_states(self, args: list):
+        """
+
+        :param args: [job_id, 原数据, 新数据, ...]
+        :return: 覆盖的job数
+        """
+        return self.redis.eval(self.REPLACE_STATES_SCRIPT, 1, self.jobs_key, *args)
+
+    def _reconstitute_job(self, job_state):
+        """
+        同RedisJobStore，反序列化改为使用self.serializer。
+        :param job_state:
+        :return:
+        """
+        job = Job.__new__(Job)
+        job.__setstate__(self.serializer.loads(job_state))
+        job._scheduler = self._scheduler
+        job._jobstore_alias = self._alias
+        return job
+
+    @staticmethod
+    def render_view(job):
+        """
+        job的展示信息，不含下次执行时间(取自run_times)。
+        :param job:
+        :return:
+        """
+        cron_str = getattr(job.trigger, 'cron_str', None)
+        view = {
+            "id": job.id,
+            "name": job.name,
+            "func": job.func.__name__,
+            "kwargs": job.kwargs,
+            "trigger": cron_str if cron_str else TiggerCronStr(str(job.trigger)).fmt_cron_str,
+        }
+        # 打散后的偏移秒数(见SmearedTrigger)
+        offset = getattr(job.trigger, 'offset', 0)
+        if offset:
+            view["offset"] = offset
+        return view
+
+    @staticmethod
+    def _dump_view(view: dict):
+        return json.dumps(view, ensure_ascii=False, default=str)
+
+    def _read_views(self, job_ids: list):
+        """
+        先查进程内缓存(见cache_views)，再查views hash，不补写。
+        :param job_ids:
+        :return: {job_id: 展示信息}
+        """
+        if not self.cache_views:
+            return self._fetch_views(self.redis, job_ids)
+
+        views = {}
+        missing_ids = []
+        for job_id in job_ids:
+            view = self.view_cache.get(job_id)
+            if view is None:
+                missing_ids.append(job_id)
+            else:
+                views[job_id] = view
+
+        fetched = self._fetch_views(self.redis, missing_ids)
+        self._cache_views(fetched)
+        views.update(fetched)
+        return views
+
+    def _fetch_views(self, redis, job_ids: list):
+        """
+        从views hash读取展示信息。
+        :param redis: Redis连接或pipeline；
+        :param job_ids:
+        :return: {job_id: 展示信息}
+        """
+        views = {}
+        for batch_ids in self._batches(job_ids):
+            for job_id, view_json in zip(batch_ids, redis.hmget(self.views_key, *batch_ids)):
+                if view_json is not None:
+                    views[job_id] = json.loads(view_json)
+        return views
+
+    def _cache_views(self, views: dict):
+        if self.cache_views:
+            for job_id, view in views.items():
+                self.view_cache.put(job_id, view)
+
+    def _index_keys(self, view: dict = None):
+        """
+        展示信息对应的函数/下游api索引。
+        :param view:
+        :return:
+        """
+        if view is None:
+            return set()
+        keys = {self._func_key(view['func'])}
+        kwargs = view.get('kwargs')
+        if not isinstance(kwargs, dict):
+            return keys
+        # 组合job(start_jobs_by_api)按其中每个请求索引
+        calls = kwargs.get('calls') if isinstance(kwargs.get('calls'), list) else [kwargs]
+        for call in calls:
+            api_call_str = call.get('api_call_str') if isinstance(call, dict) else None
+            if isinstance(api_call_str, str) and api_call_str:
+                api_name, _, api_method = api_call_str.partition(':')
+                keys.add(self._api_key(api_name))
+                keys.add(self._api_key(api_name, api_method))
+        return keys
+
+    def _add_indexes(self, pipe, job_id: str, view: dict):
+        """
+        写入尚未索引的job(补写展示信息或重建索引)的函数/下游api索引。
+        :param pipe:
+        :param job_id:
+        :param view:
+        :return:
+        """
+        index_keys = sorted(self._index_keys(view))
+        for key in index_keys:
+            pipe.sadd(key, job_id)
+        pipe.hset(self.job_indexes_key, job_id, '\n'.join(index_keys))
+
+    def _index_jobs(self, job_ids: list):
+        """
+        重建索引时写入一批job的索引。
+        :param job_ids:
+        :return:
+        """
+        views = self.get_job_views(job_ids)
+        run_times = self._get_run_times(job_ids)
+        with self.redis.pipeline(transaction=False) as pipe:
+            for job_id, run_time in zip(job_ids, run_times):
+                if job_id not in views:
+                    continue
+                pipe.zadd(self.names_key, {job_id: 0})
+                if run_time is None:
+                    pipe.zadd(self.paused_key, {job_id: 0})
+                self._add_indexes(pipe, job_id, views[job_id])
+            pipe.execute()
+        return len(views)
+
+    @staticmethod
+    def _lex_range(prefix: str):
+        """
+        按字典序的zset中以prefix开头的区间(zrangebylex的min/max)。
+        """
+        prefix = prefix.encode('utf-8')
+        return b'[' + prefix, b'[' + prefix + b'\xff'
+
+    def _func_key(self, func: str):
+        return f'{self.index_prefix}:func:{func}'
+
+    def _api_key(self, api_name: str, api_method: str = None):
+        if api_method:
+            return f'{self.index_prefix}:api:{api_name}:{api_method}'
+        return f'{self.index_prefix}:api:{api_name}'
+
+    def _get_run_times(self, job_ids: list):
+        """
+        批量读取下次执行时间。
+        :param job_ids:
+        :return: [下次执行时间的utc时间戳 or None]
+        """
+        tier = self._ready_tier()
+        if tier is not None:
+            return tier.get_run_times(job_ids)
+        run_times = []
+        for batch_ids in self._batches(job_ids):
+            with self.redis.pipeline(transaction=False) as pipe:
+                for job_id in batch_ids:
+                    pipe.zscore(self.run_times_key, job_id)
+                run_times.extend(pipe.execute())
+        return run_times
+
+    def _serialize_job(self, job):
+        """
+
+        :param job:
+        :return:
+        """
+        return self.serializer.dumps(job.__getstate__())
+
+    def _batches(self, items: list):
+        """
+
+        :param items:
+        :return:
+        """
+        for i in range(0, len(items), self.BATCH_SIZE):
+            yield items[i:i + self.BATCH_SIZE]
+
+    def _lock_key(self, job_id, run_time: float):
+        return f'{self.jobs_key}.lock:{self._decode_id(job_id)}:{run_time}'
+
+    @staticmethod
+    def _decode_id(job_id):
+        return job_id.decode('utf-8') if isinstance(job_id, bytes) else job_id
+
+    def _get_page_run_times(self, offset: int, limit: int, sort_by: str = None):
+        """
+        取一页job id及其下次执行时间。
+        :param offset:
+        :param limit:
+        :param sort_by:
+        :return: [(job_id, 下次执行时间的utc时间戳 or None)]
+        """
+        if offset < 0 or limit <= 0:
+            return []
+
+        if sort_by in (None, self.SORT_TYPE.NEXT_RUN_TIME):
+            return self._get_run_time_page(offset, limit)
+        elif sort_by == self.SORT_TYPE.ID:
+            # job id索引的score均为0，按字典序直接取区间
+            job_ids = [self._decode_id(job_id) for job_id in
+                       self.redis.zrange(self.names_key, offset, offset + limit - 1)]
+            return list(zip(job_ids, self._get_run_times(job_ids)))
+        else:
+            raise ValueError(f'undefined sort_by: {sort_by}')
+
+    def _get_run_time_page(self, offset: int, limit: int):
+        """
+        按下次执行时间取一页。
+        有下次执行时间的job直接从run_times有序集合中按区间读取；
+        暂停的job不在run_times中，与get_all_jobs一致排在最后，按id排序(从暂停索引中按区间读取)。
+        :param offset:
+        :param limit:
+        :return:
+        """
+        active_count = self.redis.zcard(self.run_times_key)
+
+        page = []
+        if offset < active_count:
+            page = [(self._decode_id(job_id), run_time) for job_id, run_time in
+                    self.redis.zrange(self.run_times_key, offset, offset + limit - 1, withscores=True)]
+
+        rest = limit - len(page)
+        if rest > 0:
+            paused_offset = max(offset - active_count, 0)
+            page = page + [(self._decode_id(job_id), None) for job_id in
+                           self.redis.zrange(self.paused_key, paused_offset, paused_offset + rest - 1)]
+
+        return page
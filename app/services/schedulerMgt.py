@@ -1,15 +1,33 @@
 from apscheduler.schedulers.background import BackgroundScheduler, BlockingScheduler
-from apscheduler.jobstores.redis import RedisJobStore
+from apscheduler.executors.pool import ThreadPoolExecutor, ProcessPoolExecutor
+from apscheduler.jobstores.memory import MemoryJobStore
 from apscheduler.job import Job
-
-from datetime import datetime
-
-from .jobCfg import SchedulerCfg, JobTriggerType
-from .cronFiled import CronFiled, TiggerCronStr
-from .. import MyLogger
-from myComUtil import FontColor
+from apscheduler.events import JobEvent, EVENT_JOB_ADDED, EVENT_JOB_MODIFIED, EVENT_JOB_REMOVED, \
+    EVENT_JOB_EXECUTED, EVENT_JOB_ERROR, EVENT_JOB_MISSED, EVENT_JOB_MAX_INSTANCES, EVENT_JOB_SUBMITTED
+from apscheduler.schedulers.base import STATE_STOPPED
+from apscheduler.util import astimezone, convert_to_datetime, datetime_to_utc_timestamp, utc_timestamp_to_datetime
+
+from datetime import datetime, timedelta
+import json
+import os
+
+from .jobCfg import SchedulerCfg, JobTriggerType, JobExecutorType, JobSerializerType, JobStatusType, SchedulerHostType
+from .cronFiled import CronFiledTrigger
+from .cronCompiled import CompiledCron, CompiledCronTrigger
+from .cronSmear import smear_offset, smear_window
+from .jobStore import JobRedisStore
+from .jobSerializer import JobSerializer, CompactJobSerializer
+from .jobHistory import JobHistory
+from .jobRetry import JobRetry
+from .jobSimulator import JobSimulator
+from .jobMetrics import metrics, JOB_EVENTS
+from .jobCluster import JobCluster
+from .jobLeader import JobLeader
+from .jobLogger import JobLogger
 from myRedisUtil import RedisClient
-from ..jobs.jobs import start_job_by_api
+from ..jobs.jobs import start_job_by_api, start_jobs_by_api, check_api_calls
+from ..requests import circuit_breakers, single_flight
+from ..requests.requestPolicy import RequestPolicy
 
 
 # ---------------------------------------------------------------------------
@@ -21,52 +39,263 @@ class SchedulerMgt(object):
 
     """
     TIME_FMT = '%Y-%m-%d %H:%M:%S'
+    MAX_FIRE_TIMES = 1000
+    #: 执行时间分布统计的最大秒数
+    MAX_HISTOGRAM_SECONDS = 3600
     JOB_STORE = 'redis'
     TRIGGER_TYPE = JobTriggerType()
-
-    def __init__(self, cfg_filename=None):
+    EXECUTOR_TYPE = JobExecutorType()
+    SERIALIZER_TYPE = JobSerializerType()
+    STATUS_TYPE = JobStatusType()
+    HOST_TYPE = SchedulerHostType()
+    #: add_job时可单独设置的job参数
+    JOB_OPTIONS = ('executor', 'max_instances', 'coalesce', 'misfire_grace_time')
+    #: 广播变更时超过该数量的job id不再逐个发送，对端按全部变更处理
+    PUBLISH_IDS_LIMIT = 1000
+    FUNCTION_MAP = {
+        "start_job_by_api": start_job_by_api,
+        "start_jobs_by_api": start_jobs_by_api,
+    }
+    #: job函数名 ==> 参数校验，添加job时执行
+    PARA_VALIDATORS = {
+        "start_jobs_by_api": check_api_calls,
+    }
+
+    def __init__(self, cfg_filename=None, scheduler_host=True, redis=None):
         """
 
+        :param cfg_filename:
+        :param scheduler_host: 为False时调度器以暂停状态启动，只读写job，不执行job；
+                               为elect时与共用存储的其它进程选举，只有选中的进程执行job(见JobLeader)；
+        :param redis: 使用已有的Redis连接(如基准测试中的本地Redis)，None时按redis-name连接；
         """
         # 初始化定时任务配置
         self.cfg_filename = cfg_filename
+        self.scheduler_host = scheduler_host
+        self.redis = redis
         self.scheduler_cfg = SchedulerCfg(self.cfg_filename)
+        self.timezone = astimezone(self.scheduler_cfg.timezone)
 
         # 初始化日志
-        self.log = MyLogger()
-        self.log.initLogger(fileName=self.scheduler_cfg.log_file)
+        self.log = JobLogger('job.scheduler')
+        self.log.initLogger(fileName=self.scheduler_cfg.log_file, level=self.scheduler_cfg.log_level,
+                            max_length=self.scheduler_cfg.log_max_length)
 
         self._init_scheduler()
 
+        # 升级前已有的job没有二级索引，启动时重建
+        if self.job_store.ensure_indexes():
+            self.log.info('重建定时任务索引！')
+
+        # 启动时转换已有job的序列化格式
+        if self.scheduler_host and self.scheduler_cfg.job_serializer_migrate:
+            self.migrate_jobs()
+
+        # 启动时从scheduler配置文件同目录下的job文件导入
+        if self.scheduler_host and self.scheduler_cfg.jobs_filename:
+            jobs_filename = os.path.join(os.path.dirname(self.scheduler_cfg.cfg_file), self.scheduler_cfg.jobs_filename)
+            self.load_jobs_file(jobs_filename)
+
     def _init_scheduler(self):
         """
         初始化触发器实例。
         :return:
         """
         # 设置存储
-        redis_cfg = RedisClient(self.scheduler_cfg.redis_name).redisCfg
-        self.log.debug(f'redisCfg: {redis_cfg}')
+        self.job_store = self._create_job_store()
+        self.job_store.serializer = self._create_serializer()
         job_stores = {
-            self.JOB_STORE: RedisJobStore(**redis_cfg)
+            self.JOB_STORE: self.job_store,
+            JobRetry.STORE: MemoryJobStore(),
+        }
+
+        scheduler_kwargs = {
+            'jobstores': job_stores,
+            'executors': self._create_executors(),
+            'job_defaults': self.scheduler_cfg.job_defaults,
         }
 
         # 根据定时任务类型，初始化对应定时任务
         if self.scheduler_cfg.trigger_type == self.TRIGGER_TYPE.BACKGROUND:
-            self.scheduler = BackgroundScheduler(jobstores=job_stores)
+            self.scheduler = BackgroundScheduler(**scheduler_kwargs)
         elif self.scheduler_cfg.trigger_type == self.TRIGGER_TYPE.BLOCKING:
-            self.scheduler = BlockingScheduler(jobstores=job_stores)
+            self.scheduler = BlockingScheduler(**scheduler_kwargs)
         else:
             raise ValueError(f'type must be Background or Blocking! input: {self.scheduler}')
 
-        self.start_scheduler()
+        # 执行历史
+        self.job_history = JobHistory(self.job_store.redis, self.scheduler_cfg.history_key_prefix,
+                                      self.scheduler_cfg.history_max_len)
+        self.scheduler.add_listener(self.job_history.on_job_event, EVENT_JOB_EXECUTED | EVENT_JOB_ERROR)
+
+        # 失败重试，熔断及请求合并状态保存在job存储的Redis中，各节点共享
+        self.job_retry = JobRetry(self.scheduler, self.JOB_STORE, self.log)
+        self.scheduler.add_listener(self.job_retry.on_job_event, EVENT_JOB_EXECUTED | EVENT_JOB_ERROR)
+        self.scheduler.add_listener(self.job_retry.on_job_changed,
+                                    EVENT_JOB_ADDED | EVENT_JOB_MODIFIED | EVENT_JOB_REMOVED)
+        circuit_breakers.key_prefix = self.scheduler_cfg.breaker_key_prefix
+        circuit_breakers.redis = self.job_store.redis
+        single_flight.key_prefix = self.scheduler_cfg.flight_key_prefix
+        single_flight.redis = self.job_store.redis
+
+        # 进程内job副本，调度器启动前完成加载
+        if self.scheduler_cfg.memory_tier:
+            self.job_store.enable_memory_tier(self.scheduler_cfg.memory_tier_channel,
+                                              self.scheduler_cfg.memory_tier_check, self.log)
+
+        # 监控指标
+        self._init_metrics()
+
+        # 集群模式
+        self.job_cluster = None
+        if self.scheduler_cfg.cluster_mode:
+            self.job_cluster = JobCluster(self.job_store.redis, self.scheduler_cfg.cluster_channel, self._on_peer_change)
+            self.job_store.enable_cluster(self.job_cluster.node_id, self.scheduler_cfg.cluster_lock_ttl,
+                                          self.scheduler_cfg.cluster_lock_retry)
+            self.job_cluster.start()
+            self.log.info('集群模式, node=%s', self.job_cluster.node_id)
+
+        # 调度进程选举：未选中的进程以暂停状态启动，租约过期后接管
+        self.job_leader = None
+        if self.scheduler_host == self.HOST_TYPE.ELECT:
+            self.job_leader = JobLeader(self.job_store.redis, self.scheduler_cfg.leader_key,
+                                        self.scheduler_cfg.leader_ttl, self._on_leader_change, self.log)
+            self.scheduler_host = self.job_leader.check()
+
+        self.start_scheduler(paused=not self.scheduler_host)
+        if self.job_leader is not None:
+            self.job_leader.start()
+
+    def _create_job_store(self):
+        """
+        按redis-name对应的Redis配置创建job存储，指定了redis时直接使用该连接。
+        :return:
+        """
+        if self.redis is not None:
+            job_store = JobRedisStore()
+            job_store.redis = self.redis
+            return job_store
+        redis_cfg = RedisClient(self.scheduler_cfg.redis_name).redisCfg
+        self.log.debug('redisCfg: %s', redis_cfg)
+        return JobRedisStore(**redis_cfg)
+
+    def _create_serializer(self):
+        """
+        job序列化方式，紧凑格式中的函数名取自FUNCTION_MAP。
+        :return:
+        """
+        serializer_type = self.scheduler_cfg.job_serializer
+        if serializer_type == self.SERIALIZER_TYPE.PICKLE:
+            return JobSerializer(self.FUNCTION_MAP, self.job_store.pickle_protocol)
+        elif serializer_type == self.SERIALIZER_TYPE.COMPACT:
+            return CompactJobSerializer(self.FUNCTION_MAP, self.job_store.pickle_protocol)
+        raise ValueError(f'job-serializer must be pickle or compact! input: {serializer_type}')
+
+    def migrate_jobs(self):
+        """
+        把已有job转为当前序列化方式的格式，调度器运行中也可执行(只覆盖转换期间未被修改的job)。
+        :return: 转换的job数
+        """
+        t_start = datetime.now()
+        migrated = self.job_store.migrate_jobs()
+        self.log.info('转换job序列化格式: %s, count=%s, spend=%.3fs', self.scheduler_cfg.job_serializer, migrated,
+                      (datetime.now() - t_start).total_seconds())
+        return migrated
 
-    def start_scheduler(self):
+    def _on_peer_change(self, job_ids: list = None):
+        """
+        其它节点修改了job: 失效本地缓存并唤醒调度器重新计算下次唤醒时间。
+        :param job_ids:
+        :return:
         """
+        self.job_store.view_cache.invalidate_many(job_ids)
+        if self.scheduler.state != STATE_STOPPED:
+            self.scheduler.wakeup()
 
+    def _on_leader_change(self, is_leader: bool):
+        """
+        本进程成为调度进程时恢复调度器，失去租约时暂停(已停止的调度器不变)。
+        :param is_leader:
         :return:
         """
-        self.scheduler.start()
-        self.log.info(FontColor(f'启动定时任务管理器！').green)
+        self.scheduler_host = is_leader
+        if self.scheduler.state == STATE_STOPPED:
+            return
+        if is_leader:
+            self.resume_scheduler()
+        else:
+            self.pause_scheduler()
+
+    def _notify_changed(self, job_ids: list, wakeup: bool = True):
+        """
+        job变更后唤醒本节点调度器，集群模式下同时通知其它节点。
+        :param job_ids:
+        :param wakeup: 是否唤醒本节点调度器(scheduler.add_job等已自行唤醒)；
+        :return:
+        """
+        if not job_ids:
+            return
+        if wakeup and self.scheduler.state != STATE_STOPPED:
+            self.scheduler.wakeup()
+        if self.job_cluster is not None:
+            self.job_cluster.publish(list(job_ids) if len(job_ids) <= self.PUBLISH_IDS_LIMIT else None)
+
+    def _create_executors(self):
+        """
+        根据配置创建执行器，未配置default时使用10个线程的线程池(同APScheduler默认值)。
+        :return:
+        """
+        executors = {}
+        for alias, executor_cfg in self.scheduler_cfg.executors.items():
+            executor_type = executor_cfg.get('type', self.EXECUTOR_TYPE.THREAD)
+            max_workers = executor_cfg.get('max-workers', 10)
+            if executor_type == self.EXECUTOR_TYPE.THREAD:
+                executors[alias] = ThreadPoolExecutor(max_workers)
+            elif executor_type == self.EXECUTOR_TYPE.PROCESS:
+                executors[alias] = ProcessPoolExecutor(max_workers)
+            else:
+                raise ValueError(f'executor type must be thread or process! input: {executor_type}')
+
+        executors.setdefault('default', ThreadPoolExecutor(10))
+        self.executor_names = set(executors)
+        return executors
+
+    def _init_metrics(self):
+        """
+        注册调度事件计数及采集时计算的执行器状态。
+        :return:
+        """
+        event_names = {EVENT_JOB_SUBMITTED: 'submitted', EVENT_JOB_EXECUTED: 'executed', EVENT_JOB_ERROR: 'error',
+                       EVENT_JOB_MISSED: 'missed', EVENT_JOB_MAX_INSTANCES: 'max_instances'}
+        mask = 0
+        for code in event_names:
+            mask |= code
+        self.scheduler.add_listener(lambda event: JOB_EVENTS.inc(event_names[event.code]), mask)
+
+        metrics.gauge('scheduler_state', 'Scheduler state: 0=stopped, 1=running, 2=paused.',
+                      lambda: self.scheduler.state)
+        metrics.gauge('executor_jobs', 'Job instances submitted to the executor and not finished yet.',
+                      lambda: {(alias,): sum(executor._instances.values())
+                               for alias, executor in self.scheduler._executors.items()}, ('executor',))
+        metrics.gauge('executor_queue_depth', 'Job instances waiting for a free executor worker.',
+                      lambda: {(alias,): executor._pool._work_queue.qsize()
+                               for alias, executor in self.scheduler._executors.items()
+                               if hasattr(getattr(executor, '_pool', None), '_work_queue')}, ('executor',))
+        metrics.gauge('store_jobs', 'Jobs in the Redis job store.', self.job_store.count_jobs)
+        metrics.gauge('retry_jobs', 'Deferred re-attempts waiting to run on this node.', self.job_retry.count)
+
+    def start_scheduler(self, paused=None):
+        """
+        停止后可再次启动，同时重新启动进程内副本(stop_scheduler时已停止，重新订阅并全量加载)。
+        :param paused: 以暂停状态启动，只读写job，不执行job；None时非调度进程以暂停状态启动；
+        :return:
+        """
+        if paused is None:
+            paused = not self.scheduler_host
+        if self.job_store.memory_tier is not None:
+            self.job_store.memory_tier.start()
+        self.scheduler.start(paused=paused)
+        self.log.info('启动定时任务管理器！%s', '(暂停)' if paused else '')
 
     def stop_scheduler(self, wait=True):
         """
@@ -74,7 +303,9 @@ class SchedulerMgt(object):
         :return:
         """
         self.scheduler.shutdown(wait)
-        self.log.info(FontColor(f'停止定时任务管理器！').red)
+        if self.job_store.memory_tier is not None:
+            self.job_store.memory_tier.stop()
+        self.log.info('停止定时任务管理器！')
 
     def pause_scheduler(self):
         """
@@ -82,7 +313,7 @@ class SchedulerMgt(object):
         :return:
         """
         self.scheduler.pause()
-        self.log.info(FontColor(f'暂停定时任务管理器！').red)
+        self.log.info('暂停定时任务管理器！')
 
     def resume_scheduler(self):
         """
@@ -90,29 +321,55 @@ class SchedulerMgt(object):
         :return:
         """
         self.scheduler.resume()
-        self.log.info(FontColor(f'恢复定时任务管理器！').green)
+        self.log.info('恢复定时任务管理器！')
 
-    def get_jobs(self, page_no: int, page_size: int):
+    def get_version(self):
         """
-
-        :param page_no:
-        :param page_size:
+        job存储的版本号：添加/删除/暂停/恢复/立即执行job，以及调度器触发执行后更新下次执行时间，都会使其递增。
         :return:
         """
-        # 读取触发器中任务
-        scheduled_jobs = self.scheduler.get_jobs(jobstore=self.JOB_STORE)
-        total_records = len(scheduled_jobs)
-        result = {'total_records': total_records}
+        return self.job_store.get_version()
 
-        start_no = min((int(page_no) - 1) * int(page_size) + 1, total_records)
-        end_no = min(int(page_no) * int(page_size), total_records)
+    def get_jobs(self, page_no: int, page_size: int, sort_by: str = None, status: str = None, func: str = None,
+                 api_name: str = None, api_method: str = None, name_prefix: str = None,
+                 next_run_from: str = None, next_run_to: str = None):
+        """
+        分页读取任务，只读取当前页job的展示信息，不反序列化job；
+        指定过滤条件时只读取二级索引，总数为命中的job数。
+        :param page_no: 页码，从1开始；
+        :param page_size: 每页条数；
+        :param sort_by: 排序方式，见JobSortType，默认按下次执行时间排序；
+        :param status: 状态，见JobStatusType；
+        :param func: job函数名，如 "start_job_by_api"；
+        :param api_name: 下游api名称(api_call_str中":"之前的部分)；
+        :param api_method: 下游api方法名，需同时指定api_name；
+        :param name_prefix: job名称前缀；
+        :param next_run_from: 下次执行时间下限(含)，格式同TIME_FMT，时区同定时任务配置；
+        :param next_run_to: 下次执行时间上限(含)；
+        :return:
+        """
+        page_no = int(page_no)
+        page_size = int(page_size)
+        if page_no < 1 or page_size < 1:
+            raise ValueError(f'page_no and page_size must be positive! input: {page_no}/{page_size}')
+        if status not in (None, self.STATUS_TYPE.ACTIVE, self.STATUS_TYPE.PAUSED):
+            raise ValueError(f'status must be active or paused! input: {status}')
+
+        offset = (page_no - 1) * page_size
+        if any((status, func, api_name, api_method, name_prefix, next_run_from, next_run_to)):
+            total_records, page_views = self.job_store.find_job_views_page(
+                offset, page_size, sort_by, paused=None if status is None else status == self.STATUS_TYPE.PAUSED,
+                func=func, api_name=api_name, api_method=api_method, name_prefix=name_prefix,
+                run_time_min=self._to_utc_timestamp(next_run_from, 'next_run_from'),
+                run_time_max=self._to_utc_timestamp(next_run_to, 'next_run_to'))
+        else:
+            total_records = self.job_store.count_jobs()
+            page_views = self.job_store.get_job_views_page(offset, page_size, sort_by)
 
-        paginated_data = []
-        for job in scheduled_jobs[start_no-1:end_no]:
-            paginated_data.append(self._get_job_info(job))
+        result = {'total_records': total_records}
+        result['paginated_data'] = [self._get_job_info(view, run_time) for view, run_time in page_views]
 
-        result['paginated_data'] = paginated_data
-        self.log.info(f'====>get_jobs: scheduled_jobs: {scheduled_jobs}, result: {result}')
+        self.log.debug('====>get_jobs: pageNo/Size: %s/%s, result: %s', page_no, page_size, result)
         return result
 
     def get_job(self, job_id: str):
@@ -121,44 +378,68 @@ class SchedulerMgt(object):
         :param job_id:
         :return:
         """
-        job = self.scheduler.get_job(job_id=job_id, jobstore=self.JOB_STORE)
-        return self._get_job_info(job)
+        job_view = self.job_store.get_job_view(job_id)
+        if job_view is None:
+            raise ValueError(f'job not found: {job_id}')
+        return self._get_job_info(*job_view)
 
-    def _get_job_info(self, job: Job):
+    def export_jobs(self):
+        """
+        按job id顺序逐个导出全部job，格式同get_jobs中的job信息，用于备份或比对。
+        :return: 生成器
         """
+        count = 0
+        for view, run_time in self.job_store.iter_job_views():
+            count += 1
+            yield self._get_job_info(view, run_time)
+        self.log.info('导出定时任务, count=%s', count)
 
-        :param job:
+    def _to_utc_timestamp(self, value: str, name: str):
+        """
+        时间字符串(定时任务配置的时区) ==> utc时间戳。
+        :param value:
+        :param name: 参数名，用于错误信息；
         :return:
         """
-        job_info = {
-            "id": job.id,
-            "name": job.name,
-            "func": job.func.__name__,
-            "kwargs": job.kwargs,
-            "trigger": TiggerCronStr(str(job.trigger)).fmt_cron_str,
-            "next_run_time": job.next_run_time.strftime(self.TIME_FMT) if job.next_run_time is not None else "paused"
-        }
+        if not value:
+            return None
+        return datetime_to_utc_timestamp(convert_to_datetime(value, self.timezone, name))
+
+    def _get_job_info(self, job_view: dict, run_time: float = None):
+        """
+        展示信息 + 下次执行时间。
+        :param job_view: JobRedisStore中保存的展示信息；
+        :param run_time: 下次执行时间的utc时间戳，None表示暂停；
+        :return:
+        """
+        job_info = dict(job_view)
+        job_info["next_run_time"] = utc_timestamp_to_datetime(run_time).astimezone(self.timezone).strftime(
+            self.TIME_FMT) if run_time is not None else "paused"
         return job_info
 
-    def add_job(self, job: dict):
+    def get_job_history(self, job_id: str, count: int = 20):
         """
+        最近的执行记录及耗时/调度延迟的百分位数。
+        :param job_id:
+        :param count:
+        :return:
+        """
+        return {'runs': self.job_history.get_runs(job_id, int(count)),
+                'stats': self.job_history.get_stats(job_id)}
 
+    def _parse_job(self, job: dict):
+        """
+        校验并解析job配置，返回scheduler.add_job所需参数。
         :param job:
         :return:
         """
-        function_map = {
-            "start_job_by_api": start_job_by_api,
-        }
-
         name = job['name']
         desc = job['desc']
 
-        cron_str = job['cron']
-        cron_dict = CronFiled(cron_str).cron
-        cron_dict["timezone"] = self.scheduler_cfg.timezone
+        trigger = self._create_trigger(job['cron'], smear_offset(name, self._smear_window(job.get('smear'))))
 
         func_name = job['func']
-        func = function_map.get(func_name)
+        func = self.FUNCTION_MAP.get(func_name)
         if not func:
             raise ValueError(f"Function '{func_name}' not found in function map.")
 
@@ -167,48 +448,345 @@ class SchedulerMgt(object):
         if not para:
             para = {}
 
-        self.log.info(FontColor(f'添加定时任务, name={name}, cron={cron_str}').green)
-        self.scheduler.add_job(id=name, name=desc, func=func, jobstore=self.JOB_STORE, replace_existing=True,
-                               trigger='cron', kwargs=para, **cron_dict)
+        # job的请求策略(超时、重试、熔断)，覆盖request-policies中的设置
+        if job.get('policy'):
+            RequestPolicy.from_cfg(job['policy'])
+            para = dict(para, policy=job['policy'])
 
-    def start_jobs(self, job_ids: list):
+        if func_name in self.PARA_VALIDATORS:
+            self.PARA_VALIDATORS[func_name](para)
+
+        job_kwargs = {'id': name, 'name': desc, 'func': func, 'kwargs': para, 'trigger': trigger}
+
+        # 可选的执行器及并发策略，未设置时使用job-defaults
+        for option in self.JOB_OPTIONS:
+            if job.get(option) is not None:
+                job_kwargs[option] = job[option]
+        if job_kwargs.get('executor', 'default') not in self.executor_names:
+            raise ValueError(f"Executor '{job_kwargs['executor']}' not found in executors.")
+
+        return job_kwargs
+
+    def _smear_window(self, smear=None):
+        """
+        job的打散窗口，见smear_window。
+        :param smear:
+        :return:
         """
+        return smear_window(smear, self.scheduler_cfg.smear_window)
 
-        :param job_ids:
+    def _create_trigger(self, cron_str: str, offset: int = 0):
+        """
+        创建cron触发器，创建时即校验cron字符串。
+        使用了L、W、#、?的表达式由CompiledCronTrigger执行，
+        其它表达式仍使用APScheduler的CronTrigger(CronFiledTrigger)；两者周域均为0=MON。
+        :param cron_str:
+        :param offset: 执行时间后移的秒数；
+        :return:
+        """
+        if CompiledCron.is_quartz(cron_str):
+            return CompiledCronTrigger(cron_str, self.scheduler_cfg.timezone, offset)
+        return CronFiledTrigger(cron_str, self.scheduler_cfg.timezone, offset)
+
+    def get_fire_times(self, cron_str: str = None, job_id: str = None, count: int = 10):
+        """
+        预览cron字符串或已有job的后续count次执行时间。
+        :param cron_str:
+        :param job_id:
+        :param count: 最多MAX_FIRE_TIMES次；
         :return:
         """
-        for job_id in job_ids:
-            self.log.info(FontColor(f'立即执行定时任务, name={job_id}').green)
+        if cron_str:
+            trigger = self._create_trigger(cron_str)
+        elif job_id:
+            job = self.scheduler.get_job(job_id=job_id, jobstore=self.JOB_STORE)
+            if job is None:
+                raise ValueError(f'job not found: {job_id}')
+            trigger = job.trigger
+        else:
+            raise ValueError('cron or job_id is required!')
 
-            # 立即执行任务
-            self.scheduler.modify_job(job_id=job_id, jobstore=self.JOB_STORE, next_run_time=datetime.now())
+        fire_times = []
+        now = datetime.now(self.scheduler.timezone)
+        fire_time = None
+        for _ in range(min(int(count), self.MAX_FIRE_TIMES)):
+            fire_time = trigger.get_next_fire_time(fire_time, now)
+            if fire_time is None:
+                break
+            fire_times.append(fire_time.strftime(self.TIME_FMT))
+            now = fire_time
 
-    def remove_jobs(self, job_ids: list):
+        return fire_times
+
+    def get_fire_histogram(self, seconds: int = 60):
+        """
+        从下一整秒起seconds秒内每秒的执行次数：只读取这段时间内会执行的job，按触发器展开其间的每次执行。
+        (当前这一秒内已过去的执行不再计入)
+        :param seconds: 统计秒数，最多MAX_HISTOGRAM_SECONDS；
+        :return:
         """
+        seconds = int(seconds)
+        if seconds < 1 or seconds > self.MAX_HISTOGRAM_SECONDS:
+            raise ValueError(f'seconds must be between 1 and {self.MAX_HISTOGRAM_SECONDS}! input: {seconds}')
+
+        start = datetime.now(self.scheduler.timezone).replace(microsecond=0) + timedelta(seconds=1)
+        start_ts = start.timestamp()
+        end = start + timedelta(seconds=seconds)
+        histogram = [0] * seconds
+        for job in self.job_store.get_due_jobs_between(start, end):
+            fire_time = job.next_run_time
+            while fire_time is not None and fire_time < end:
+                index = int(fire_time.timestamp() - start_ts)
+                if index >= 0:
+                    histogram[index] += 1
+                fire_time = job.trigger.get_next_fire_time(fire_time, fire_time)
+
+        peak = max(histogram)
+        return {
+            'start': start.astimezone(self.timezone).strftime(self.TIME_FMT),
+            'seconds': seconds,
+            'total': sum(histogram),
+            'peak': peak,
+            'peak_second': histogram.index(peak),
+            'mean': round(sum(histogram) / seconds, 2),
+            'histogram': histogram,
+        }
 
-        :param job_ids:
+    def simulate(self, jobs: list = None, include_store: bool = True, start: str = None, seconds: int = 7 * 86400,
+                 resolution: int = 60, duration: float = 1, durations: dict = None, top: int = 10, window: int = 60):
+        """
+        模拟已有job及待添加job在一段时间内的执行负载，只读取job存储，不修改调度器和job。
+        :param jobs: 待添加的job(格式同add_job)，与已有job同名时按新配置计算；
+        :param include_store: 是否包含已有job；
+        :param start: 开始时间，格式同TIME_FMT，默认为当前时间；
+        :param seconds: 模拟秒数；
+        :param resolution: 直方图每个桶的秒数；
+        :param duration: 每次执行的预计耗时(秒)；
+        :param durations: 按下游api设置的预计耗时；
+        :param top: 返回最忙的时间段数；
+        :param window: 最忙时间段的长度(秒)；
+        :return: 见JobSimulator.simulate
+        """
+        t_start = datetime.now()
+        simulator = JobSimulator(self.scheduler_cfg.timezone, self.scheduler_cfg.smear_window)
+        if include_store:
+            simulator.add_views(self.job_store.iter_job_views())
+        if jobs:
+            simulator.add_jobs(jobs)
+
+        start_time = convert_to_datetime(start, self.timezone, 'start') if start else None
+        result = simulator.simulate(start_time, seconds, resolution, duration, durations, top, window)
+        self.log.info('模拟定时任务负载, jobs=%s, seconds=%s, spend=%.3fs', result['jobs'], result['seconds'],
+                      (datetime.now() - t_start).total_seconds())
+        return result
+
+    def add_job(self, job: dict):
+        """
+
+        :param job:
         :return:
         """
-        for job_id in job_ids:
-            self.scheduler.remove_job(job_id=job_id, jobstore=self.JOB_STORE)
-            self.log.info(FontColor(f'删除定时任务, name={job_id}').red)
+        job_kwargs = self._parse_job(job)
 
-    def pause_jobs(self, job_ids: list):
+        self.log.info('添加定时任务, name=%s, cron=%s', job_kwargs['id'], job['cron'])
+        self.scheduler.add_job(jobstore=self.JOB_STORE, replace_existing=True, **job_kwargs)
+        self._notify_changed([job_kwargs['id']], wakeup=False)
+
+    def add_jobs(self, jobs):
+        """
+        批量添加任务：先校验全部job，再按批写入Redis，逐个返回每个job的结果。
+        :param jobs: job配置的列表或迭代器，格式同add_job；
+        :return: 结果生成器，每项为 {"id": name, "result": "ok"} 或 {"id": name, "result": "error", "msg": ...}
+        """
+        now = datetime.now(self.scheduler.timezone)
+        valid_jobs = []
+        for job in jobs:
+            job_id = job.get('name') if isinstance(job, dict) else None
+            try:
+                valid_jobs.append(self._build_job(self._parse_job(job), now))
+            except Exception as e:
+                yield {'id': job_id, 'result': 'error', 'msg': f'{e!r}'}
+
+        self.log.info('批量添加定时任务, count=%s', len(valid_jobs))
+        for i in range(0, len(valid_jobs), self.job_store.BATCH_SIZE):
+            batch_jobs = valid_jobs[i:i + self.job_store.BATCH_SIZE]
+            with self.scheduler._jobstores_lock:
+                self.job_store.add_jobs(batch_jobs)
+
+            for job in batch_jobs:
+                self.scheduler._dispatch_event(JobEvent(EVENT_JOB_ADDED, job.id, self.JOB_STORE))
+                yield {'id': job.id, 'result': 'ok'}
+
+        self._notify_changed([job.id for job in valid_jobs])
+
+    def _build_job(self, job_kwargs: dict, now: datetime):
+        """
+        与scheduler.add_job相同的方式构造Job，并计算首次执行时间，但不写入存储。
+        :param job_kwargs:
+        :param now:
+        :return:
+        """
+        job_kwargs = dict(job_kwargs, args=())
+        job_kwargs.setdefault('executor', 'default')
+        for key, value in self.scheduler._job_defaults.items():
+            job_kwargs.setdefault(key, value)
+
+        job = Job(self.scheduler, **job_kwargs)
+        job._jobstore_alias = self.JOB_STORE
+        job._modify(next_run_time=job.trigger.get_next_fire_time(None, now))
+        return job
+
+    def load_jobs_file(self, jobs_filename: str):
+        """
+        从文件批量导入job，支持JSON数组(.json)或每行一个job的NDJSON(.ndjson)。
+        :param jobs_filename:
+        :return: 导入结果统计
+        """
+        t_start = datetime.now()
+        with open(jobs_filename, encoding='utf-8') as f:
+            if jobs_filename.endswith('.ndjson'):
+                jobs = (json.loads(line) for line in f if line.strip())
+            else:
+                jobs = json.load(f)
+
+            total = 0
+            failed = []
+            for result in self.add_jobs(jobs):
+                total += 1
+                if result['result'] != 'ok':
+                    failed.append(result)
+
+        t_spend = (datetime.now() - t_start).total_seconds()
+        self.log.info('导入定时任务文件: %s, total=%s, failed=%s, spend=%.3fs',
+                      jobs_filename, total, len(failed), t_spend)
+        for result in failed:
+            self.log.error('导入定时任务失败: %s', result)
+        return {'total': total, 'failed': len(failed), 'spend': t_spend}
+
+    def start_jobs(self, job_ids: list):
         """
+        立即执行任务，可重复调用：已到期等待执行、本节点正在执行或其下游请求正在进行(开启了single-flight)的job
+        不再重复排队，结果中msg为already queued或already running。
+        :param job_ids:
+        :return: 每个job id的执行结果
+        """
+        busy = self._get_busy_jobs(job_ids)
+        self.log.info('立即执行定时任务, count=%s, busy=%s', len(job_ids), len(busy))
+        results = self._modify_jobs([job_id for job_id in job_ids if job_id not in busy], lambda job, now: now)
+        results.update({job_id: {'result': 'ok', 'msg': msg} for job_id, msg in busy.items()})
+        return {job_id: results[job_id] for job_id in job_ids}
 
+    def _get_busy_jobs(self, job_ids: list):
+        """
+        已在执行或等待执行的job。
         :param job_ids:
+        :return: {job_id: "already queued" or "already running"}
+        """
+        now = datetime.now(self.scheduler.timezone)
+        busy = {}
+        flight_keys = {}
+        for job in self.job_store.lookup_jobs(job_ids):
+            executor = self.scheduler._executors.get(job.executor)
+            if job.next_run_time is not None and job.next_run_time <= now:
+                busy[job.id] = 'already queued'
+            elif executor is not None and executor._instances.get(job.id):
+                busy[job.id] = 'already running'
+            else:
+                flight_keys[job.id] = self._flight_keys(job.kwargs)
+
+        running_keys = single_flight.in_flight([key for keys in flight_keys.values() for key in keys])
+        for job_id, keys in flight_keys.items():
+            if running_keys.intersection(keys):
+                busy[job_id] = 'already running'
+        return busy
+
+    @staticmethod
+    def _flight_keys(kwargs: dict):
+        """
+        job发出的下游请求的合并key，组合job中参数取自上游响应(inputs)的请求除外。
+        :param kwargs:
         :return:
         """
-        for job_id in job_ids:
-            self.scheduler.pause_job(job_id=job_id, jobstore=self.JOB_STORE)
-            self.log.info(FontColor(f'暂停定时任务: {job_id}').red)
+        calls = kwargs.get('calls') if isinstance(kwargs.get('calls'), list) else [kwargs]
+        return [single_flight.key(call['api_call_str'], call.get('api_para')) for call in calls
+                if isinstance(call, dict) and call.get('api_call_str') and not call.get('inputs')]
+
+    def remove_jobs(self, job_ids: list):
+        """
+        批量删除任务，不存在的job不影响其它job。
+        :param job_ids:
+        :return: 每个job id的执行结果
+        """
+        with self.scheduler._jobstores_lock:
+            removed_ids = set(self.job_store.remove_jobs(job_ids))
+        self.job_history.remove(list(removed_ids))
+
+        for job_id in removed_ids:
+            self.scheduler._dispatch_event(JobEvent(EVENT_JOB_REMOVED, job_id, self.JOB_STORE))
+        self.log.info('删除定时任务, count=%s/%s', len(removed_ids), len(job_ids))
+        self._notify_changed(removed_ids, wakeup=False)
+
+        return {job_id: self._opt_result(job_id in removed_ids) for job_id in job_ids}
+
+    def pause_jobs(self, job_ids: list):
+        """
+        批量暂停任务。
+        :param job_ids:
+        :return: 每个job id的执行结果
+        """
+        self.log.info('暂停定时任务, count=%s', len(job_ids))
+        return self._modify_jobs(job_ids, lambda job, now: None)
 
     def resume_jobs(self, job_ids: list):
         """
+        批量恢复任务，已没有下次执行时间的job会被删除(与scheduler.resume_job一致)。
+        :param job_ids:
+        :return: 每个job id的执行结果
+        """
+        self.log.info('恢复定时任务, count=%s', len(job_ids))
+        return self._modify_jobs(job_ids, lambda job, now: job.trigger.get_next_fire_time(None, now),
+                                 remove_finished=True)
 
+    def _modify_jobs(self, job_ids: list, get_next_run_time, remove_finished=False):
+        """
+        批量修改job的下次执行时间：一次批量读取，一次批量写入。
         :param job_ids:
+        :param get_next_run_time: get_next_run_time(job, now)，返回None表示暂停；
+        :param remove_finished: 为True时，没有下次执行时间的job直接删除；
+        :return: 每个job id的执行结果
+        """
+        now = datetime.now(self.scheduler.timezone)
+        modified_jobs = []
+        finished_ids = []
+
+        with self.scheduler._jobstores_lock:
+            jobs = self.job_store.lookup_jobs(job_ids)
+            for job in jobs:
+                next_run_time = get_next_run_time(job, now)
+                if next_run_time is None and remove_finished:
+                    finished_ids.append(job.id)
+                    continue
+                job._modify(next_run_time=next_run_time)
+                modified_jobs.append(job)
+
+            self.job_store.update_jobs(modified_jobs)
+            self.job_store.remove_jobs(finished_ids)
+
+        for job in modified_jobs:
+            self.scheduler._dispatch_event(JobEvent(EVENT_JOB_MODIFIED, job.id, self.JOB_STORE))
+        for job_id in finished_ids:
+            self.scheduler._dispatch_event(JobEvent(EVENT_JOB_REMOVED, job_id, self.JOB_STORE))
+
+        self._notify_changed([job.id for job in modified_jobs] + finished_ids)
+
+        found_ids = {job.id for job in jobs}
+        return {job_id: self._opt_result(job_id in found_ids) for job_id in job_ids}
+
+    @staticmethod
+    def _opt_result(success: bool):
+        """
+
+        :param success:
         :return:
         """
-        for job_id in job_ids:
-            self.scheduler.resume_job(job_id=job_id, jobstore=self.JOB_STORE)
-            self.log.info(FontColor(f'恢复定时任务: {job_id}').green)
+        return {'result': 'ok'} if success else {'result': 'error', 'msg': 'job not found'}
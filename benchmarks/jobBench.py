@@ -0,0 +1,568 @@
+# -*- coding: utf-8 -*-
+"""
+定时任务服务基准测试，离线运行，结果输出为JSON，便于跟踪性能回退。
+
+    python -m benchmarks.jobBench --config-dir <配置目录> [--out bench.json]
+
+配置目录中为正常部署所需的配置文件(job.json、scheduler.json等)：
+    - Redis: 不使用scheduler.json中的redis-name，而是启动本地redis-server(未安装时使用fakeredis)，
+             或使用--redis-url指定的Redis，该库会被清空；
+    - 下游api: 启动本地桩HTTP服务(--stub-port)，请求配置中--api-call对应的api需指向 http://127.0.0.1:<stub-port>；
+    - 日志: 使用job.json中的日志文件。
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+#: 基准测试使用的job不会在测试期间触发
+IDLE_CRON = '0 0 0 1 1 * 2099'
+
+
+# ---------------------------------------------------------------------------
+# 统计
+# ---------------------------------------------------------------------------
+#
+def percentile(sorted_values: list, p: float):
+    """
+    最近秩法百分位数(同JobHistory.percentile)。
+    """
+    if not sorted_values:
+        return None
+    return sorted_values[max(math.ceil(p / 100 * len(sorted_values)) - 1, 0)]
+
+
+def latency_stats(seconds: list):
+    """
+    耗时列表(秒) ==> 毫秒统计。
+    """
+    values = sorted(seconds)
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'mean_ms': round(sum(values) / len(values) * 1000, 3),
+        'p50_ms': round(percentile(values, 50) * 1000, 3),
+        'p95_ms': round(percentile(values, 95) * 1000, 3),
+        'p99_ms': round(percentile(values, 99) * 1000, 3),
+        'max_ms': round(values[-1] * 1000, 3),
+    }
+
+
+def rate(count: int, seconds: float):
+    return {'count': count, 'seconds': round(seconds, 4), 'per_sec': round(count / seconds, 1) if seconds else None}
+
+
+# ---------------------------------------------------------------------------
+# 本地Redis
+# ---------------------------------------------------------------------------
+#
+class LocalRedis(object):
+    """
+    --redis-url > 本地redis-server > fakeredis。
+    """
+    def __init__(self, redis_url: str = None):
+        self.redis_url = redis_url
+        self.process = None
+        self.backend = None
+        self.redis = None
+
+    def start(self):
+        import redis
+
+        if self.redis_url:
+            self.backend = 'external'
+            self.redis = redis.Redis.from_url(self.redis_url)
+        elif shutil.which('redis-server'):
+            port = free_port()
+            self.process = subprocess.Popen(['redis-server', '--port', str(port), '--save', '', '--appendonly', 'no'],
+                                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            self.backend = 'redis-server'
+            self.redis = redis.Redis(port=port)
+            for _ in range(100):
+                try:
+                    self.redis.ping()
+                    break
+                except redis.ConnectionError:
+                    time.sleep(0.05)
+        else:
+            import fakeredis
+            self.backend = 'fakeredis'
+            self.redis = fakeredis.FakeRedis()
+
+        self.redis.flushdb()
+        return self.redis
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+# ---------------------------------------------------------------------------
+# 下游api桩服务
+# ---------------------------------------------------------------------------
+#
+class StubServer(object):
+    """
+    任意GET/POST都返回 {"result": "ok"}，可设置固定延迟，并记录每次请求的到达时间。
+    """
+    def __init__(self, port: int, delay: float = 0):
+        self.port = port
+        self.delay = delay
+        self.hits = []
+        self._lock = threading.Lock()
+        self._server = None
+
+    def start(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self):
+                with stub._lock:
+                    stub.hits.append(time.time())
+                length = int(self.headers.get('Content-Length') or 0)
+                if length:
+                    self.rfile.read(length)
+                if stub.delay:
+                    time.sleep(stub.delay)
+                body = b'{"result": "ok"}'
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = do_POST = do_PUT = _reply
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', self.port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name='bench-stub', daemon=True).start()
+
+    def reset(self):
+        with self._lock:
+            self.hits = []
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+# ---------------------------------------------------------------------------
+# 基准测试
+# ---------------------------------------------------------------------------
+#
+class JobBench(object):
+    """
+
+    """
+    def __init__(self, args, redis):
+        self.args = args
+        self.redis = redis
+        self.job_api = None
+        self.scheduler_mgt = None
+
+    def job(self, i: int, cron: str = IDLE_CRON, prefix: str = 'bench'):
+        return {'name': f'{prefix}-{i:07d}', 'desc': f'benchmark job {i}', 'cron': cron,
+                'func': 'start_job_by_api', 'para': {'api_call_str': self.args.api_call, 'api_para': {'i': i}}}
+
+    def reset(self):
+        self.scheduler_mgt.job_store.remove_all_jobs()
+        self.scheduler_mgt.job_store.view_cache.clear()
+        for key in self.redis.scan_iter(f'{self.scheduler_mgt.scheduler_cfg.history_key_prefix}:*'):
+            self.redis.delete(key)
+
+    def fill(self, count: int):
+        self.reset()
+        for _ in self.scheduler_mgt.add_jobs(self.job(i) for i in range(count)):
+            pass
+
+    def bench_startup(self):
+        """
+        导入app(加载配置、日志、注册路由)及创建定时任务管理器(连接Redis、启动调度器)的耗时。
+        """
+        t_start = time.perf_counter()
+        import app
+        from app.services.schedulerMgt import SchedulerMgt
+        t_import = time.perf_counter() - t_start
+
+        t_start = time.perf_counter()
+        self.job_api = app.job_api
+        self.scheduler_mgt = SchedulerMgt(app.job_cfg.scheduler_cfg_filename, True, redis=self.redis)
+        self.job_api.set_scheduler_mgt(self.scheduler_mgt)
+        t_scheduler = time.perf_counter() - t_start
+        self.reset()
+        return {'import_app_s': round(t_import, 4), 'scheduler_mgt_s': round(t_scheduler, 4)}
+
+    def bench_add_job(self):
+        """
+        逐个add_job的吞吐量。
+        """
+        self.reset()
+        count = self.args.add_jobs
+        t_start = time.perf_counter()
+        for i in range(count):
+            self.scheduler_mgt.add_job(self.job(i))
+        return rate(count, time.perf_counter() - t_start)
+
+    def bench_bulk(self):
+        """
+        批量添加/暂停/恢复/删除的吞吐量。
+        """
+        self.reset()
+        count = self.args.bulk_jobs
+        jobs = [self.job(i) for i in range(count)]
+        job_ids = [job['name'] for job in jobs]
+        result = {}
+
+        t_start = time.perf_counter()
+        failed = sum(1 for r in self.scheduler_mgt.add_jobs(jobs) if r['result'] != 'ok')
+        result['add_jobs'] = dict(rate(count, time.perf_counter() - t_start), failed=failed)
+
+        for name, method in (('pause_jobs', self.scheduler_mgt.pause_jobs),
+                             ('resume_jobs', self.scheduler_mgt.resume_jobs),
+                             ('remove_jobs', self.scheduler_mgt.remove_jobs)):
+            t_start = time.perf_counter()
+            results = method(job_ids)
+            failed = sum(1 for r in results.values() if r['result'] != 'ok')
+            result[name] = dict(rate(count, time.perf_counter() - t_start), failed=failed)
+        return result
+
+    def bench_import(self):
+        """
+        从NDJSON文件导入job的速率。
+        """
+        self.reset()
+        count = self.args.import_jobs
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            jobs_filename = os.path.join(tmp_dir, 'jobs.ndjson')
+            with open(jobs_filename, 'w', encoding='utf-8') as f:
+                for i in range(count):
+                    f.write(json.dumps(self.job(i)) + '\n')
+            t_start = time.perf_counter()
+            summary = self.scheduler_mgt.load_jobs_file(jobs_filename)
+        return dict(rate(count, time.perf_counter() - t_start), failed=summary['failed'])
+
+    def bench_get_jobs(self):
+        """
+        不同job总数下get_jobs分页查询的耗时：cold为清空展示信息缓存后的首轮，warm为之后一轮。
+        """
+        result = {}
+        page_size = self.args.page_size
+        for size in self.args.sizes:
+            t_start = time.perf_counter()
+            self.fill(size)
+            fill_s = time.perf_counter() - t_start
+
+            pages = max(size // page_size, 1)
+            page_nos = [random.randint(1, pages) for _ in range(self.args.samples)]
+            size_result = {'fill': rate(size, fill_s)}
+            for sort_by in ('next_run_time', 'id'):
+                self.scheduler_mgt.job_store.view_cache.clear()
+                for phase in ('cold', 'warm'):
+                    latencies = []
+                    for page_no in page_nos:
+                        t_start = time.perf_counter()
+                        self.scheduler_mgt.get_jobs(page_no, page_size, sort_by)
+                        latencies.append(time.perf_counter() - t_start)
+                    size_result[f'{sort_by}_{phase}'] = latency_stats(latencies)
+            result[str(size)] = size_result
+        return result
+
+    def bench_serializer(self):
+        """
+        pickle与紧凑格式的对比：每个job在jobs hash中占用的内存，以及批量读取(反序列化)全部job的耗时。
+        """
+        from app.services.jobSerializer import JobSerializer, CompactJobSerializer
+
+        job_store = self.scheduler_mgt.job_store
+        original = job_store.serializer
+        count = self.args.serializer_jobs
+        result = {'jobs': count}
+        try:
+            for name, serializer_class in (('pickle', JobSerializer), ('compact', CompactJobSerializer)):
+                job_store.serializer = serializer_class(self.scheduler_mgt.FUNCTION_MAP, job_store.pickle_protocol)
+                self.fill(count)
+                job_ids = [self.job(i)['name'] for i in range(count)]
+
+                sizes = []
+                for i in range(0, count, job_store.BATCH_SIZE):
+                    with self.redis.pipeline(transaction=False) as pipe:
+                        for job_id in job_ids[i:i + job_store.BATCH_SIZE]:
+                            pipe.hstrlen(job_store.jobs_key, job_id)
+                        sizes.extend(pipe.execute())
+                try:
+                    memory = self.redis.memory_usage(job_store.jobs_key, samples=0)
+                except Exception:
+                    memory = None
+
+                t_start = time.perf_counter()
+                jobs = job_store.lookup_jobs(job_ids)
+                t_spend = time.perf_counter() - t_start
+                result[name] = {
+                    'value_bytes_per_job': round(sum(sizes) / count, 1),
+                    'redis_bytes_per_job': round(memory / count, 1) if memory else None,
+                    'lookup_all': rate(len(jobs), t_spend),
+                }
+        finally:
+            job_store.serializer = original
+            self.reset()
+        return result
+
+    def bench_api(self):
+        """
+        并发调用JobAPI的查询api(不经过HTTP和鉴权)：
+        cached: 无If-None-Match，命中响应缓存；not_modified: 带ETag，返回304；
+        uncached: 每次请求前修改一个job使版本号变化；logging_off: 关闭该api的INFO日志后的cached。
+        """
+        from starlette.requests import Request
+        from fastapi import HTTPException
+
+        self.fill(self.args.api_jobs)
+        # 与log-levels中的子日志名称相同
+        get_jobs_log = logging.getLogger('job.JobAPI.get_jobs_api')
+        page_size = self.args.page_size
+        pages = max(self.args.api_jobs // page_size, 1)
+
+        def request(etag: str = None):
+            headers = [(b'if-none-match', etag.encode())] if etag else []
+            return Request({'type': 'http', 'method': 'GET', 'path': '/jobs', 'headers': headers, 'query_string': b''})
+
+        async def run(mode: str):
+            latencies = []
+            statuses = {}
+            remaining = [self.args.api_requests]
+            version = await self.job_api.read_executor.run(self.scheduler_mgt.get_version)
+            etag = f'"{version}"' if mode == 'not_modified' else None
+
+            async def worker():
+                while remaining[0] > 0:
+                    remaining[0] -= 1
+                    if mode == 'uncached':
+                        await self.job_api.write_executor.run(self.scheduler_mgt.add_job, self.job(0))
+                    t_start = time.perf_counter()
+                    try:
+                        response = await self.job_api.get_jobs_api(request(etag), random.randint(1, pages),
+                                                                    page_size, auth='bench')
+                        status = response.status_code
+                    except HTTPException as e:
+                        status = e.status_code
+                    latencies.append(time.perf_counter() - t_start)
+                    statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+            t_start = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(self.args.concurrency)))
+            t_spend = time.perf_counter() - t_start
+            return dict(rate(len(latencies), t_spend), latency=latency_stats(latencies), status=statuses)
+
+        async def run_all():
+            result = {'concurrency': self.args.concurrency}
+            for mode in ('cached', 'not_modified', 'uncached'):
+                result[mode] = await run(mode)
+            level = get_jobs_log.level
+            get_jobs_log.setLevel('WARNING')
+            try:
+                result['logging_off'] = await run('cached')
+            finally:
+                get_jobs_log.setLevel(level)
+            return result
+
+        return asyncio.run(run_all())
+
+    def bench_write_load(self):
+        """
+        写线程池忙于批量添加job时，/health与GET /jobs的延迟(直接调用JobAPI，不经过HTTP和鉴权)：
+        idle为写线程池空闲时的基线，loaded为批量添加期间的采样。
+        """
+        from starlette.requests import Request
+        from fastapi import HTTPException
+
+        self.fill(self.args.api_jobs)
+        count = self.args.load_jobs
+        page_size = self.args.page_size
+        pages = max(self.args.api_jobs // page_size, 1)
+
+        def request():
+            return Request({'type': 'http', 'method': 'GET', 'path': '/jobs', 'headers': [], 'query_string': b''})
+
+        async def health():
+            await self.job_api.health_api()
+
+        async def get_jobs():
+            # 每次换页，避免全部命中响应缓存
+            await self.job_api.get_jobs_api(request(), random.randint(1, pages), page_size, auth='bench')
+
+        async def sample(call, until):
+            latencies = []
+            errors = 0
+            while not until():
+                t_start = time.perf_counter()
+                try:
+                    await call()
+                except HTTPException:
+                    errors += 1
+                latencies.append(time.perf_counter() - t_start)
+                await asyncio.sleep(self.args.load_interval)
+            return dict(latency=latency_stats(latencies), errors=errors)
+
+        async def run(phase: str):
+            if phase == 'idle':
+                deadline = time.perf_counter() + self.args.load_idle
+                done = lambda: time.perf_counter() >= deadline
+                writing = None
+            else:
+                jobs = [self.job(i, prefix='load') for i in range(count)]
+                writing = asyncio.ensure_future(
+                    self.job_api.write_executor.run(lambda: list(self.scheduler_mgt.add_jobs(jobs))))
+                done = writing.done
+            t_start = time.perf_counter()
+            health_result, get_jobs_result = await asyncio.gather(sample(health, done), sample(get_jobs, done))
+            result = {'seconds': round(time.perf_counter() - t_start, 4),
+                      'health': health_result, 'get_jobs': get_jobs_result}
+            if writing is not None:
+                results = await writing
+                result['add_jobs'] = dict(rate(count, result['seconds']),
+                                          failed=sum(1 for r in results if r['result'] != 'ok'))
+            return result
+
+        async def run_all():
+            return {phase: await run(phase) for phase in ('idle', 'loaded')}
+
+        try:
+            return asyncio.run(run_all())
+        finally:
+            self.reset()
+
+    def bench_firing(self, stub: StubServer):
+        """
+        N个job在同一秒触发时，计划执行时间与实际开始执行时间的偏差(取自执行历史的lag_us)。
+        """
+        self.reset()
+        stub.reset()
+        count = self.args.firing_jobs
+        fire_at = (datetime.now() + timedelta(seconds=self.args.firing_lead)).replace(microsecond=0)
+        cron = f'{fire_at.second} {fire_at.minute} {fire_at.hour} * * *'
+        for _ in self.scheduler_mgt.add_jobs(self.job(i, cron, 'fire') for i in range(count)):
+            pass
+
+        wait = (fire_at - datetime.now()).total_seconds() + self.args.firing_settle
+        time.sleep(max(wait, 0))
+
+        lags = []
+        errors = 0
+        for i in range(count):
+            runs = self.scheduler_mgt.job_history.get_runs(self.job(i, cron, 'fire')['name'], 1)
+            if not runs:
+                continue
+            lags.append(runs[0]['lag_us'] / 1000000)
+            if runs[0].get('status') != 'ok':
+                errors += 1
+
+        stub_lags = sorted(hit - fire_at.timestamp() for hit in stub.hits)
+        self.reset()
+        return {'jobs': count, 'fired': len(lags), 'errors': errors, 'lag': latency_stats(lags),
+                'stub_hits': len(stub_lags), 'stub_arrival': latency_stats(stub_lags)}
+
+
+# ---------------------------------------------------------------------------
+# 入口
+# ---------------------------------------------------------------------------
+#
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Job scheduler benchmarks (JSON output).')
+    parser.add_argument('--config-dir', required=True, help='directory containing job.json and the other configs')
+    parser.add_argument('--out', help='write the JSON result to this file instead of stdout')
+    parser.add_argument('--redis-url', help='use this Redis instead of a local one (the db is flushed!)')
+    parser.add_argument('--stub-port', type=int, default=18080)
+    parser.add_argument('--stub-delay', type=float, default=0, help='downstream stub latency (seconds)')
+    parser.add_argument('--api-call', default='bench:ping', help='api_call_str used by the benchmark jobs')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--add-jobs', type=int, default=1000)
+    parser.add_argument('--bulk-jobs', type=int, default=10000)
+    parser.add_argument('--import-jobs', type=int, default=10000)
+    parser.add_argument('--sizes', type=lambda s: [int(x) for x in s.split(',')], default=[1000, 10000, 100000])
+    parser.add_argument('--page-size', type=int, default=50)
+    parser.add_argument('--samples', type=int, default=200)
+    parser.add_argument('--serializer-jobs', type=int, default=10000)
+    parser.add_argument('--api-jobs', type=int, default=10000)
+    parser.add_argument('--api-requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--load-jobs', type=int, default=20000, help='jobs bulk added while sampling write_load')
+    parser.add_argument('--load-idle', type=float, default=2, help='seconds of idle baseline sampling')
+    parser.add_argument('--load-interval', type=float, default=0.005, help='pause between samples (seconds)')
+    parser.add_argument('--firing-jobs', type=int, default=500)
+    parser.add_argument('--firing-lead', type=float, default=5, help='seconds until the shared firing second')
+    parser.add_argument('--firing-settle', type=float, default=10, help='seconds to wait after the firing second')
+    parser.add_argument('--only', help='comma separated benchmark names to run')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    random.seed(args.seed)
+
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, repo_dir)
+    os.chdir(args.config_dir)
+
+    local_redis = LocalRedis(args.redis_url)
+    stub = StubServer(args.stub_port, args.stub_delay)
+    redis = local_redis.start()
+    stub.start()
+
+    bench = JobBench(args, redis)
+    only = set(args.only.split(',')) if args.only else None
+    result = {
+        'meta': {'time': datetime.now().isoformat(timespec='seconds'), 'python': platform.python_version(),
+                 'platform': platform.platform(), 'redis': local_redis.backend, 'args': vars(args)},
+        'benchmarks': {},
+    }
+    try:
+        result['benchmarks']['startup'] = bench.bench_startup()
+        for name, func in (('add_job', bench.bench_add_job), ('bulk', bench.bench_bulk),
+                           ('import', bench.bench_import), ('get_jobs', bench.bench_get_jobs),
+                           ('serializer', bench.bench_serializer), ('api', bench.bench_api),
+                           ('write_load', bench.bench_write_load), ('firing', lambda: bench.bench_firing(stub))):
+            if only is None or name in only:
+                result['benchmarks'][name] = func()
+    finally:
+        if bench.scheduler_mgt is not None:
+            bench.reset()
+        if bench.job_api is not None:
+            asyncio.run(bench.job_api.shutdown())
+        stub.stop()
+        local_redis.stop()
+
+    output = json.dumps(result, indent=2, ensure_ascii=False)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
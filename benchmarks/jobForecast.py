@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+离线负载预测：展开已有job及待添加job的cron触发器，输出每秒及按下游api的执行次数、峰值并发和最忙的时间段(JSON)，
+不创建定时任务管理器，不修改job存储。
+
+    python -m benchmarks.jobForecast --config-dir <配置目录> --jobs-file new_jobs.ndjson [--store] [--days 7]
+
+时区及smear-window取自配置目录中的scheduler配置；
+--store时同时读取scheduler配置中redis-name对应的job存储，待添加的job与已有job同名时按新配置计算。
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+
+def load_jobs(jobs_filename: str):
+    """
+    JSON数组(.json)或每行一个job的NDJSON(.ndjson)，格式同SchedulerMgt.load_jobs_file。
+    """
+    with open(jobs_filename, encoding='utf-8') as f:
+        if jobs_filename.endswith('.ndjson'):
+            return [json.loads(line) for line in f if line.strip()]
+        return json.load(f)
+
+
+# ---------------------------------------------------------------------------
+# 入口
+# ---------------------------------------------------------------------------
+#
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Offline job load forecast (JSON output).')
+    parser.add_argument('--config-dir', required=True, help='directory containing job.json and the other configs')
+    parser.add_argument('--jobs-file', help='proposed jobs (.json array or .ndjson), same format as add_job')
+    parser.add_argument('--store', action='store_true', help='include the jobs in the configured Redis job store')
+    parser.add_argument('--start', help='"%%Y-%%m-%%d %%H:%%M:%%S" in the scheduler timezone, default now')
+    parser.add_argument('--days', type=float, default=7)
+    parser.add_argument('--resolution', type=int, default=60, help='histogram bucket size (seconds)')
+    parser.add_argument('--duration', type=float, default=1, help='expected run time of a job (seconds)')
+    parser.add_argument('--durations', type=json.loads, default=None,
+                        help='expected run time per api_name, e.g. \'{"orderApi": 5}\'')
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--window', type=int, default=60, help='size of the busiest windows (seconds)')
+    parser.add_argument('--out', help='write the JSON result to this file instead of stdout')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    jobs_filename = os.path.abspath(args.jobs_file) if args.jobs_file else None
+    out_filename = os.path.abspath(args.out) if args.out else None
+    if jobs_filename is None and not args.store:
+        raise SystemExit('--jobs-file and/or --store is required')
+
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, repo_dir)
+    os.chdir(args.config_dir)
+
+    from apscheduler.util import convert_to_datetime
+    from app import job_cfg
+    from app.services.jobCfg import SchedulerCfg
+    from app.services.jobSimulator import JobSimulator
+
+    scheduler_cfg = SchedulerCfg(job_cfg.scheduler_cfg_filename)
+    simulator = JobSimulator(scheduler_cfg.timezone, scheduler_cfg.smear_window)
+
+    t_start = time.perf_counter()
+    if args.store:
+        from myRedisUtil import RedisClient
+        from app.services.jobStore import JobRedisStore
+        job_store = JobRedisStore(**RedisClient(scheduler_cfg.redis_name).redisCfg)
+        simulator.add_views(job_store.iter_job_views())
+    if jobs_filename:
+        simulator.add_jobs(load_jobs(jobs_filename))
+    t_load = time.perf_counter() - t_start
+
+    start = convert_to_datetime(args.start, simulator.timezone, 'start') if args.start else None
+    t_start = time.perf_counter()
+    result = simulator.simulate(start, round(args.days * 86400), args.resolution, args.duration, args.durations,
+                                args.top, args.window)
+    result['spend'] = {'load_s': round(t_load, 4), 'simulate_s': round(time.perf_counter() - t_start, 4)}
+
+    output = json.dumps(result, ensure_ascii=False)
+    if out_filename:
+        with open(out_filename, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+import os
+import sys
+
+import fakeredis
+import pytest
+
+# 与基准测试相同，导入app时从当前目录读取配置(job.json等)，可用JOB_CONFIG_DIR指定配置目录
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if os.environ.get('JOB_CONFIG_DIR'):
+    os.chdir(os.environ['JOB_CONFIG_DIR'])
+
+
+@pytest.fixture
+def redis_server():
+    """
+    同一个fakeredis服务，多个连接可模拟共用Redis的多个进程。
+    """
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+def make_scheduler(redis_server):
+    """
+    创建使用JobRedisStore(fakeredis)的调度器，调度器以暂停状态启动，不执行job。
+    """
+    from apscheduler.schedulers.background import BackgroundScheduler
+    from app.services.jobStore import JobRedisStore
+
+    schedulers = []
+
+    def make(serializer=None):
+        job_store = JobRedisStore(serializer=serializer)
+        job_store.redis = fakeredis.FakeRedis(server=redis_server)
+        scheduler = BackgroundScheduler(jobstores={'default': job_store}, timezone='UTC')
+        scheduler.start(paused=True)
+        schedulers.append(scheduler)
+        return scheduler, job_store
+
+    yield make
+    for scheduler in schedulers:
+        scheduler.shutdown(wait=False)
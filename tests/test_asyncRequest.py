@@ -0,0 +1,79 @@
+import threading
+import time
+
+import pytest
+
+from app.requests.asyncRequest import AsyncRequestEngine
+from app.requests.rateLimit import RequestLimiters, RequestRejected
+from app.requests.requestPolicy import RequestTimeout
+
+
+@pytest.fixture
+def hung_engine():
+    """
+    deadApi一直不返回(直到release)，其他api立即返回。
+    """
+    release = threading.Event()
+
+    def request_func(api_name, api_method_name, params):
+        if api_name == 'deadApi':
+            release.wait(5)
+        return api_name
+
+    limiters = RequestLimiters({'apis': {'deadApi': {'max-concurrency': 2, 'max-wait': 0.1}}})
+    engine = AsyncRequestEngine(request_func, max_workers=4, limiters=limiters)
+    yield engine, limiters, release
+    release.set()
+    engine.shutdown()
+
+
+def test_timeout_keeps_slot_until_thread_returns(hung_engine):
+    engine, limiters, release = hung_engine
+    for _ in range(2):
+        with pytest.raises(RequestTimeout):
+            engine.submit(engine.request('deadApi', 'm', timeout=0.05)).result(2)
+    assert limiters.limiters['deadApi'].in_flight == 2
+
+    # 名额仍被无响应的请求占用，新请求排队超时被拒绝，不再占用线程
+    with pytest.raises(RequestRejected):
+        engine.submit(engine.request('deadApi', 'm', timeout=0.05)).result(2)
+
+    release.set()
+    for _ in range(50):
+        if limiters.limiters['deadApi'].in_flight == 0:
+            break
+        time.sleep(0.01)
+    assert limiters.limiters['deadApi'].in_flight == 0
+    assert engine.submit(engine.request('deadApi', 'm', timeout=1)).result(2) == 'deadApi'
+
+
+def test_hung_downstream_does_not_block_others(hung_engine):
+    engine, limiters, release = hung_engine
+    for _ in range(2):
+        with pytest.raises(RequestTimeout):
+            engine.submit(engine.request('deadApi', 'm', timeout=0.05)).result(2)
+
+    t_start = time.perf_counter()
+    futures = [engine.submit(engine.request('orderApi', 'm', timeout=1)) for _ in range(8)]
+    assert [future.result(2) for future in futures] == ['orderApi'] * 8
+    assert time.perf_counter() - t_start < 0.5
+    assert set(engine.executors) == {'deadApi', 'orderApi'}
+
+
+def timed_request_in_child():
+    from app.requests.jobRequest import job_com_request
+    from app.requests.requestPolicy import RequestPolicy
+
+    return job_com_request('orderApi:create', {'i': 1}, RequestPolicy(timeout=2))
+
+
+def test_timed_sync_request_in_forked_child(monkeypatch):
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    from app.requests import request_engine
+
+    monkeypatch.setattr(request_engine, 'request_func', lambda api_name, api_method_name, params: params)
+    # 父进程已启动引擎的事件循环线程，子进程继承了loop但没有运行它的线程
+    assert request_engine.submit(request_engine.request('orderApi', 'create', {'i': 0}, 1)).result(2) == {'i': 0}
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('fork')) as pool:
+        assert pool.submit(timed_request_in_child).result(10) == {'i': 1}
@@ -0,0 +1,73 @@
+import time
+
+import fakeredis
+import pytest
+
+from app.requests.rateLimit import RequestRejected
+from app.requests.requestPolicy import CircuitBreakers, RequestPolicy
+
+POLICY = RequestPolicy(breaker_failures=3, breaker_window=60, breaker_open=0.2)
+
+
+@pytest.fixture(params=['local', 'redis'])
+def breakers(request, redis_server):
+    if request.param == 'local':
+        return CircuitBreakers()
+    return CircuitBreakers(redis=fakeredis.FakeRedis(server=redis_server))
+
+
+def fail(breakers, api_name: str = 'orderApi'):
+    state = breakers.allow(api_name, POLICY)
+    breakers.record(api_name, POLICY, state, False)
+
+
+def test_opens_after_failures(breakers):
+    for _ in range(2):
+        fail(breakers)
+    assert not breakers.is_open('orderApi')
+    fail(breakers)
+    assert breakers.is_open('orderApi')
+    with pytest.raises(RequestRejected) as e:
+        breakers.allow('orderApi', POLICY)
+    assert e.value.reason == 'circuit_open'
+    # 其它下游不受影响
+    assert breakers.allow('userApi', POLICY) == CircuitBreakers.CLOSED
+
+
+def test_single_probe_after_open(breakers):
+    for _ in range(3):
+        fail(breakers)
+    time.sleep(0.25)
+
+    assert breakers.allow('orderApi', POLICY) == CircuitBreakers.PROBE
+    # 探测请求进行中，其它请求仍被拒绝
+    with pytest.raises(RequestRejected):
+        breakers.allow('orderApi', POLICY)
+
+    breakers.record('orderApi', POLICY, CircuitBreakers.PROBE, True)
+    assert breakers.allow('orderApi', POLICY) == CircuitBreakers.CLOSED
+
+
+def test_failed_probe_reopens(breakers):
+    for _ in range(3):
+        fail(breakers)
+    time.sleep(0.25)
+    state = breakers.allow('orderApi', POLICY)
+    breakers.record('orderApi', POLICY, state, False)
+    assert breakers.is_open('orderApi')
+
+
+def test_shared_between_nodes(redis_server):
+    node_a = CircuitBreakers(redis=fakeredis.FakeRedis(server=redis_server))
+    node_b = CircuitBreakers(redis=fakeredis.FakeRedis(server=redis_server))
+    for _ in range(3):
+        fail(node_a)
+    with pytest.raises(RequestRejected):
+        node_b.allow('orderApi', POLICY)
+
+
+def test_disabled_policy_never_opens(breakers):
+    policy = RequestPolicy()
+    for _ in range(10):
+        breakers.record('orderApi', policy, breakers.allow('orderApi', policy), False)
+    assert breakers.allow('orderApi', policy) == CircuitBreakers.CLOSED
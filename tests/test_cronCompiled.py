@@ -0,0 +1,69 @@
+from datetime import datetime
+
+import pytest
+import pytz
+
+from app.services.cronCompiled import CompiledCron, CompiledCronTrigger
+from app.services.cronFiled import CronFiledTrigger
+
+UTC = pytz.utc
+
+
+def fire_times(trigger, start: datetime, count: int):
+    times = []
+    fire_time = trigger.get_next_fire_time(None, start)
+    while fire_time is not None and len(times) < count:
+        times.append(fire_time)
+        fire_time = trigger.get_next_fire_time(fire_time, fire_time)
+    return times
+
+
+def test_step_from_start_value():
+    assert CompiledCron('5/1 * * ? * *').seconds == list(range(5, 60))
+    assert CompiledCron('5/20 * * ? * *').seconds == [5, 25, 45]
+    assert CompiledCron('5 * * ? * *').seconds == [5]
+    assert CompiledCron('10-20/5 * * ? * *').seconds == [10, 15, 20]
+
+
+@pytest.mark.parametrize('day_of_week', ['1', '0,4', 'mon-fri', '5-6', 'sun'])
+def test_day_of_week_matches_cron_trigger(day_of_week):
+    # 使用了?的表达式由CompiledCronTrigger执行，周域的含义需与普通表达式(APScheduler)一致
+    start = UTC.localize(datetime(2024, 1, 1))
+    compiled = CompiledCronTrigger(f'0 30 9 ? * {day_of_week}', UTC)
+    plain = CronFiledTrigger(f'0 30 9 * * {day_of_week}', UTC)
+    assert fire_times(compiled, start, 10) == fire_times(plain, start, 10)
+
+
+def test_last_and_nth_day_of_week():
+    # 2024-03: 1日为周五
+    assert CompiledCron('0 0 0 ? * FRIL').get_month_days(2024, 3) == [29]
+    assert CompiledCron('0 0 0 ? * 4L').get_month_days(2024, 3) == [29]
+    assert CompiledCron('0 0 0 ? * 0#2').get_month_days(2024, 3) == [11]
+    assert CompiledCron('0 0 0 ? * L').get_month_days(2024, 3) == [3, 10, 17, 24, 31]
+
+
+def test_last_and_nearest_weekday_of_month():
+    assert CompiledCron('0 0 0 L * ?').get_month_days(2024, 2) == [29]
+    assert CompiledCron('0 0 0 L-2 * ?').get_month_days(2024, 2) == [27]
+    # 2024-06-01为周六，1W不跨月，取3日(周一)；2024-06-30为周日，LW取28日(周五)
+    assert CompiledCron('0 0 0 1W * ?').get_month_days(2024, 6) == [3]
+    assert CompiledCron('0 0 0 LW * ?').get_month_days(2024, 6) == [28]
+
+
+def test_next_fire_time_rolls_over_fields():
+    trigger = CompiledCronTrigger('0 0 12 L * ?', UTC)
+    start = UTC.localize(datetime(2024, 12, 31, 12, 0, 1))
+    assert trigger.get_next_fire_time(None, start) == UTC.localize(datetime(2025, 1, 31, 12))
+
+
+def test_is_quartz():
+    assert CompiledCron.is_quartz('0 0 0 ? * 1')
+    assert CompiledCron.is_quartz('0 0 0 LW * *')
+    assert CompiledCron.is_quartz('0 0 0 * * 1#2')
+    assert not CompiledCron.is_quartz('0 0/5 * * * mon-fri')
+
+
+@pytest.mark.parametrize('cron_str', ['0 0 0 ? *', '0 0 0 ? * 7', '0 0 0 32 * ?', '0 0/0 0 ? * *', '0 0 0 ? * 1#6'])
+def test_invalid_expressions(cron_str):
+    with pytest.raises(ValueError):
+        CompiledCron(cron_str)
@@ -0,0 +1,82 @@
+from datetime import datetime, timedelta
+
+import pytest
+from apscheduler.util import utc
+
+from app.jobs.jobs import start_job_by_api
+from app.services.cronCompiled import CompiledCronTrigger
+from app.services.cronFiled import CronFiledTrigger
+from app.services.cronSmear import smear_offset, smear_window
+from app.services.schedulerMgt import SchedulerMgt
+
+
+def test_smear_offset_is_stable_and_spread():
+    offsets = [smear_offset(f'job-{i}', 60) for i in range(6000)]
+    assert offsets == [smear_offset(f'job-{i}', 60) for i in range(6000)]
+    assert min(offsets) == 0 and max(offsets) == 59
+    counts = [offsets.count(second) for second in range(60)]
+    # 6000个job平均每秒100个
+    assert max(counts) < 150
+    assert smear_offset('job-1', 0) == 0
+
+
+def test_smear_window():
+    assert smear_window(None, 30) == 30
+    assert smear_window(True, 30) == 30
+    assert smear_window(False, 30) == 0
+    assert smear_window(10, 30) == 10
+    with pytest.raises(ValueError):
+        smear_window(-1, 30)
+
+
+@pytest.mark.parametrize('trigger_class, cron_str', [
+    (CronFiledTrigger, '0 0 * * * *'),
+    (CompiledCronTrigger, '0 0 * ? * 0-6'),
+])
+def test_offset_shifts_every_fire_time(trigger_class, cron_str):
+    plain = trigger_class(cron_str, 'UTC')
+    smeared = trigger_class(cron_str, 'UTC', 125)
+    now = datetime(2024, 3, 1, 10, 1, 0, tzinfo=utc)
+
+    plain_times, smeared_times = [], []
+    plain_time = smeared_time = None
+    for _ in range(3):
+        plain_time = plain.get_next_fire_time(plain_time, plain_time or now)
+        smeared_time = smeared.get_next_fire_time(smeared_time, smeared_time or now)
+        plain_times.append(plain_time)
+        smeared_times.append(smeared_time)
+
+    # 10:02:05仍在10:00这一次的偏移之后，周期不变
+    assert smeared_times[0] == datetime(2024, 3, 1, 10, 2, 5, tzinfo=utc)
+    assert plain_times[0] == datetime(2024, 3, 1, 11, 0, 0, tzinfo=utc)
+    assert [b - a for a, b in zip(smeared_times, smeared_times[1:])] == [timedelta(hours=1)] * 2
+
+
+def fire_histogram(scheduler, job_store, seconds: int = 60):
+    scheduler_mgt = SchedulerMgt.__new__(SchedulerMgt)
+    scheduler_mgt.scheduler = scheduler
+    scheduler_mgt.job_store = job_store
+    scheduler_mgt.timezone = utc
+    return scheduler_mgt.get_fire_histogram(seconds)
+
+
+@pytest.mark.parametrize('window, max_peak', [(0, 60), (60, 10)])
+def test_fire_histogram_counts_each_firing(make_scheduler, window, max_peak):
+    scheduler, job_store = make_scheduler()
+    for i in range(60):
+        job_id = f'job-{i}'
+        trigger = CronFiledTrigger('0 * * * * *', 'UTC', smear_offset(job_id, window))
+        scheduler.add_job(start_job_by_api, trigger, id=job_id, kwargs={'api_call_str': 'orderApi:create'})
+
+    result = fire_histogram(scheduler, job_store)
+    assert result['seconds'] == 60 and len(result['histogram']) == 60
+    # 每分钟执行一次的job在60秒内各执行一次
+    assert result['total'] == 60
+    if window:
+        assert result['peak'] <= max_peak
+    else:
+        assert result['peak'] == max_peak
+    assert result['histogram'][result['peak_second']] == result['peak']
+
+    with pytest.raises(ValueError):
+        fire_histogram(scheduler, job_store, SchedulerMgt.MAX_HISTOGRAM_SECONDS + 1)
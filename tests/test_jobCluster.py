@@ -0,0 +1,67 @@
+import json
+from datetime import datetime, timedelta
+
+import fakeredis
+from apscheduler.util import utc
+
+from app.jobs.jobs import start_job_by_api
+from app.services.jobCluster import JobCluster
+
+
+def add_due_job(scheduler, job_id: str, seconds_ago: int = 1):
+    return scheduler.add_job(start_job_by_api, 'interval', seconds=60, id=job_id,
+                             kwargs={'api_call_str': 'orderApi:create'},
+                             next_run_time=datetime.now(utc) - timedelta(seconds=seconds_ago))
+
+
+def test_each_firing_runs_on_one_node(make_scheduler):
+    scheduler, store_a = make_scheduler()
+    _, store_b = make_scheduler()
+    store_a.enable_cluster('node-a', lock_ttl=60, lock_retry=0.5)
+    store_b.enable_cluster('node-b', lock_ttl=60, lock_retry=0.5)
+    add_due_job(scheduler, 'job')
+
+    now = datetime.now(utc)
+    assert [job.id for job in store_a.get_due_jobs(now)] == ['job']
+    assert store_b.get_due_jobs(now) == []
+    # 同一次执行再次检查仍被锁定(锁的值为抢到锁的节点)
+    assert store_a.get_due_jobs(now) == []
+    run_time = store_a.redis.zscore(store_a.run_times_key, 'job')
+    assert store_a.redis.get(store_a._lock_key('job', run_time)) == b'node-a'
+
+
+def test_next_firing_is_locked_separately(make_scheduler):
+    scheduler, store_a = make_scheduler()
+    _, store_b = make_scheduler()
+    store_a.enable_cluster('node-a', lock_ttl=60, lock_retry=0.5)
+    store_b.enable_cluster('node-b', lock_ttl=60, lock_retry=0.5)
+    job = add_due_job(scheduler, 'job', seconds_ago=5)
+    assert store_a.get_due_jobs(datetime.now(utc))
+
+    # 抢到锁的节点更新下次执行时间后，新的一次执行使用新的锁
+    job.next_run_time = datetime.now(utc) - timedelta(seconds=1)
+    store_a.update_job(job)
+    assert [job.id for job in store_b.get_due_jobs(datetime.now(utc))] == ['job']
+
+
+def test_locked_due_job_delays_next_wakeup(make_scheduler):
+    scheduler, store_a = make_scheduler()
+    _, store_b = make_scheduler()
+    store_a.enable_cluster('node-a', lock_ttl=60, lock_retry=0.5)
+    store_b.enable_cluster('node-b', lock_ttl=60, lock_retry=0.5)
+    add_due_job(scheduler, 'job')
+    store_a.get_due_jobs(datetime.now(utc))
+
+    # 到期job已被其它节点锁定：不立即重试，等lock_retry后再检查
+    t_start = datetime.now(utc)
+    next_run_time = store_b.get_next_run_time()
+    assert t_start + timedelta(seconds=0.4) <= next_run_time <= datetime.now(utc) + timedelta(seconds=0.5)
+
+
+def test_cluster_ignores_own_messages(redis_server):
+    changes = []
+    cluster = JobCluster(fakeredis.FakeRedis(server=redis_server), 'changes', changes.append)
+    cluster._handle_message({'data': json.dumps({'node': cluster.node_id, 'job_ids': ['a']})})
+    cluster._handle_message({'data': json.dumps({'node': 'other', 'job_ids': ['b']})})
+    cluster._handle_message({'data': json.dumps({'node': 'other', 'job_ids': None})})
+    assert changes == [['b'], None]
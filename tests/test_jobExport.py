@@ -0,0 +1,75 @@
+import asyncio
+import json
+import logging
+from types import SimpleNamespace
+
+from apscheduler.util import utc
+
+from app.apis.jobAPI import JobAPI
+from app.jobs.jobs import start_job_by_api
+from app.services.schedulerMgt import SchedulerMgt
+
+
+def add_api_job(scheduler, job_id: str, seconds: int = 10):
+    return scheduler.add_job(start_job_by_api, 'interval', seconds=seconds, id=job_id,
+                             kwargs={'api_call_str': 'orderApi:create', 'api_para': {'id': job_id}})
+
+
+def export_mgt(job_store):
+    scheduler_mgt = SchedulerMgt.__new__(SchedulerMgt)
+    scheduler_mgt.job_store = job_store
+    scheduler_mgt.timezone = utc
+    scheduler_mgt.log = logging.getLogger('test.export')
+    return scheduler_mgt
+
+
+def test_iter_job_views_in_id_order_across_batches(make_scheduler):
+    scheduler, job_store = make_scheduler()
+    for job_id in ('e', 'b', 'd', 'a', 'c'):
+        add_api_job(scheduler, job_id)
+    scheduler.pause_job('c')
+    # 升级前没有展示信息的job在导出时补写
+    job_store.redis.hdel(job_store.views_key, 'd')
+
+    rows = list(job_store.iter_job_views(batch_size=2))
+    assert [view['id'] for view, _ in rows] == ['a', 'b', 'c', 'd', 'e']
+    assert [run_time is None for _, run_time in rows] == [False, False, True, False, False]
+    assert rows[3][0]['kwargs']['api_para'] == {'id': 'd'}
+    assert job_store.redis.hexists(job_store.views_key, 'd')
+
+
+def test_jobs_changed_during_export(make_scheduler):
+    scheduler, job_store = make_scheduler()
+    for job_id in ('a', 'b', 'c', 'd'):
+        add_api_job(scheduler, job_id)
+
+    exported = []
+    for view, _ in job_store.iter_job_views(batch_size=2):
+        exported.append(view['id'])
+        if view['id'] == 'a':
+            # 游标之后新增的job会导出，尚未读到就删除的job不再导出
+            add_api_job(scheduler, 'bb')
+            scheduler.remove_job('d')
+    assert exported == ['a', 'b', 'bb', 'c']
+
+
+def test_export_api_streams_ndjson(make_scheduler):
+    scheduler, job_store = make_scheduler()
+    for i in range(3):
+        add_api_job(scheduler, f'job-{i}', 10 + i)
+    scheduler.pause_job('job-1')
+
+    job_api = SimpleNamespace(scheduler_mgt=export_mgt(job_store), _endpoint_log=lambda endpoint: logging.getLogger(
+        f'test.{endpoint}'))
+    response = asyncio.run(JobAPI.export_jobs_api(job_api, auth='test'))
+    assert response.media_type == 'application/x-ndjson'
+    assert 'jobs.ndjson' in response.headers['content-disposition']
+
+    async def read_body():
+        return ''.join([chunk async for chunk in response.body_iterator])
+
+    lines = asyncio.run(read_body()).splitlines()
+    jobs = [json.loads(line) for line in lines]
+    assert [job['id'] for job in jobs] == ['job-0', 'job-1', 'job-2']
+    assert jobs[1]['next_run_time'] == 'paused'
+    assert jobs[0]['func'] == 'start_job_by_api' and jobs[0]['kwargs']['api_call_str'] == 'orderApi:create'
@@ -0,0 +1,55 @@
+import time
+
+import fakeredis
+
+from app.services.jobLeader import JobLeader
+
+
+def make_leader(redis_server, changes: list = None, ttl: float = 1):
+    redis = fakeredis.FakeRedis(server=redis_server)
+    return JobLeader(redis, 'leader', ttl, changes.append if changes is not None else None)
+
+
+def test_only_one_process_is_elected(redis_server):
+    changes_a, changes_b = [], []
+    leader_a = make_leader(redis_server, changes_a)
+    leader_b = make_leader(redis_server, changes_b)
+
+    assert leader_a.check()
+    assert not leader_b.check()
+    # 续约后仍是同一个进程
+    assert leader_a.check() and not leader_b.check()
+    assert changes_a == [True] and changes_b == []
+
+
+def test_stop_releases_lease(redis_server):
+    changes_b = []
+    leader_a = make_leader(redis_server)
+    leader_b = make_leader(redis_server, changes_b, ttl=0.3)
+    assert leader_a.check()
+    leader_a.start()
+    leader_b.check()
+    leader_b.start()
+    try:
+        leader_a.stop()
+        assert not leader_a.is_leader
+        for _ in range(50):
+            if leader_b.is_leader:
+                break
+            time.sleep(0.02)
+        assert changes_b == [True]
+    finally:
+        leader_b.stop()
+
+
+def test_takeover_after_lease_expires(redis_server):
+    changes_a = []
+    leader_a = make_leader(redis_server, changes_a, ttl=0.1)
+    leader_b = make_leader(redis_server, ttl=0.1)
+    assert leader_a.check()
+
+    # 持有者失联(不再续约)：租约过期后被接管，原持有者下次续约时得知已失去租约
+    time.sleep(0.15)
+    assert leader_b.check()
+    assert not leader_a.check()
+    assert changes_a == [True, False]
@@ -0,0 +1,111 @@
+import logging
+import time
+
+import fakeredis
+from apscheduler.schedulers.base import STATE_PAUSED
+from apscheduler.util import utc
+
+from app.jobs.jobs import start_job_by_api
+from app.services.jobStore import JobRedisStore
+from app.services.schedulerMgt import SchedulerMgt
+
+CHANNEL = 'test.store'
+
+
+def add_api_job(scheduler, job_id: str, seconds: int = 10):
+    return scheduler.add_job(start_job_by_api, 'interval', seconds=seconds, id=job_id,
+                             kwargs={'api_call_str': 'orderApi:create', 'api_para': {'id': job_id}})
+
+
+def tiered_scheduler(make_scheduler):
+    scheduler, job_store = make_scheduler()
+    job_store.enable_memory_tier(CHANNEL, check_interval=0.1)
+    return scheduler, job_store
+
+
+def wait_until(predicate, timeout: float = 2):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_changes_reach_other_processes(make_scheduler):
+    scheduler_a, store_a = tiered_scheduler(make_scheduler)
+    scheduler_b, store_b = tiered_scheduler(make_scheduler)
+    try:
+        add_api_job(scheduler_a, 'a')
+        assert store_a.memory_tier.lookup_job('a') is not None
+        assert wait_until(lambda: store_b.memory_tier.lookup_job('a') is not None)
+
+        scheduler_a.pause_job('a')
+        assert wait_until(lambda: store_b.memory_tier.get_run_times(['a']) == [None])
+        assert store_b.lookup_job('a').next_run_time is None
+
+        scheduler_b.remove_job('a')
+        assert wait_until(lambda: store_a.memory_tier.count() == 0)
+        assert store_a.lookup_job('a') is None
+    finally:
+        store_a.memory_tier.stop()
+        store_b.memory_tier.stop()
+
+
+def test_missed_changes_are_reloaded(make_scheduler, redis_server):
+    scheduler, job_store = tiered_scheduler(make_scheduler)
+    # 未开启副本的进程写入时不广播，版本号检查发现后全量重新加载
+    plain_store = JobRedisStore()
+    plain_store.redis = fakeredis.FakeRedis(server=redis_server)
+    plain_store._scheduler = scheduler
+    plain_store._alias = 'default'
+    try:
+        job = add_api_job(scheduler, 'a')
+        job._jobstore_alias = 'default'
+        job.id = 'b'
+        plain_store.add_job(job)
+        assert wait_until(lambda: job_store.memory_tier.lookup_job('b') is not None)
+        assert [job.id for job in job_store.get_all_jobs()] == ['a', 'b']
+    finally:
+        job_store.memory_tier.stop()
+
+
+def test_older_change_does_not_overwrite_newer(make_scheduler):
+    scheduler, job_store = tiered_scheduler(make_scheduler)
+    tier = job_store.memory_tier
+    try:
+        job = add_api_job(scheduler, 'a')
+        version = job_store.get_version()
+        tier.apply(version + 2, removed_ids=['a'])
+        # 晚到的旧版本变更被忽略
+        tier.apply(version + 1, jobs=[job])
+        assert tier.lookup_job('a') is None
+    finally:
+        tier.stop()
+
+
+def test_restart_scheduler_restarts_memory_tier(make_scheduler):
+    scheduler, job_store = tiered_scheduler(make_scheduler)
+    writer, _ = make_scheduler()
+    scheduler_mgt = SchedulerMgt.__new__(SchedulerMgt)
+    scheduler_mgt.scheduler = scheduler
+    scheduler_mgt.job_store = job_store
+    scheduler_mgt.timezone = utc
+    scheduler_mgt.scheduler_host = False
+    scheduler_mgt.log = logging.getLogger('test.memory_tier')
+    try:
+        add_api_job(scheduler, 'a')
+        scheduler_mgt.stop_scheduler()
+        assert not job_store.memory_tier.ready
+
+        # 停止期间其它进程的变更在重新启动时加载
+        add_api_job(writer, 'b')
+        scheduler_mgt.start_scheduler()
+        assert job_store.memory_tier.ready
+        assert scheduler.state == STATE_PAUSED
+        assert sorted(job.id for job in job_store.get_all_jobs()) == ['a', 'b']
+
+        add_api_job(writer, 'c')
+        assert wait_until(lambda: job_store.memory_tier.lookup_job('c') is not None)
+    finally:
+        job_store.memory_tier.stop()
@@ -0,0 +1,62 @@
+import pickle
+
+import pytz
+
+from app.jobs.jobs import start_job_by_api
+from app.services.cronCompiled import CompiledCronTrigger
+from app.services.cronFiled import CronFiledTrigger
+from app.services.jobSerializer import JobSerializer, CompactJobSerializer
+
+FUNCTION_MAP = {'start_job_by_api': start_job_by_api}
+KWARGS = {'api_call_str': 'orderApi:create', 'api_para': {'id': 1}}
+
+
+def add_cron_job(scheduler, job_id: str, trigger):
+    return scheduler.add_job(start_job_by_api, trigger, id=job_id, kwargs=KWARGS)
+
+
+def test_compact_round_trip(make_scheduler):
+    scheduler, _ = make_scheduler()
+    serializer = CompactJobSerializer(FUNCTION_MAP)
+    for job_id, trigger in (('cron', CronFiledTrigger('0 0/5 * * * *', pytz.utc, offset=3)),
+                            ('quartz', CompiledCronTrigger('0 0 12 L * ?', pytz.utc))):
+        state = add_cron_job(scheduler, job_id, trigger).__getstate__()
+        data = serializer.dumps(state)
+        assert data[:2] == JobSerializer.MAGIC + JobSerializer.CODEC_MSGPACK
+        assert len(data) < len(pickle.dumps(state))
+
+        loaded = serializer.loads(data)
+        assert loaded['func'] == state['func']
+        assert loaded['kwargs'] == KWARGS
+        assert loaded['next_run_time'] == state['next_run_time']
+        assert type(loaded['trigger']) is type(trigger)
+        assert loaded['trigger'].cron_str == trigger.cron_str
+        assert loaded['trigger'].offset == trigger.offset
+
+
+def test_unsupported_trigger_falls_back_to_pickle(make_scheduler):
+    scheduler, _ = make_scheduler()
+    state = scheduler.add_job(start_job_by_api, 'interval', seconds=10, id='interval', kwargs=KWARGS).__getstate__()
+    serializer = CompactJobSerializer(FUNCTION_MAP)
+    data = serializer.dumps(state)
+    assert not serializer.is_current(data)
+    assert serializer.loads(data)['trigger'].interval == state['trigger'].interval
+
+
+def test_migrate_pickled_jobs(make_scheduler):
+    # 先以pickle写入，再切换为紧凑格式并迁移
+    scheduler, job_store = make_scheduler(JobSerializer(FUNCTION_MAP))
+    for i in range(3):
+        add_cron_job(scheduler, f'job-{i}', CronFiledTrigger(f'0 {i} * * * *', pytz.utc))
+    scheduler.add_job(start_job_by_api, 'interval', seconds=10, id='interval', kwargs=KWARGS)
+
+    job_store.serializer = CompactJobSerializer(FUNCTION_MAP)
+    # 切换后未迁移的pickle数据仍可读取
+    assert sorted(job.id for job in job_store.get_all_jobs()) == ['interval', 'job-0', 'job-1', 'job-2']
+
+    assert job_store.migrate_jobs() == 3
+    assert job_store.migrate_jobs() == 0
+    states = dict(job_store.redis.hgetall(job_store.jobs_key))
+    assert all(job_store.serializer.is_current(states[f'job-{i}'.encode()]) for i in range(3))
+    assert {job.id: job.trigger.cron_str for job in job_store.lookup_jobs(['job-0', 'job-2'])} == \
+        {'job-0': '0 0 * * * *', 'job-2': '0 2 * * * *'}
@@ -0,0 +1,110 @@
+from datetime import datetime
+
+import pytest
+from apscheduler.util import utc
+
+from app.services.cronSmear import smear_offset
+from app.services.jobSimulator import JobSimulator
+
+START = datetime(2024, 3, 1, tzinfo=utc)
+
+
+def api_job(name: str, cron: str, api_name: str = 'orderApi', smear=False):
+    return {'name': name, 'cron': cron, 'func': 'start_job_by_api', 'smear': smear,
+            'para': {'api_call_str': f'{api_name}:create'}}
+
+
+def composite_job(name: str, cron: str, *api_names: str):
+    return {'name': name, 'cron': cron, 'func': 'start_jobs_by_api', 'smear': False,
+            'para': {'calls': [{'id': str(i), 'api_call_str': f'{api_name}:create'}
+                               for i, api_name in enumerate(api_names)]}}
+
+
+def test_hourly_jobs_over_a_day():
+    simulator = JobSimulator(utc)
+    simulator.add_jobs([api_job('a', '0 0 * * * *'), api_job('b', '0 0 * * * *'),
+                        api_job('c', '30 0 0/6 * * *', 'userApi')])
+
+    result = simulator.simulate(START, 86400, resolution=3600)
+    assert result['jobs'] == 3
+    assert result['fires'] == 24 * 2 + 4
+    assert result['peak'] == {'fires': 2, 'time': '2024-03-01 00:00:00'}
+    assert len(result['histogram']) == 24
+    assert result['histogram'][:7] == [3, 2, 2, 2, 2, 2, 3]
+
+    assert result['apis']['orderApi']['jobs'] == 2
+    assert result['apis']['orderApi']['fires'] == 48
+    assert result['apis']['orderApi']['histogram'] == [2] * 24
+    assert result['apis']['userApi']['fires'] == 4
+    assert result['apis']['userApi']['peak_bucket'] == {'fires': 1, 'time': '2024-03-01 00:00:00'}
+
+
+def test_smeared_jobs_fall_into_offset_seconds():
+    simulator = JobSimulator(utc, default_smear_window=60)
+    names = [f'job-{i}' for i in range(120)]
+    simulator.add_jobs([api_job(name, '0 * * * * *', smear=True) for name in names])
+
+    result = simulator.simulate(START, 3600, resolution=1, window=60, top=3)
+    assert result['fires'] == 120 * 60
+    # 每分钟的分布相同，峰值为同一偏移秒的job数
+    offsets = [smear_offset(name, 60) for name in names]
+    assert result['peak']['fires'] == max(offsets.count(second) for second in range(60))
+    assert result['histogram'][:60] == [offsets.count(second) for second in range(60)]
+    assert result['apis']['orderApi']['histogram'] == result['histogram']
+    assert [window['fires'] for window in result['busiest_windows']] == [120] * 3
+
+
+def test_window_cuts_partial_buckets():
+    simulator = JobSimulator(utc)
+    simulator.add_jobs([api_job('a', '* * * * * *')])
+
+    # 从00:00:30开始，桶按开始时间对齐，最后一个桶不满
+    result = simulator.simulate(datetime(2024, 3, 1, 0, 0, 30, tzinfo=utc), 150, resolution=60)
+    assert result['histogram'] == [60, 60, 30]
+    assert result['apis']['orderApi']['histogram'] == [60, 60, 30]
+
+
+def test_composite_job_counts_each_downstream():
+    simulator = JobSimulator(utc)
+    simulator.add_jobs([composite_job('flow', '0 0 * * * *', 'userApi', 'orderApi', 'orderApi'),
+                        api_job('single', '0 0 * * * *')])
+
+    result = simulator.simulate(START, 3600, resolution=60)
+    # 全局为job的执行次数，按下游为请求次数
+    assert result['fires'] == 2
+    assert result['apis']['userApi'] == dict(result['apis']['userApi'], jobs=1, fires=1)
+    assert result['apis']['orderApi'] == dict(result['apis']['orderApi'], jobs=2, fires=3)
+    assert 'start_jobs_by_api' not in result['apis']
+    # 同一秒4个下游请求
+    assert result['peak_concurrency'] == {'running': 4, 'time': '2024-03-01 00:00:00'}
+
+
+def test_durations_spread_running_requests():
+    simulator = JobSimulator(utc)
+    simulator.add_jobs([api_job('a', '0 * * * * *'), api_job('b', '30 * * * * *', 'userApi')])
+
+    result = simulator.simulate(START, 600, durations={'orderApi': 40})
+    # orderApi的请求持续40秒，与30秒时的userApi请求重叠
+    assert result['peak']['fires'] == 1
+    assert result['peak_concurrency']['running'] == 2
+    assert result['peak_concurrency']['time'] == '2024-03-01 00:00:30'
+
+
+def test_paused_views_are_skipped():
+    simulator = JobSimulator(utc)
+    views = [({'id': 'a', 'trigger': '0 0 * * * *', 'func': 'start_job_by_api',
+               'kwargs': {'api_call_str': 'orderApi:create'}}, START),
+             ({'id': 'b', 'trigger': '0 0 * * * *', 'func': 'start_job_by_api',
+               'kwargs': {'api_call_str': 'orderApi:create'}}, None)]
+    assert simulator.add_views(views) == 1
+
+    result = simulator.simulate(START, 86400)
+    assert result['apis']['orderApi']['fires'] == 24
+
+
+def test_invalid_arguments():
+    simulator = JobSimulator(utc)
+    with pytest.raises(ValueError):
+        simulator.simulate(START, JobSimulator.MAX_SECONDS + 1)
+    with pytest.raises(ValueError):
+        simulator.simulate(START, 60, resolution=0)
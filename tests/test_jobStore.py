@@ -0,0 +1,153 @@
+import pytest
+from apscheduler.jobstores.base import ConflictingIdError, JobLookupError
+
+from app.jobs.jobs import start_job_by_api, start_jobs_by_api
+
+
+def add_api_job(scheduler, job_id: str, seconds: int, api_call_str: str = 'orderApi:create'):
+    return scheduler.add_job(start_job_by_api, 'interval', seconds=seconds, id=job_id,
+                             kwargs={'api_call_str': api_call_str})
+
+
+def page_ids(job_store, offset: int, limit: int, sort_by: str = None):
+    return [view['id'] for view, _ in job_store.get_job_views_page(offset, limit, sort_by)]
+
+
+def test_page_by_next_run_time_puts_paused_jobs_last(make_scheduler):
+    scheduler, job_store = make_scheduler()
+    for i in range(6):
+        add_api_job(scheduler, f'job-{i}', 10 + i)
+    scheduler.pause_job('job-4')
+    scheduler.pause_job('job-1')
+
+    assert page_ids(job_store, 0, 10) == ['job-0', 'job-2', 'job-3', 'job-5', 'job-1', 'job-4']
+    # 跨越有下次执行时间的job和暂停的job的一页，以及不满的最后一页
+    assert page_ids(job_store, 3, 2) == ['job-5', 'job-1']
+    assert page_ids(job_store, 5, 10) == ['job-4']
+    assert page_ids(job_store, 6, 10) == []
+
+
+def test_page_by_id(make_scheduler):
+    scheduler, job_store = make_scheduler()
+    for job_id in ('c', 'a', 'd', 'b'):
+        add_api_job(scheduler, job_id, 10)
+    scheduler.pause_job('b')
+
+    assert page_ids(job_store, 1, 2, 'id') == ['b', 'c']
+    assert [run_time is None for _, run_time in job_store.get_job_views_page(0, 4, 'id')] == \
+        [False, True, False, False]
+
+
+def test_resume_and_remove_update_paused_index(make_scheduler):
+    scheduler, job_store = make_scheduler()
+    add_api_job(scheduler, 'a', 10)
+    add_api_job(scheduler, 'b', 20)
+    scheduler.pause_job('a')
+    assert job_store.find_job_views_page(0, 10, paused=True)[0] == 1
+
+    scheduler.resume_job('a')
+    scheduler.pause_job('b')
+    count, rows = job_store.find_job_views_page(0, 10, paused=True)
+    assert count == 1 and rows[0][0]['id'] == 'b'
+
+    scheduler.remove_job('b')
+    assert job_store.find_job_views_page(0, 10, paused=True)[0] == 0
+    assert page_ids(job_store, 0, 10) == ['a']
+
+
+def test_find_by_api_and_paused(make_scheduler):
+    scheduler, job_store = make_scheduler()
+    add_api_job(scheduler, 'order-1', 10)
+    add_api_job(scheduler, 'order-2', 20)
+    add_api_job(scheduler, 'user-1', 30, 'userApi:get')
+    scheduler.add_job(start_jobs_by_api, 'interval', seconds=40, id='combo',
+                      kwargs={'calls': [{'api_call_str': 'userApi:get'}]})
+    scheduler.pause_job('order-2')
+
+    count, rows = job_store.find_job_views_page(0, 10, api_name='orderApi', paused=True)
+    assert count == 1 and rows[0][0]['id'] == 'order-2'
+    count, rows = job_store.find_job_views_page(0, 10, api_name='userApi', api_method='get')
+    assert [view['id'] for view, _ in rows] == ['user-1', 'combo']
+    count, rows = job_store.find_job_views_page(0, 10, name_prefix='order', paused=False)
+    assert [view['id'] for view, _ in rows] == ['order-1']
+
+
+def test_view_changes_are_compared_with_redis(make_scheduler):
+    # 两个进程共用Redis，没有集群通知：一个进程的旧缓存不能使另一个进程的修改被跳过
+    scheduler_a, store_a = make_scheduler()
+    scheduler_b, store_b = make_scheduler()
+    add_api_job(scheduler_a, 'job', 10)
+    assert store_b.get_job_view('job')[0]['kwargs']['api_call_str'] == 'orderApi:create'
+
+    scheduler_a.modify_job('job', kwargs={'api_call_str': 'userApi:get'})
+    scheduler_b.modify_job('job', kwargs={'api_call_str': 'orderApi:create'})
+
+    assert store_a.get_job_view('job')[0]['kwargs']['api_call_str'] == 'orderApi:create'
+    assert store_a.find_job_views_page(0, 10, api_name='orderApi')[0] == 1
+    assert store_a.find_job_views_page(0, 10, api_name='userApi')[0] == 0
+
+
+def test_update_job_is_one_round_trip(make_scheduler, monkeypatch):
+    scheduler, job_store = make_scheduler()
+    job = add_api_job(scheduler, 'job', 10)
+    commands = []
+    execute_command = job_store.redis.execute_command
+    monkeypatch.setattr(job_store.redis, 'execute_command',
+                        lambda *args, **kwargs: commands.append(args[0]) or execute_command(*args, **kwargs))
+
+    job_store.update_job(job)
+    assert commands == ['EVAL']
+
+    job_store.remove_job('job')
+    with pytest.raises(JobLookupError):
+        job_store.update_job(job)
+    assert job_store.lookup_job('job') is None
+
+
+def test_add_existing_job_conflicts(make_scheduler):
+    scheduler, job_store = make_scheduler()
+    job = add_api_job(scheduler, 'job', 10)
+    version = job_store.get_version()
+    with pytest.raises(ConflictingIdError):
+        job_store.add_job(job)
+    assert job_store.get_version() == version
+
+
+def test_rebuilt_indexes_follow_later_changes(make_scheduler):
+    scheduler, job_store = make_scheduler()
+    add_api_job(scheduler, 'job', 10)
+    job_store.redis.delete(job_store.index_version_key)
+    assert job_store.ensure_indexes()
+
+    scheduler.modify_job('job', kwargs={'api_call_str': 'userApi:get'})
+    assert job_store.find_job_views_page(0, 10, api_name='orderApi')[0] == 0
+    assert job_store.find_job_views_page(0, 10, api_name='userApi', api_method='get')[0] == 1
+
+    scheduler.remove_job('job')
+    assert job_store.find_job_views_page(0, 10, api_name='userApi')[0] == 0
+
+
+def test_single_index_filters_page_in_redis(make_scheduler):
+    scheduler, job_store = make_scheduler()
+    for i in range(8):
+        add_api_job(scheduler, f'job-{i}', 10 + i)
+    for job_id in ('job-6', 'job-1', 'job-3'):
+        scheduler.pause_job(job_id)
+
+    def ids(rows):
+        return [view['id'] for view, _ in rows]
+
+    count, rows = job_store.find_job_views_page(1, 2, paused=True)
+    assert count == 3 and ids(rows) == ['job-3', 'job-6']
+    count, rows = job_store.find_job_views_page(1, 1, paused=True, name_prefix='job-')
+    assert count == 3 and ids(rows) == ['job-3']
+    count, rows = job_store.find_job_views_page(1, 2, paused=False)
+    assert count == 5 and ids(rows) == ['job-2', 'job-4']
+    run_times = [run_time for _, run_time in job_store.find_job_views_page(0, 10, paused=False)[1]]
+    count, rows = job_store.find_job_views_page(0, 10, run_time_min=run_times[1], run_time_max=run_times[3])
+    assert count == 3 and ids(rows) == ['job-2', 'job-4', 'job-5']
+    count, rows = job_store.find_job_views_page(2, 3, 'id', name_prefix='job-')
+    assert count == 8 and ids(rows) == ['job-2', 'job-3', 'job-4']
+    assert rows[1][1] is None and rows[0][1] is not None
+    # 超出范围的一页
+    assert job_store.find_job_views_page(10, 2, paused=False) == (5, [])
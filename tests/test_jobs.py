@@ -0,0 +1,116 @@
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+from app.jobs import jobs
+from app.jobs.jobs import JobRunError, check_api_calls, start_jobs_by_api
+from app.requests import request_engine
+
+
+class FakeDownstream(object):
+    """
+    按api名称返回固定响应，记录每个请求的开始、结束顺序；slowApi较慢，failApi失败。
+    """
+    def __init__(self):
+        self.events = []
+        self._lock = threading.Lock()
+
+    def __call__(self, api_name, api_method_name, params):
+        self._record('start', api_name, params)
+        if api_name == 'slowApi':
+            time.sleep(0.05)
+        if api_name == 'failApi':
+            self._record('end', api_name, params)
+            raise RuntimeError('downstream failed')
+        self._record('end', api_name, params)
+        return {'data': {'id': 7, 'items': [{'sku': 'a'}, {'sku': 'b'}]}, 'params': params}
+
+    def _record(self, event: str, api_name: str, params: dict):
+        with self._lock:
+            self.events.append((event, api_name, params))
+
+    def index(self, event: str, api_name: str):
+        return [(e, name) for e, name, _ in self.events].index((event, api_name))
+
+
+@pytest.fixture
+def downstream(monkeypatch):
+    fake = FakeDownstream()
+    monkeypatch.setattr(request_engine, 'request_func', fake)
+    monkeypatch.setattr(jobs.job_cfg, 'request_async', False)
+    return fake
+
+
+def test_calls_run_in_dependency_order(downstream):
+    result = start_jobs_by_api([
+        {'id': 'order', 'api_call_str': 'orderApi:create', 'after': ['user', 'stock']},
+        {'id': 'user', 'api_call_str': 'slowApi:get'},
+        {'id': 'stock', 'api_call_str': 'stockApi:get'},
+    ])
+    assert result['calls'].keys() == {'user', 'stock', 'order'}
+    assert all(call['status'] == 'ok' for call in result['calls'].values())
+    # 互不依赖的请求并发执行，依赖的请求在上游结束后才开始
+    assert downstream.index('start', 'stockApi') < downstream.index('end', 'slowApi')
+    assert downstream.index('start', 'orderApi') > downstream.index('end', 'slowApi')
+    assert downstream.index('start', 'orderApi') > downstream.index('end', 'stockApi')
+
+
+def test_inputs_pass_upstream_fields(downstream):
+    result = start_jobs_by_api([
+        {'id': 'user', 'api_call_str': 'slowApi:get'},
+        {'id': 'order', 'api_call_str': 'orderApi:create', 'api_para': {'userId': 0, 'count': 2},
+         'inputs': {'userId': 'user.data.id', 'sku': 'user.data.items.1.sku'}},
+    ])
+    assert result['calls']['order']['status'] == 'ok'
+    # inputs中的上游自动作为依赖，覆盖api_para中的同名参数
+    order_params = [params for event, name, params in downstream.events if (event, name) == ('start', 'orderApi')]
+    assert order_params == [{'userId': 7, 'count': 2, 'sku': 'b'}]
+    assert downstream.index('start', 'orderApi') > downstream.index('end', 'slowApi')
+
+
+def test_failed_call_skips_dependents(downstream):
+    with pytest.raises(JobRunError) as exc_info:
+        start_jobs_by_api([
+            {'id': 'pay', 'api_call_str': 'failApi:pay'},
+            {'id': 'notify', 'api_call_str': 'orderApi:notify', 'inputs': {'payId': 'pay.data.id'}},
+            {'id': 'stock', 'api_call_str': 'stockApi:get'},
+        ])
+    calls = exc_info.value.result['calls']
+    assert calls['pay']['status'] == 'error'
+    assert calls['notify'] == {'status': 'skipped', 'error': "dependency failed: ['pay']"}
+    # 不依赖失败请求的照常执行
+    assert calls['stock']['status'] == 'ok'
+    assert ('start', 'orderApi') not in [(event, name) for event, name, _ in downstream.events]
+
+
+@pytest.mark.parametrize('calls, message', [
+    ([], 'non-empty'),
+    ([{'id': 'a', 'api_call_str': 'orderApi'}], 'api_call_str'),
+    ([{'id': 'a', 'api_call_str': 'orderApi:m'}, {'id': 'a', 'api_call_str': 'orderApi:m'}], 'duplicate'),
+    ([{'id': 'a', 'api_call_str': 'orderApi:m', 'inputs': {'x': 'b.data'}}], 'unknown'),
+    ([{'id': 'a', 'api_call_str': 'orderApi:m', 'after': ['b']},
+      {'id': 'b', 'api_call_str': 'orderApi:m', 'after': ['a']}], 'cycle'),
+])
+def test_check_api_calls_rejects_invalid(calls, message):
+    with pytest.raises(ValueError, match=message):
+        check_api_calls({'calls': calls})
+
+
+def composite_job_in_child():
+    return start_jobs_by_api([
+        {'id': 'user', 'api_call_str': 'slowApi:get'},
+        {'id': 'order', 'api_call_str': 'orderApi:create', 'inputs': {'userId': 'user.data.id'}},
+    ])
+
+
+def test_composite_job_in_process_pool(downstream):
+    # 父进程已启动引擎的事件循环线程，子进程中重新创建(见AsyncRequestEngine._after_fork)，等待结果不会一直阻塞
+    assert request_engine.submit(request_engine.request('orderApi', 'create', {'i': 0}, 1)).result(2)['params'] == {
+        'i': 0}
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('fork')) as pool:
+        result = pool.submit(composite_job_in_child).result(10)
+    assert result['calls'] == {'user': dict(result['calls']['user'], status='ok'),
+                               'order': dict(result['calls']['order'], status='ok')}
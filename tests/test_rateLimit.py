@@ -0,0 +1,97 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.requests.rateLimit import DownstreamLimiter, RequestLimiters, RequestRejected
+
+
+def test_sync_and_async_share_concurrency():
+    limiter = DownstreamLimiter('orderApi', max_concurrency=2)
+    lock = threading.Lock()
+    running = [0, 0]
+
+    def work():
+        with lock:
+            running[0] += 1
+            running[1] = max(running)
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+
+    def sync_call():
+        limiter.acquire(time.monotonic())
+        try:
+            work()
+        finally:
+            limiter.release()
+
+    async def async_call():
+        await limiter.acquire_async(time.monotonic())
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, work)
+        finally:
+            limiter.release()
+
+    async def async_calls():
+        await asyncio.gather(*(async_call() for _ in range(4)))
+
+    threads = [threading.Thread(target=sync_call) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    asyncio.run(async_calls())
+    for thread in threads:
+        thread.join()
+
+    assert running[1] == 2
+    assert limiter.stats() == {'queued': 0, 'in_flight': 0, 'available': 2}
+
+
+def test_wait_timeout_and_queue_full():
+    limiter = DownstreamLimiter('orderApi', max_concurrency=1, max_queue=1, max_wait=0.1)
+    limiter.acquire(time.monotonic())
+
+    with pytest.raises(RequestRejected) as e:
+        asyncio.run(limiter.acquire_async(time.monotonic()))
+    assert e.value.reason == 'timeout'
+
+    waiter = threading.Thread(target=lambda: pytest.raises(RequestRejected, limiter.acquire, time.monotonic()))
+    waiter.start()
+    time.sleep(0.02)
+    with pytest.raises(RequestRejected) as e:
+        limiter.acquire(time.monotonic())
+    assert e.value.reason == 'queue_full'
+    waiter.join()
+
+    limiter.release()
+    assert limiter.stats() == {'queued': 0, 'in_flight': 0, 'available': 1}
+
+
+def test_released_slot_goes_to_waiter():
+    limiter = DownstreamLimiter('orderApi', max_concurrency=1, max_wait=1)
+    limiter.acquire(time.monotonic())
+    acquired = threading.Event()
+
+    def wait():
+        limiter.acquire(time.monotonic())
+        acquired.set()
+
+    thread = threading.Thread(target=wait)
+    thread.start()
+    time.sleep(0.05)
+    assert not acquired.is_set()
+    limiter.release()
+    thread.join()
+    assert acquired.is_set() and limiter.stats()['in_flight'] == 1
+
+
+def test_api_and_server_limiters():
+    limiters = RequestLimiters({'apis': {'orderApi': {'server': 'svc'}, 'userApi': {'server': 'svc'}},
+                                'servers': {'svc': {'max-concurrency': 1}}}, {'default': 5})
+    order, server = limiters.get_limiters('orderApi')
+    assert order.max_concurrency == 5 and server.key == 'server:svc'
+    assert limiters.get_limiters('userApi')[1] is server
+    with limiters.acquire('orderApi'):
+        assert server.stats()['available'] == 0
+    assert server.stats()['available'] == 1
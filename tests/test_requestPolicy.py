@@ -0,0 +1,26 @@
+import pytest
+
+from app.requests.requestPolicy import RequestPolicy, RequestPolicies
+
+
+def test_from_cfg_converts_kebab_case():
+    policy = RequestPolicy.from_cfg({'timeout': 5, 'breaker-failures': 3, 'single-flight': True})
+    assert policy.timeout == 5 and policy.breaker_failures == 3 and policy.single_flight
+
+
+def test_from_cfg_rejects_unknown_keys():
+    with pytest.raises(ValueError) as e:
+        RequestPolicy.from_cfg({'timeout': 5, 'retry': 2})
+    assert 'retry' in str(e.value)
+
+
+def test_policies_are_checked_when_loaded():
+    with pytest.raises(ValueError):
+        RequestPolicies({'apis': {'orderApi': {'breaker-failure': 3}}})
+    with pytest.raises(ValueError):
+        RequestPolicies({'default': {'time-out': 3}})
+
+    policies = RequestPolicies({'default': {'retries': 2}, 'apis': {'orderApi': {'timeout': 5}}})
+    assert policies.get_policy('orderApi').timeout == 5
+    with pytest.raises(ValueError):
+        policies.get_policy('orderApi', {'retires': 1})
@@ -0,0 +1,133 @@
+import asyncio
+import threading
+import time
+
+import fakeredis
+import pytest
+
+from app.requests.requestPolicy import RequestPolicy, RequestTimeout
+from app.requests.singleFlight import SingleFlight, SharedRequestError
+
+POLICY = RequestPolicy(single_flight=True)
+KEY = SingleFlight.key('orderApi:get', {'id': 1})
+
+
+class SlowRequest(object):
+    """
+    计数的慢请求，started在请求发出后置位。
+    """
+    def __init__(self, result='resp', delay: float = 0.3, error: Exception = None):
+        self.result = result
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+        self.started = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        self.started.set()
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def run_in_thread(func):
+    results = []
+    thread = threading.Thread(target=lambda: results.append(func()))
+    thread.start()
+    return thread, results
+
+
+def nodes(redis_server, count: int = 2):
+    return [SingleFlight(redis=fakeredis.FakeRedis(server=redis_server)) for _ in range(count)]
+
+
+def test_key_ignores_parameter_order():
+    assert SingleFlight.key('a:b', {'x': 1, 'y': 2}) == SingleFlight.key('a:b', {'y': 2, 'x': 1})
+    assert SingleFlight.key('a:b', {'x': 1}) != SingleFlight.key('a:b', {'x': 2})
+
+
+def test_local_callers_share_one_request():
+    flight = SingleFlight()
+    request = SlowRequest()
+    threads = [run_in_thread(lambda: flight.run(KEY, POLICY, request)) for _ in range(5)]
+    for thread, _ in threads:
+        thread.join()
+    assert request.calls == 1
+    assert [results for _, results in threads] == [['resp']] * 5
+
+
+def test_nodes_share_result(redis_server):
+    leader, follower = nodes(redis_server)
+    request = SlowRequest()
+    thread, results = run_in_thread(lambda: leader.run(KEY, POLICY, request))
+    request.started.wait()
+
+    async def follow():
+        async def own_request():
+            raise AssertionError('follower should not send the request')
+        return await follower.run_async(KEY, POLICY, own_request)
+
+    assert asyncio.run(follow()) == 'resp'
+    thread.join()
+    assert results == ['resp'] and request.calls == 1
+    assert follower.in_flight([KEY]) == set()
+
+
+def test_leader_error_is_shared(redis_server):
+    leader, follower = nodes(redis_server)
+    request = SlowRequest(error=ValueError('boom'))
+    thread, _ = run_in_thread(lambda: pytest.raises(ValueError, leader.run, KEY, POLICY, request))
+    request.started.wait()
+    with pytest.raises(SharedRequestError):
+        follower.run(KEY, POLICY, SlowRequest())
+    thread.join()
+
+
+def test_unpicklable_result_is_requested_again(redis_server):
+    leader, follower = nodes(redis_server)
+    request = SlowRequest(result=threading.Lock())
+    thread, _ = run_in_thread(lambda: leader.run(KEY, POLICY, request))
+    request.started.wait()
+    assert follower.run(KEY, POLICY, lambda: 'own') == 'own'
+    thread.join()
+
+
+def test_wait_is_bounded_by_timeout(redis_server):
+    leader, follower = nodes(redis_server)
+    request = SlowRequest(delay=0.5)
+    thread, _ = run_in_thread(lambda: leader.run(KEY, POLICY, request))
+    request.started.wait()
+    t_start = time.monotonic()
+    with pytest.raises(RequestTimeout):
+        follower.run(KEY, RequestPolicy(single_flight=True, timeout=0.1), SlowRequest())
+    assert time.monotonic() - t_start < 0.4
+    thread.join()
+
+
+def test_missing_holder_retries_acquire(redis_server):
+    # 抢占时锁恰好被释放(未抢到且读不到持有者)，应重新抢占而不是一直等待
+    flight, = nodes(redis_server, 1)
+    acquire = flight._acquire
+    attempts = []
+
+    def flaky_acquire(key, policy):
+        attempts.append(key)
+        if len(attempts) == 1:
+            return None, False, None
+        return acquire(key, policy)
+
+    flight._acquire = flaky_acquire
+    assert flight.run(KEY, POLICY, lambda: 'resp') == 'resp'
+    assert len(attempts) == 2
+
+
+def test_result_ttl_reuses_result(redis_server):
+    first, second = nodes(redis_server)
+    policy = RequestPolicy(single_flight=True, result_ttl=10)
+    request = SlowRequest(delay=0)
+    assert first.run(KEY, policy, request) == 'resp'
+    assert first.run(KEY, policy, request) == 'resp'
+    assert second.run(KEY, policy, request) == 'resp'
+    assert request.calls == 1